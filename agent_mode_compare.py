@@ -0,0 +1,186 @@
+"""Сравнение режимов агента памяти: two_phase против single_call.
+
+Оба режима прогоняются на одних и тех же записанных ходах (turn_recorder):
+история, реплика и результаты поиска берутся из записи, записи в память —
+без эффекта (ReplayChroma). Вызовы LLM идут на настоящую модель (ключ из
+keys.env) или на FakeOpenAIServer (--fake). Для каждого режима — задержка
+агента p50/p95 и число вызовов LLM; для качества — совпадение флагов,
+действия с памятью и Jaccard по id отобранных записей относительно two_phase.
+
+    python agent_mode_compare.py turn_records.jsonl --limit 50
+    python agent_mode_compare.py turn_records.jsonl --fake --latency planning=0.6,memory=0.8,combined=0.9
+"""
+import argparse
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from turn_recorder import load_turns
+from turn_replay import ReplayChroma
+
+MODES = ("two_phase", "single_call")
+
+
+class CountingClient():
+    """Прокси клиента: считает вызовы LLM по фазам."""
+
+    def __init__(self, client):
+        self._client = client
+        self.calls = {}
+
+    def chat_completion(self, model, messages, schema=None, stream=False, on_delta=None,
+                        stream_field="final_answer", phase="default"):
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        return self._client.chat_completion(model, messages, schema=schema, stream=stream, on_delta=on_delta,
+                                            stream_field=stream_field, phase=phase)
+
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+
+class ActionChroma(ReplayChroma):
+    """ReplayChroma, который запоминает, каким вызовом агент записал память.
+
+    В записи есть только запросы исходного прогона; свежий memory_query фазы 2
+    там не найдётся — тогда отдаётся записанный поиск по самой реплике, а ход
+    помечается как fallback, чтобы такие ходы были видны в отчёте.
+    """
+
+    def load(self, turn):
+        super().load(turn)
+        self.actions = []
+        self.fell_back = False
+
+    def search_memory(self, query, *args, **kwargs):
+        if query in self.results:
+            return self.results[query]
+        self.fell_back = True
+        return self.results.get(self.turn["request"], [])
+
+    def add_records(self, records, *args, **kwargs):
+        self.actions.append("create")
+        return super().add_records(records, *args, **kwargs)
+
+    def upsert_records(self, records, *args, **kwargs):
+        self.actions.append("update")
+        return super().upsert_records(records, *args, **kwargs)
+
+
+def run_agent(agent, chroma, turn):
+    """Решение агента по ходу: (флаги, действие, id записей, секунды)."""
+    chroma.load(turn)
+    user_request = turn["request"]
+    history = turn.get("history") or []
+    search_future = Future()
+    search_future.set_result(chroma.search_memory(user_request))
+
+    started = time.perf_counter()
+    if agent.mode == "single_call":
+        planning, relevant = agent.activate_memory_agent_combined(
+            user_request, history, prefetched_search=(user_request, search_future)
+        )
+    else:
+        planning = agent.activate_memory_agent_phase1(user_request, history)
+        planning = planning if isinstance(planning, dict) else {}
+        relevant = []
+        if planning.get("requires_memory") or planning.get("is_new_info"):
+            relevant = agent.activate_memory_agent_phase2(
+                user_request, history, planning, prefetched_search=(user_request, search_future)
+            )
+    elapsed = time.perf_counter() - started
+
+    flags = (bool(planning.get("requires_memory")), bool(planning.get("is_new_info")))
+    return {"flags": flags, "action": chroma.actions[0] if chroma.actions else "skip",
+            "ids": {m.get("id") for m in relevant or []}, "seconds": elapsed, "fallback": chroma.fell_back}
+
+
+def jaccard(a: set, b: set) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def compare_modes(turns, client, model_name: str, quiet: bool = True):
+    from memory_agent import MemoryAgent
+
+    results, calls = {}, {}
+    sink = open(os.devnull, "w", encoding="utf-8") if quiet else None
+    with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+        for mode in MODES:
+            counting, chroma = CountingClient(client), ActionChroma()
+            agent = MemoryAgent(counting, chroma, model_name=model_name, log_decisions=False, mode=mode)
+            results[mode] = [run_agent(agent, chroma, turn) for turn in turns]
+            calls[mode] = counting.calls
+    if sink:
+        sink.close()
+    return results, calls
+
+
+def print_report(results: dict, calls: dict, turns: int):
+    print(f"\n{'режим':<14}{'ходов':>7}{'p50':>10}{'p95':>10}{'вызовов LLM':>14}{'fallback':>10}   (мс)")
+    for mode in MODES:
+        seconds = np.asarray([r["seconds"] for r in results[mode]], dtype=np.float64) * 1000
+        p50, p95 = np.percentile(seconds, [50, 95]) if len(seconds) else (0.0, 0.0)
+        total_calls = sum(calls[mode].values())
+        fallbacks = sum(r["fallback"] for r in results[mode])
+        print(f"{mode:<14}{len(seconds):>7}{p50:>10.1f}{p95:>10.1f}{total_calls:>14}{fallbacks:>10}   {calls[mode]}")
+    print("  fallback — ходы, где запроса к памяти не было в записи и взят поиск по реплике")
+
+    reference, candidate = results["two_phase"], results["single_call"]
+    if not turns:
+        return
+    requires = sum(a["flags"][0] == b["flags"][0] for a, b in zip(reference, candidate)) / turns
+    new_info = sum(a["flags"][1] == b["flags"][1] for a, b in zip(reference, candidate)) / turns
+    action = sum(a["action"] == b["action"] for a, b in zip(reference, candidate)) / turns
+    overlap = np.mean([jaccard(a["ids"], b["ids"]) for a, b in zip(reference, candidate)])
+    print(f"\n[Compare] single_call относительно two_phase на {turns} ходах:")
+    print(f"  requires_memory совпал: {requires:.1%}")
+    print(f"  is_new_info совпал:     {new_info:.1%}")
+    print(f"  действие с памятью:     {action:.1%}")
+    print(f"  Jaccard по id записей:  {overlap:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="файл записи ходов (AURORA_RECORD_TURNS)")
+    parser.add_argument("--limit", type=int, default=None, help="только первые N ходов")
+    parser.add_argument("--model", default="openai/gpt-oss-20b:free")
+    parser.add_argument("--fake", action="store_true", help="вместо OpenRouter — локальный FakeOpenAIServer")
+    parser.add_argument("--latency", default="", help="задержки фейкового сервера: planning=0.6,memory=0.8,combined=0.9")
+    parser.add_argument("--verbose", action="store_true", help="не глушить вывод агента")
+    args = parser.parse_args()
+
+    from openrouter_client import OpenRouterClient
+
+    turns = load_turns(args.path)[:args.limit]
+    print(f"[Compare] Ходов в записи: {len(turns)}")
+
+    server = None
+    if args.fake:
+        from fake_openai_server import FakeOpenAIServer, parse_latency
+
+        server = FakeOpenAIServer(latency=parse_latency(args.latency)).start()
+        client = OpenRouterClient("fake-key", base_url=server.base_url)
+    else:
+        from dotenv import load_dotenv
+
+        load_dotenv("keys.env")
+        key = os.getenv("OPENROUTER_API_KEY")
+        if not key:
+            sys.exit("OPENROUTER_API_KEY не найден в keys.env (или запустите с --fake)")
+        client = OpenRouterClient(key)
+
+    try:
+        results, calls = compare_modes(turns, client, args.model, not args.verbose)
+    finally:
+        if server:
+            server.stop()
+    print_report(results, calls, len(turns))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,16 @@
 from PySide6.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel, QMainWindow, QSizePolicy
-)
-from PySide6.QtGui import QPixmap
-from PySide6.QtCore import Qt
-import re
-from datetime import datetime
-import json
-
-from openrouter_schemas import AURORA_SCHEMA
-
-from main_prompts import (
-    PERSONALITY_PROMPT,
-    FINAL_RESPONSE_PHASE_PROMPT,
-    FINAL_EXAMPLES_PROMPT
+    QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QLineEdit, QPushButton, QLabel, QMainWindow, QSizePolicy,
+    QPlainTextEdit, QToolButton
 )
+from PySide6.QtGui import QPixmap, QTextCursor, QFontDatabase
+from PySide6.QtCore import Qt, QThreadPool, Signal
+from collections import deque
+
+from turn_worker import TurnWorker
+from tracing import tracer, format_waterfall
+
+# Сколько последних ходов показывает панель таймингов
+TRACE_PANEL_TURNS = 5
 
 MOOD_IMAGES = {
     "neutral": "mood_pic/neutral.png",
@@ -31,20 +28,42 @@ MOOD_IMAGES = {
 
 
 class MainWindow(QMainWindow):
-    def __init__(self, client, mongodb, chroma_memory, memory_agent, audio_manager):
+    # Компонент догрузился в фоне: имя, секунды, успешно ли
+    component_ready = Signal(str, float, bool)
+    # Закрылся трейс: список спанов (из потока хода, доставляется в GUI-поток)
+    trace_finished = Signal(object)
+    # Сессия заархивирована в пуле ходов
+    history_cleared = Signal()
+
+    def __init__(self, client, mongodb, chroma_memory, memory_agent, audio_manager, history):
         super().__init__()
         self.client = client
         self.mongodb = mongodb
         self.chroma_memory = chroma_memory
         self.memory_agent = memory_agent
         self.audio_manager = audio_manager
+        self.history = history
+
+        # Один поток: ходы выполняются по очереди, окно при этом не блокируется
+        self.turn_pool = QThreadPool(self)
+        self.turn_pool.setMaxThreadCount(1)
+        self.active_turns = set()
+        # Границы ответа, который сейчас печатается из стрима. Сообщения, отправленные
+        # во время хода, добавляются в конец чата, после этого диапазона, и его не сдвигают
+        self.stream_start = None
+        self.stream_end = None
 
         self.setWindowTitle("Аврора")
         self.resize(850, 700)
 
+        self.recent_traces = deque(maxlen=TRACE_PANEL_TURNS)
+
         self.setup_ui()
         self.set_mood("neutral")
 
+        self.trace_finished.connect(self.on_trace_finished)
+        tracer.add_listener(self.trace_finished.emit)
+
     def setup_ui(self):
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -62,6 +81,29 @@ class MainWindow(QMainWindow):
         self.chat_window = QTextEdit(readOnly=True)
         chat_layout.addWidget(self.chat_window)
 
+        self.status_label = QLabel()
+        chat_layout.addWidget(self.status_label)
+
+        self.readiness_label = QLabel()
+        chat_layout.addWidget(self.readiness_label)
+
+        self.startup_components = {}
+        self.component_ready.connect(self.update_readiness)
+
+        # Сворачиваемая панель с водопадом таймингов последних ходов
+        self.trace_toggle = QToolButton(text="Тайминги", checkable=True)
+        self.trace_toggle.setArrowType(Qt.RightArrow)
+        self.trace_toggle.setToolButtonStyle(Qt.ToolButtonTextBesideIcon)
+        self.trace_toggle.toggled.connect(self.on_trace_toggle)
+        chat_layout.addWidget(self.trace_toggle)
+
+        self.trace_panel = QPlainTextEdit(readOnly=True)
+        self.trace_panel.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.trace_panel.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.trace_panel.setMaximumHeight(260)
+        self.trace_panel.setVisible(False)
+        chat_layout.addWidget(self.trace_panel)
+
         entry_layout = QHBoxLayout()
         self.entry_field = QLineEdit()
         self.entry_field.returnPressed.connect(self.on_send_message)
@@ -72,7 +114,8 @@ class MainWindow(QMainWindow):
         entry_layout.addWidget(self.send_button)
 
         self.clear_db_button = QPushButton("Очистить")
-        self.clear_db_button.clicked.connect(lambda: self.mongodb.delete_all_records(self.mongodb.phrases))
+        self.clear_db_button.clicked.connect(self.on_clear_history)
+        self.history_cleared.connect(lambda: self.clear_db_button.setEnabled(True))
         entry_layout.addWidget(self.clear_db_button)
 
         chat_layout.addLayout(entry_layout)
@@ -83,127 +126,68 @@ class MainWindow(QMainWindow):
         user_request = self.entry_field.text().strip()
         if not user_request:
             return
-        
+
         # === ДОБАВЛЯЕМ В ЧАТ ===
         self.chat_window.append(f"Ты: {user_request}")
-        self.mongodb.add_record(
-            self.mongodb.phrases,
-            {"role": "user", "content": user_request, "timestamp": datetime.now()}
-        )
         self.entry_field.clear()
 
-        # === ЛОГ ===
-        print(f"\n{'='*60}")
-        print(f"📨 НОВЫЙ ЗАПРОС")
-        print(f"{'='*60}")
-        print(f"📝 '{user_request}'")
-
-        # === ИСТОРИЯ ===
-        dialogue_history = self.mongodb.get_n_records(self.mongodb.phrases, 30)
-        print(f"📌 История загружена: {len(dialogue_history)} сообщений")
-
-
-        # === ФАЗА 1: Memory Agent — анализирует, нужно ли искать/сохранять ===
+        # === ХОД ЦЕЛИКОМ УХОДИТ В ФОНОВЫЙ ПОТОК ===
+        worker = TurnWorker(
+            user_request,
+            self.client,
+            self.mongodb,
+            self.chroma_memory,
+            self.memory_agent,
+            self.audio_manager,
+            self.history
+        )
+        worker.signals.stage.connect(self.status_label.setText)
+        worker.signals.answer_delta.connect(self.on_answer_delta)
+        worker.signals.answer.connect(self.on_answer)
+        worker.signals.error.connect(self.on_turn_error)
+        worker.signals.finished.connect(lambda: self.active_turns.discard(worker))
+        # Держим ссылку, пока сигналы воркера не отработают
+        self.active_turns.add(worker)
+        self.turn_pool.start(worker)
+
+    def on_clear_history(self):
+        # Старый диалог уходит в архив, краткое содержание привязано к сессии.
+        # Очистка встаёт в тот же однопоточный пул за уже отправленными ходами,
+        # чтобы session_id не сменился посреди хода
+        self.clear_db_button.setEnabled(False)
+        self.turn_pool.start(self.archive_session)
+
+    def archive_session(self):
         try:
-            planning_memory = self.memory_agent.activate_memory_agent_phase1(user_request, dialogue_history)
-            requires_memory = planning_memory.get("requires_memory", False)
-            is_new_info = planning_memory.get("is_new_info", False)
-        except Exception as e:
-            print(f"❌ Ошибка MemoryAgent Phase1: {e}")
-            requires_memory = False
-            is_new_info = False
-
-        # === ФАЗА 2: Memory Agent — ищет, обновляет, возвращает контекст ===
-        relevant_memories = []
-        if requires_memory or is_new_info:
-            relevant_memories = self.memory_agent.activate_memory_agent_phase2(
-                user_request=user_request,
-                dialogue_context=dialogue_history,
-                first_step_response=planning_memory if isinstance(planning_memory, dict) else {}
-            )
+            # Свёртка истории прошлого хода идёт в фоне — она не должна записаться в новую сессию
+            with self.history.fold_lock:
+                self.mongodb.archive_session()
+        finally:
+            self.history_cleared.emit()
+
+    def watch_startup(self, loader):
+        """Индикатор готовности компонентов, которые ещё грузятся в фоне."""
+        self.startup_components = loader.components
+        loader.on_ready = self.component_ready.emit
+        self.update_readiness()
+
+    def update_readiness(self, *_):
+        pending = [name for name, c in self.startup_components.items() if not c.is_ready()]
+        if pending:
+            self.readiness_label.setText("⏳ Загружается: " + ", ".join(pending))
         else:
-            relevant_memories = []
+            self.readiness_label.setText("")
 
-        # === ФАЗА ОТВЕТА: Один вызов модели ===
-        system_prompt = self.build_final_system_prompt(user_request, relevant_memories)
-        messages = [
-            {"role": "system", "content": system_prompt}
-        ]
-        for msg in dialogue_history:
-            messages.append({"role": msg["role"], "content": msg["content"]})
+    def on_trace_toggle(self, expanded: bool):
+        self.trace_toggle.setArrowType(Qt.DownArrow if expanded else Qt.RightArrow)
+        self.trace_panel.setVisible(expanded)
 
-        print(messages)
-
-        print(f"\n🧠 → ЗАПРОС К МОДЕЛИ (ФИНАЛЬНЫЙ ОТВЕТ)")
-        try:
-            response = self.client.chat_completion(
-                model="openai/gpt-oss-20b:free",
-                messages=messages,
-                schema=AURORA_SCHEMA
-            )
-        except Exception as e:
-            print(f"❌ ОШИБКА API: {e}")
-            self.chat_window.append("Аврора: У меня техническая ошибка. Повтори позже.")
+    def on_trace_finished(self, spans: list):
+        if not spans or spans[0]["name"] != "turn":
             return
-
-        if isinstance(response, str) or "error" in response:
-            print(f"❌ ОШИБКА: {response}")
-            self.chat_window.append("Аврора: Не могу ответить — ошибка.")
-            return
-
-        print(f"\n🔍 ← ОТВЕТ МОДЕЛИ — СЫРОЙ JSON")
-        print(json.dumps(response, ensure_ascii=False, indent=2))
-
-        # === ВЫВОД ОТВЕТА ===
-        self.render_and_store(response)
-
-    def build_final_system_prompt(self, user_request, relevant_memories):
-        # --- Время ---
-        last_msg_time = self.get_last_user_message_time()
-        time_info = "Ты не помнишь, сколько времени прошло с последнего сообщения."
-        if last_msg_time:
-            elapsed = datetime.now() - last_msg_time
-            hours, rem = divmod(int(elapsed.total_seconds()), 3600)
-            minutes = rem // 60
-            days = elapsed.days
-
-            if elapsed.total_seconds() < 120:
-                time_info = "Андрей только что писал тебе."
-            elif hours == 0:
-                time_info = f"С последнего сообщения Андрея прошло {minutes} минут."
-            elif hours < 24:
-                time_info = f"С последнего сообщения Андрея прошло {hours} ч {minutes} мин."
-            else:
-                time_info = f"С последнего разговора прошло {days} дн."
-
-        time_info += f" Время сейчас: {datetime.now().strftime('%d.%m.%y %H:%M')}."
-
-        # --- Критические границы ---
-        critical_prefs = self.chroma_memory.get_critical_memories()
-        critical_text = "\n".join([p for p in critical_prefs]) if critical_prefs else "ничего."
-
-        # --- Релевантные воспоминания ---
-        memory_text = "\n".join([m["text"] for m in relevant_memories]) if relevant_memories else "ничего."
-
-        # --- Сборка промта ---
-        prompt_parts = [
-            PERSONALITY_PROMPT,
-            FINAL_RESPONSE_PHASE_PROMPT,
-            "Критические границы: " + critical_text,
-            time_info,
-            f"Андрей сказал: {user_request}",
-            "Релевантные воспоминания из памяти:",
-            memory_text,
-            FINAL_EXAMPLES_PROMPT
-        ]
-        return "\n\n".join(prompt_parts)
-
-    def get_last_user_message_time(self):
-        recent = self.mongodb.get_n_records(self.mongodb.phrases, 5)
-        for msg in recent:
-            if msg.get("role") == "user" and "timestamp" in msg:
-                return msg["timestamp"]
-        return None
+        self.recent_traces.append(spans)
+        # Свежий ход сверху
+        self.trace_panel.setPlainText("\n\n".join(format_waterfall(t) for t in reversed(self.recent_traces)))
 
     def set_mood(self, mood: str):
         image_path = MOOD_IMAGES.get(mood.lower(), MOOD_IMAGES["neutral"])
@@ -211,30 +195,31 @@ class MainWindow(QMainWindow):
         if not pixmap.isNull():
             self.aurora_pic.setPixmap(pixmap)
 
-    def render_and_store(self, aurora_answer: dict):
-        # Очистка ответа от <think> тегов
-        final_answer = re.sub(
-            r'<think>.*?</think>', '', aurora_answer.get("final_answer", ""), flags=re.DOTALL
-        ).strip() or "…"
-
-        self.audio_manager.generate_speech(final_answer)
-
-        # Вывод в чат
-        self.chat_window.append(f"Аврора: {final_answer}")
-        
-        self.audio_manager.play_speech()
+    def on_answer_delta(self, text: str):
+        if self.stream_start is None:
+            self.chat_window.append("Аврора: ")
+            self.stream_start = self.stream_end = self.chat_window.document().characterCount() - 1
+        # Дописываем в конец своего блока, а не документа: ниже уже может быть "Ты: ..."
+        cursor = QTextCursor(self.chat_window.document())
+        cursor.setPosition(self.stream_end)
+        cursor.insertText(text)
+        self.stream_end = cursor.position()
+        self.chat_window.ensureCursorVisible()
+
+    def on_answer(self, final_answer: str, mood: str):
+        # Вывод в чат: напечатанное из стрима заменяем очищенным ответом
+        if self.stream_start is not None:
+            cursor = QTextCursor(self.chat_window.document())
+            cursor.setPosition(self.stream_start)
+            cursor.setPosition(self.stream_end, QTextCursor.KeepAnchor)
+            cursor.insertText(final_answer)
+            self.stream_start = self.stream_end = None
+        else:
+            self.chat_window.append(f"Аврора: {final_answer}")
         # Смена настроения
-        mood = aurora_answer.get("mood", "neutral")
         self.set_mood(mood)
+        self.chat_window.ensureCursorVisible()
 
-        # Сохранение в БД
-        self.mongodb.add_record(
-            self.mongodb.phrases,
-            {
-                "role": "assistant",
-                "content": final_answer,
-                "mood": mood,
-                "timestamp": datetime.now()
-            }
-        )
-        self.chat_window.ensureCursorVisible()
\ No newline at end of file
+    def on_turn_error(self, message: str):
+        self.stream_start = self.stream_end = None
+        self.chat_window.append(message)
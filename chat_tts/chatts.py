@@ -1,23 +1,104 @@
-import torchaudio as ta
 from chatterbox.tts import ChatterboxTTS
 import simpleaudio as sa
+import threading
+import queue
+import re
+import time
+
+from tracing import tracer
+
+# Конец предложения: . ! ? … (и их повторы), за которыми идёт пробел
+SENTENCE_END = re.compile(r'(?<=[.!?…])\s+')
+
+
+def split_sentences(text: str, min_len: int = 20):
+    """Режет текст на предложения. Слишком короткие куски ("Ой!", "Хм.")
+    приклеиваются к следующему, чтобы не синтезировать обрывки."""
+    sentences = []
+    buffer = ""
+    for part in SENTENCE_END.split(text.strip()):
+        buffer = f"{buffer} {part}".strip() if buffer else part.strip()
+        if len(buffer) >= min_len:
+            sentences.append(buffer)
+            buffer = ""
+    if buffer:
+        if sentences and len(buffer) < min_len:
+            sentences[-1] += " " + buffer
+        else:
+            sentences.append(buffer)
+    return sentences
+
 
 class AudioManager():
     def __init__(self):
         self.model = ChatterboxTTS.from_pretrained(device="cuda")
         self.audio_prompt_path = "chat_tts\\shadow.wav"
     
-    def generate_speech(self, text):
+    def synthesize_pcm(self, text) -> bytes:
+        """Синтез одного куска сразу в 16-битный mono PCM, без записи на диск."""
         wav = self.model.generate(text, audio_prompt_path=self.audio_prompt_path, exaggeration=0.5, cfg_weight=0.5)
-        ta.save("chat_tts\\speech.wav", wav, self.model.sr, encoding='PCM_S', bits_per_sample=16)
+        pcm = (wav.squeeze(0).clamp(-1.0, 1.0) * 32767).short()
+        return pcm.cpu().numpy().tobytes()
+
+    def speak(self, text, prefetch: int = 2):
+        """Озвучка по предложениям: пока играет предложение N, синтезируется N+1.
+
+        Синтез идёт в отдельном потоке и складывает PCM в очередь, текущий
+        поток проигрывает буферы по мере готовности. Блокирует до конца речи.
+        Если воспроизведение упало, stop останавливает синтез, а очередь
+        вычищается — поток синтеза не повиснет на полной очереди.
+        """
+        buffers = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+
+        def offer(item) -> bool:
+            while not stop.is_set():
+                try:
+                    buffers.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def producer():
+            try:
+                for sentence in split_sentences(text):
+                    if stop.is_set():
+                        break
+                    with tracer.span("tts.synthesize", chars=len(sentence)) as span:
+                        pcm = self.synthesize_pcm(sentence)
+                        span.set("audio_seconds", round(len(pcm) / 2 / self.model.sr, 2))
+                    if not offer(pcm):
+                        break
+            except Exception as e:
+                print(f"[TTS] Ошибка синтеза: {e}")
+            finally:
+                offer(None)
 
-    def play_speech(self, audio_file = "chat_tts\\speech.wav"):
-        wave_obj = sa.WaveObject.from_wave_file(audio_file)
-        play_obj = wave_obj.play()
+        with tracer.span("tts.speak", chars=len(text)) as speak_span:
+            threading.Thread(target=tracer.bind(producer), name="tts-synth", daemon=True).start()
 
-        play_obj.wait_done()
+            waited = 0.0
+            try:
+                while True:
+                    started = time.perf_counter()
+                    pcm = buffers.get()
+                    waited += time.perf_counter() - started
+                    if pcm is None:
+                        break
+                    with tracer.span("tts.play", audio_seconds=round(len(pcm) / 2 / self.model.sr, 2)):
+                        play_obj = sa.play_buffer(pcm, 1, 2, self.model.sr)
+                        play_obj.wait_done()
+            finally:
+                stop.set()
+                while True:
+                    try:
+                        buffers.get_nowait()
+                    except queue.Empty:
+                        break
+                # Сколько речь простаивала в ожидании синтеза
+                speak_span.set("stall_seconds", round(waited, 3))
 
 if __name__ == "__main__":
     manager = AudioManager()
-    manager.generate_speech("I can feel the warmth of the morning sun spilling through the window, brushing against my skin like a gentle caress. There’s a soft hum in the air, the kind that makes your heart ache with a mixture of longing and hope. Somewhere in the distance, birds are calling to each other, their voices weaving together in a delicate symphony that feels almost alive. I take a deep breath, tasting the faint scent of blooming flowers mixed with the crisp freshness of early dew.")
-    manager.play_speech()
+    manager.speak("I can feel the warmth of the morning sun spilling through the window, brushing against my skin like a gentle caress. There’s a soft hum in the air, the kind that makes your heart ache with a mixture of longing and hope. Somewhere in the distance, birds are calling to each other, their voices weaving together in a delicate symphony that feels almost alive. I take a deep breath, tasting the faint scent of blooming flowers mixed with the crisp freshness of early dew.")
@@ -1,101 +1,404 @@
 import chromadb
+import os
 import uuid
+import threading
+import time
+import numpy as np
 from sentence_transformers import SentenceTransformer
 from datetime import datetime
+from embedding_cache import EmbeddingCache
+from tokens import estimate_tokens
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from tracing import tracer, traced, current_span
+
+EMBEDDING_MODEL_NAME = "ai-forever/sbert_large_mt_nlu_ru"
+# "torch" — fp32 SentenceTransformer, "onnx" — int8 ONNX Runtime (см. onnx_embedder.py)
+EMBEDDING_ENGINE = os.getenv("AURORA_EMBEDDING_ENGINE", "torch")
+
+# Обычный поиск не трогает критические границы — они и так всегда в промпте
+SEARCHABLE_IMPORTANCE = ["high", "medium", "low"]
+# BM25-попадание без векторного кандидата проходит только с таким нормированным счётом
+# (1.0 — совпадение слова, которое есть в одной записи; см. BM25Index.search):
+# редкое точное слово даёт ~0.8–1.2 при любом размере памяти, частая основа — ниже 0.5
+LEXICAL_MIN_SCORE = 0.6
+
+def load_embedding_model(engine: str = EMBEDDING_ENGINE):
+    """Модель эмбеддингов и ключ для кэша (у int8-векторов свой ключ)."""
+    if engine == "onnx":
+        from onnx_embedder import OnnxEmbedder
+
+        threads = int(os.getenv("AURORA_ONNX_THREADS", "0")) or None
+        return OnnxEmbedder(threads=threads), f"{EMBEDDING_MODEL_NAME}:onnx-int8"
+    return SentenceTransformer(EMBEDDING_MODEL_NAME), EMBEDDING_MODEL_NAME
 
-last_successful_search_results = []
 
 class ChromaHandler():
-    def __init__(self):
-        self.model = SentenceTransformer("ai-forever/sbert_large_mt_nlu_ru")
+    def __init__(self, engine: str = EMBEDDING_ENGINE):
+        self.model, model_key = load_embedding_model(engine)
+        self.embeddings = EmbeddingCache(self.model, model_key)
         self.chroma_client = chromadb.PersistentClient(path="./chroma_db")
         self.collection = self.chroma_client.get_or_create_collection(
             name="preferences",
             metadata={"hnsw:space": "cosine"}
         )
 
+        # Холодный архив: устаревшие записи, которые ищутся только при явном припоминании
+        self.archive = self.chroma_client.get_or_create_collection(
+            name="preferences_archive",
+            metadata={"hnsw:space": "cosine"}
+        )
+        # Время последнего попадания записи в выдачу: id → epoch, сбрасывается в метаданные тирингом
+        self.retrieved_lock = threading.Lock()
+        self.retrieved = {}
+
+        # Материализованный набор критических границ: грузится один раз,
+        # дальше поддерживается при записи / удалении без обращений к хранилищу
+        self.critical_lock = threading.Lock()
+        self.critical = {}
+        # BM25 по тем же текстам — для точных слов, которые векторный поиск упускает
+        self.lexical = BM25Index()
+        self.load_derived_indexes()
+
+        # Подписчики на изменения памяти: listener(kind, embeddings), kind — "add" / "delete",
+        # "tier" — запись перенесена между горячей коллекцией и архивом, но по-прежнему есть
+        self.change_listeners = []
+
+    def add_change_listener(self, listener):
+        self.change_listeners.append(listener)
+
+    def notify_change(self, kind: str, embeddings=None):
+        for listener in self.change_listeners:
+            try:
+                listener(kind, embeddings)
+            except Exception as e:
+                print(f"[Chroma] Ошибка подписчика изменений: {e}")
+
     def add_record(self, text, category, importance):
+        self.add_records([{"text": text, "category": category, "importance": importance}])
+
+    def add_records(self, records: list, duplicate_threshold: float = 0.3):
+        """Пакетное добавление: один batched encode, один query на все векторы,
+        одна запись в Chroma. Дубли (в базе и внутри пачки) пропускаются.
+
+        records — [{"text", "category", "importance"}]. Возвращает отчёт
+        {"added": [...], "merged": [...], "skipped": [...]}.
+        """
+        return self._write_records(records, duplicate_threshold, merge=False)
+
+    def upsert_records(self, records: list, duplicate_threshold: float = 0.3):
+        """Как add_records, но близкий дубль в базе обновляется новым текстом
+        ("merged"). Поле "replaces" у записи — id, который она заменяет."""
+        replaced = [r["replaces"] for r in records if r.get("replaces")]
+        if replaced:
+            self.delete_records(replaced)
+        return self._write_records(records, duplicate_threshold, merge=True)
+
+    def delete_records(self, record_ids: list):
+        record_ids = [record_id for record_id in record_ids if record_id]
+        if not record_ids:
+            return
+        try:
+            self.collection.delete(ids=record_ids)
+            self._on_deleted(record_ids)
+            print(f"[Chroma] Удалено записей: {len(record_ids)}")
+        except Exception as e:
+            print(f"[Chroma] Ошибка при удалении записей {record_ids}: {e}")
+
+    def demote_records(self, record_ids: list):
+        """Перенос записей из горячей коллекции в холодный архив."""
+        moved = self._move_records(record_ids, self.collection, self.archive)
+        if moved:
+            self._on_deleted(moved, kind="tier")
+        return moved
+
+    def restore_records(self, record_ids: list):
+        """Возврат записей из архива в горячую коллекцию (после припоминания)."""
+        moved = self._move_records(record_ids, self.archive, self.collection, touch=True)
+        if moved:
+            batch = self.collection.get(ids=moved, include=["documents", "metadatas", "embeddings"])
+            self._on_added(batch["ids"], batch["documents"], batch["metadatas"], batch["embeddings"], kind="tier")
+        return moved
+
+    def _move_records(self, record_ids, source, target, touch=False):
+        record_ids = [record_id for record_id in record_ids if record_id]
+        if not record_ids:
+            return []
+        try:
+            batch = source.get(ids=record_ids, include=["documents", "metadatas", "embeddings"])
+            if not batch["ids"]:
+                return []
+            metadatas = batch["metadatas"]
+            if touch:
+                metadatas = [dict(meta, last_retrieved=time.time()) for meta in metadatas]
+            target.upsert(
+                ids=batch["ids"],
+                documents=batch["documents"],
+                embeddings=[list(vec) for vec in batch["embeddings"]],
+                metadatas=metadatas
+            )
+            source.delete(ids=batch["ids"])
+            return list(batch["ids"])
+        except Exception as e:
+            print(f"[Chroma] Ошибка переноса записей {record_ids}: {e}")
+            return []
+
+    def mark_retrieved(self, record_ids):
+        now = time.time()
+        with self.retrieved_lock:
+            for record_id in record_ids:
+                self.retrieved[record_id] = now
+
+    def take_retrieved(self, record_ids):
+        """Забрать накопленные отметки для указанных id (их запишет тиринг)."""
+        with self.retrieved_lock:
+            return {rid: self.retrieved.pop(rid) for rid in record_ids if rid in self.retrieved}
+
+    @traced("chroma.write")
+    def _write_records(self, records, duplicate_threshold, merge):
+        report = {"added": [], "merged": [], "skipped": []}
+        records = [r for r in records if r.get("text", "").strip()]
+        if not records:
+            return report
+
         creation_date = datetime.now().strftime("%d.%m.%y")
-        embedding = self.model.encode(text, convert_to_numpy=True).tolist()
+        vectors = self.embeddings.encode_many([r["text"] for r in records])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        unit = vectors / np.where(norms == 0, 1.0, norms)
 
-        # Поиск дубликатов
-        result = self.collection.query(
-            query_embeddings=[embedding],
-            n_results=1,
-            include=["documents", "distances"]
-        )
+        # Ближайший сосед в базе для всех векторов — одним запросом
+        nearest = [None] * len(records)
+        if self.collection.count() > 0:
+            result = self.collection.query(
+                query_embeddings=vectors.tolist(),
+                n_results=1,
+                include=["documents", "distances"]
+            )
+            for i in range(len(records)):
+                if result["ids"][i]:
+                    nearest[i] = (result["ids"][i][0], result["documents"][i][0], result["distances"][i][0])
 
-        duplicate_threshold = 0.3
-        if result["documents"] and len(result["documents"][0]) > 0:
-            score = result["distances"][0][0]
-            if score < duplicate_threshold:
-                print("Дубликат найден, не добавляю:", result["documents"][0][0])
-                return
-
-        print(f"Запись добавлена в chroma: {text}")
-        self.collection.add(
-            documents=[text],
-            embeddings=[embedding],
-            ids=[str(uuid.uuid4())],
-            metadatas=[{
-                "category": category,
-                "importance": importance,
+        accepted, merged = [], {}  # merged: id в базе → индекс записи пачки
+        twins = []  # (пропущенная запись отчёта, индекс записи пачки, дублем которой она оказалась)
+        for i, record in enumerate(records):
+            # Дубль внутри пачки: сравниваем с уже принятыми (косинусное расстояние)
+            kept = accepted + list(merged.values())
+            twin = next((j for j in kept if 1.0 - float(unit[i] @ unit[j]) < duplicate_threshold), None)
+            if twin is not None:
+                skipped = {"text": record["text"], "duplicate_of": records[twin]["text"], "duplicate_id": None}
+                report["skipped"].append(skipped)
+                twins.append((skipped, twin))
+                continue
+
+            if nearest[i] and nearest[i][2] < duplicate_threshold:
+                existing_id, existing_text, _ = nearest[i]
+                if merge and existing_id not in merged:
+                    merged[existing_id] = i
+                    report["merged"].append({"id": existing_id, "text": record["text"], "previous": existing_text})
+                else:
+                    report["skipped"].append({"text": record["text"], "duplicate_of": existing_text,
+                                              "duplicate_id": existing_id})
+                continue
+            accepted.append(i)
+
+        def metadata(record):
+            return {
+                "category": record["category"],
+                "importance": record["importance"],
                 "creation_date": creation_date
-            }]
-        )
+            }
+
+        if merged:
+            ids = list(merged)
+            texts = [records[i]["text"] for i in merged.values()]
+            metadatas = [metadata(records[i]) for i in merged.values()]
+            embeddings = [vectors[i] for i in merged.values()]
+            self.collection.update(
+                ids=ids,
+                documents=texts,
+                embeddings=[vec.tolist() for vec in embeddings],
+                metadatas=metadatas
+            )
+            self._on_deleted(ids, notify=False)
+            self._on_added(ids, texts, metadatas, embeddings)
+
+        if accepted:
+            ids = [str(uuid.uuid4()) for _ in accepted]
+            texts = [records[i]["text"] for i in accepted]
+            metadatas = [metadata(records[i]) for i in accepted]
+            embeddings = [vectors[i] for i in accepted]
+            self.collection.add(
+                documents=texts,
+                embeddings=[vec.tolist() for vec in embeddings],
+                ids=ids,
+                metadatas=metadatas
+            )
+            self._on_added(ids, texts, metadatas, embeddings)
+            report["added"] = [{"id": record_id, "text": text} for record_id, text in zip(ids, texts)]
+
+        # Дубль внутри пачки получает id записи, с которой совпал, — когда он уже известен
+        written = {i: existing_id for existing_id, i in merged.items()}
+        written.update(zip(accepted, (r["id"] for r in report["added"])))
+        for skipped, twin in twins:
+            skipped["duplicate_id"] = written.get(twin)
+
+        print(f"[Chroma] Запись пачки: добавлено {len(report['added'])}, "
+              f"обновлено {len(report['merged'])}, пропущено {len(report['skipped'])}")
+        for skipped in report["skipped"]:
+            print("Дубликат найден, не добавляю:", skipped["duplicate_of"])
+        return report
+
+    def _on_added(self, ids, texts, metadatas, embeddings, kind="add"):
+        """Поддержка производных структур после записи в коллекцию."""
+        for record_id, text, meta in zip(ids, texts, metadatas):
+            self.lexical.add(record_id, text, meta)
+        with self.critical_lock:
+            for record_id, text, meta in zip(ids, texts, metadatas):
+                if meta.get("importance") == "critical":
+                    self.critical[record_id] = (self._parse_date(meta.get("creation_date")), text)
+        self.notify_change(kind, [list(vec) for vec in embeddings])
+
+    def _on_deleted(self, ids, notify=True, kind="delete"):
+        for record_id in ids:
+            self.lexical.remove(record_id)
+        with self.critical_lock:
+            for record_id in ids:
+                self.critical.pop(record_id, None)
+        if notify:
+            self.notify_change(kind)
     
-    def search_memory(self, query, k=10, threshold=0.7):
-        global last_successful_search_results
-        query_vec = self.model.encode(query, convert_to_numpy=True).tolist()
-        results = self.collection.query(
-            query_embeddings=[query_vec],  # ← должен быть списком векторов
-            n_results=k,
-            include=["documents", "metadatas", "distances"],  # ← важно: metadatas
-            where={"importance": {"$in": ["high", "medium", "low"]}}
-        )
+    @traced("chroma.search")
+    def search_memory(self, query, k=10, threshold=0.7, top_n=5, include_archive=False, speculative=False):
+        """Гибридный поиск: векторный (порог threshold по косинусному расстоянию)
+        плюс BM25 по словам, списки сливаются reciprocal rank fusion, наружу
+        отдаются top_n лучших.
+
+        include_archive — при явном припоминании искать и в холодном архиве;
+        найденные там записи возвращаются в горячую коллекцию.
+
+        speculative — поиск заранее, результат может не пригодиться: отметки
+        о попадании в выдачу не ставятся, их ставит accept_search_results,
+        если результат всё же использован.
 
-        # Проверяем, есть ли результатыы
-        if not results["documents"] or len(results["documents"][0]) == 0:
-            print("Нет результатов поиска.")
-            return last_successful_search_results
+        Если ничего не прошло порог — пустой список: записи из чужого хода
+        в промпте хуже, чем их отсутствие."""
+        query_vec = self.embeddings.encode(query).tolist()
+        with tracer.span("chroma.query", n_results=k) as span:
+            results = self.collection.query(
+                query_embeddings=[query_vec],  # ← должен быть списком векторов
+                n_results=k,
+                include=["documents", "metadatas", "distances"],  # ← важно: metadatas
+                where={"importance": {"$in": SEARCHABLE_IMPORTANCE}}
+            )
+            span.set("results", len(results["ids"][0]) if results["ids"] else 0)
 
-        documents = results["documents"][0]
-        metadatas = results["metadatas"][0]
-        distances = results["distances"][0]
-        ids = results["ids"][0]
+        candidates = {}
+        dense_ranking = []
+        if results["documents"] and len(results["documents"][0]) > 0:
+            for doc, dist, meta, id in zip(results["documents"][0], results["distances"][0],
+                                           results["metadatas"][0], results["ids"][0]):
+                if dist < threshold:
+                    dense_ranking.append(id)
+                    candidates[id] = (doc, meta)
+
+        archive_ranking = []
+        if include_archive and self.archive.count() > 0:
+            archived = self.archive.query(
+                query_embeddings=[query_vec],
+                n_results=min(k, self.archive.count()),
+                include=["documents", "metadatas", "distances"]
+            )
+            for doc, dist, meta, id in zip(archived["documents"][0], archived["distances"][0],
+                                           archived["metadatas"][0], archived["ids"][0]):
+                if dist < threshold:
+                    archive_ranking.append(id)
+                    candidates[id] = (doc, meta)
+
+        lexical_ranking = []
+        for id, score in self.lexical.search(query, k, where=lambda meta: meta.get("importance") in SEARCHABLE_IMPORTANCE,
+                                             normalize=True):
+            if id not in candidates and score < LEXICAL_MIN_SCORE:
+                continue  # слабое совпадение по слову, которое не подтвердил векторный поиск
+            lexical_ranking.append(id)
+            if id not in candidates:
+                candidates[id] = self.lexical.get(id)
 
         filtered = []
-        for doc, dist, meta, id in zip(documents, distances, metadatas, ids):
-            if dist < threshold:
-                filtered.append({
-                    "id": id,
-                    "text": doc,
-                    "category": meta["category"],
-                    "importance": meta["importance"]
-                })
+        for id, _ in reciprocal_rank_fusion([dense_ranking, lexical_ranking, archive_ranking])[:top_n]:
+            doc, meta = candidates[id]
+            filtered.append({
+                "id": id,
+                "text": doc,
+                "category": meta["category"],
+                "importance": meta["importance"]
+            })
 
         print(f"Запрос: {query}")
-        print(f"Результаты: {results}")
+        print(f"[Chroma] Кэш эмбеддингов: {self.embeddings.stats}, hit rate {self.embeddings.hit_rate():.0%}")
+        print(f"[Chroma] Векторных кандидатов: {len(dense_ranking)}, BM25: {len(lexical_ranking)}, "
+              f"из архива: {len(archive_ranking)}, после слияния: {len(filtered)}")
+        current_span().update(dense=len(dense_ranking), lexical=len(lexical_ranking),
+                              archive=len(archive_ranking), results=len(filtered))
 
-        if filtered:
-            print(f"ПРОШЛИ ФИЛЬТР: {filtered}")
-            last_successful_search_results = filtered
-            return filtered
-        else:
-            print("НИКТО НЕ ПРОШЕЛ ФИЛЬТР. ИСПОЛЬЗУЮТСЯ ПОСЛЕДНИЕ ПРОШЕДШИЕ.")
-            return last_successful_search_results
+        if not filtered:
+            print("НИКТО НЕ ПРОШЕЛ ФИЛЬТР.")
+            return []
+        recalled = [r["id"] for r in filtered if r["id"] in archive_ranking]
+        if recalled:
+            print(f"[Chroma] Возвращаю из архива: {self.restore_records(recalled)}")
+        print(f"ПРОШЛИ ФИЛЬТР: {filtered}")
+        if not speculative:
+            self.accept_search_results(filtered)
+        return filtered
 
+    def accept_search_results(self, results):
+        """Побочный эффект выдачи, которая ушла в промпт: отметка для тиринга."""
+        if results:
+            self.mark_retrieved([r["id"] for r in results])
 
-    def get_critical_memories(self):
-        results = self.collection.get(
-            where={"importance": "critical"}
-        )
-        print(f'Критические предпочтения: {results.get("documents", [])}')
-        return results.get("documents", [])
+    def load_derived_indexes(self):
+        """Один проход по коллекции: критические границы и BM25-индекс."""
+        results = self.collection.get(include=["documents", "metadatas"])
+        critical = {}
+        for record_id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"]):
+            self.lexical.add(record_id, doc, meta)
+            if meta.get("importance") == "critical":
+                critical[record_id] = (self._parse_date(meta.get("creation_date")), doc)
+        with self.critical_lock:
+            self.critical = critical
+        print(f"[Chroma] Загружено критических границ: {len(self.critical)}, в BM25-индексе: {len(self.lexical)}")
+
+    def get_critical_memories(self, max_tokens: int = 800):
+        """Критические границы из памяти процесса, старые → новые.
+
+        Если не влезают в max_tokens, отбрасываются самые старые.
+        """
+        with self.critical_lock:
+            ordered = sorted(self.critical.values(), key=lambda item: item[0])
+
+        selected = []
+        budget = max_tokens
+        for _, text in reversed(ordered):
+            cost = estimate_tokens(text)
+            if cost > budget:
+                break
+            selected.append(text)
+            budget -= cost
+
+        if len(selected) < len(ordered):
+            print(f"[Chroma] Критических границ {len(ordered)}, в промпт влезло {len(selected)}")
+        return list(reversed(selected))
+
+    @staticmethod
+    def _parse_date(value):
+        try:
+            return datetime.strptime(value, "%d.%m.%y")
+        except (TypeError, ValueError):
+            return datetime.min
     
     def delete_record(self, record_id: str):
         try:
             self.collection.delete(ids=[record_id])
+            self._on_deleted([record_id])
             print(f"[Chroma] Удалена запись: {record_id}")
         except Exception as e:
             print(f"[Chroma] Ошибка при удалении записи {record_id}: {e}")
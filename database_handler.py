@@ -1,18 +1,138 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from collections import deque
+from datetime import datetime
+import threading
+import uuid
+
+from tracing import tracer, traced
 
 class DatabaseHandler():
-    def __init__(self):
+    def __init__(self, user_id: str = "andrey", persona: str = "aurora", recent_cache_size: int = 256):
         client = MongoClient("mongodb://localhost:27017/")
         self.db = client["aurora_db"]
         self.phrases = self.db["phrases"]
         self.user_preferences = self.db["user_preferences"]
+        self.summaries = self.db["summaries"]
+        self.sessions = self.db["sessions"]
+
+        # Несколько пользователей и персон делят одну базу: всё привязано к сессии
+        self.user_id = user_id
+        self.persona = persona
+        self.session_id = None
+        self.ensure_indexes()
+        self.open_session()
+
+        # Кольцевой буфер последних реплик: читается из памяти, пишется сквозь в Mongo
+        self.recent_lock = threading.Lock()
+        self.recent_phrases = deque(maxlen=recent_cache_size)
+        self.recent_complete = False  # в буфере вся сессия целиком
+        self.load_recent_phrases()
+
+    def ensure_indexes(self):
+        try:
+            self.phrases.create_index([("session_id", ASCENDING), ("timestamp", ASCENDING)])
+            self.phrases.create_index([("user_id", ASCENDING), ("persona", ASCENDING), ("timestamp", ASCENDING)])
+            self.sessions.create_index([("user_id", ASCENDING), ("persona", ASCENDING), ("archived", ASCENDING), ("last_active", DESCENDING)])
+        except Exception as e:
+            print(str(e))
+
+    def open_session(self):
+        """Продолжает последнюю неархивную сессию пользователя или начинает новую."""
+        try:
+            session = self.sessions.find_one(
+                {"user_id": self.user_id, "persona": self.persona, "archived": False},
+                sort=[("last_active", DESCENDING)]
+            )
+        except Exception as e:
+            print(str(e))
+            session = None
+
+        if session:
+            self.session_id = session["_id"]
+        else:
+            self.start_session()
+            self.adopt_legacy_records()
+        print(f"[Mongo] Сессия: {self.session_id}")
+
+    def start_session(self):
+        now = datetime.now()
+        self.session_id = str(uuid.uuid4())
+        try:
+            self.sessions.insert_one({
+                "_id": self.session_id,
+                "user_id": self.user_id,
+                "persona": self.persona,
+                "started_at": now,
+                "last_active": now,
+                "archived": False
+            })
+        except Exception as e:
+            print(str(e))
+
+    def adopt_legacy_records(self):
+        # Реплики, записанные до появления сессий, переходят в первую сессию
+        try:
+            result = self.phrases.update_many(
+                {"session_id": {"$exists": False}},
+                {"$set": {"session_id": self.session_id, "user_id": self.user_id, "persona": self.persona}}
+            )
+            if result.modified_count:
+                print(f"[Mongo] Старых реплик привязано к сессии: {result.modified_count}")
+        except Exception as e:
+            print(str(e))
+
+    def archive_session(self):
+        """Очистка без удаления: сессия архивируется, диалог начинается заново."""
+        try:
+            self.sessions.update_one(
+                {"_id": self.session_id},
+                {"$set": {"archived": True, "archived_at": datetime.now()}}
+            )
+        except Exception as e:
+            print(str(e))
+        print(f"[Mongo] Сессия {self.session_id} в архиве")
+        self.start_session()
+        self.load_recent_phrases()
+
+    def session_filter(self, session_id: str = None):
+        return {"session_id": session_id or self.session_id}
+
+    def load_recent_phrases(self):
+        try:
+            records = list(
+                self.phrases.find(self.session_filter())
+                .sort("timestamp", DESCENDING)
+                .limit(self.recent_phrases.maxlen)
+            )
+        except Exception as e:
+            print(str(e))
+            records = []
+        with self.recent_lock:
+            self.recent_phrases.clear()
+            self.recent_phrases.extend(reversed(records))
+            self.recent_complete = len(records) < self.recent_phrases.maxlen
 
+    @traced("mongo.write")
     def add_record(self, collection, record:dict):
+        if collection == self.phrases:
+            record.setdefault("session_id", self.session_id)
+            record.setdefault("user_id", self.user_id)
+            record.setdefault("persona", self.persona)
         try:
             collection.insert_one(record)
             print("Запись добавлена")
         except Exception as e:
             print(str(e))
+            return
+        if collection == self.phrases:
+            with self.recent_lock:
+                if len(self.recent_phrases) == self.recent_phrases.maxlen:
+                    self.recent_complete = False
+                self.recent_phrases.append(record)
+            try:
+                self.sessions.update_one({"_id": self.session_id}, {"$set": {"last_active": datetime.now()}})
+            except Exception as e:
+                print(str(e))
 
     def delete_record(self, collection, record:dict):
         try:
@@ -20,19 +140,95 @@ class DatabaseHandler():
             print("Запись удалена")
         except Exception as e:
             print(str(e))
+        if collection == self.phrases:
+            self.load_recent_phrases()
 
     def get_n_records(self, collection, number):
+        with tracer.span("mongo.read", collection=collection.name, limit=number) as span:
+            if collection == self.phrases:
+                with self.recent_lock:
+                    if number <= len(self.recent_phrases) or self.recent_complete:
+                        span.set("cache_hit", True)
+                        return list(self.recent_phrases)[-number:] if number > 0 else []
+                query, sort_key = self.session_filter(), "timestamp"
+                span.set("cache_hit", False)
+            else:
+                query, sort_key = {}, "_id"
+            try:
+                # Возвращаем в правильном порядке: старое → новое
+                records = list(collection.find(query).sort(sort_key, DESCENDING).limit(number))
+                span.set("results", len(records))
+                return list(reversed(records))
+            except Exception as e:
+                print(str(e))
+                return []
+    
+    def delete_all_records(self, collection):
+        # Для phrases — только текущая сессия, чужие диалоги не трогаем
+        query = self.session_filter() if collection == self.phrases else {}
+        try:
+            result = collection.delete_many(query)
+            print(f"Удалено записей: {result.deleted_count}")
+        except Exception as e:
+            print(str(e))
+        if collection == self.phrases:
+            self.load_recent_phrases()
+
+    @traced("mongo.read")
+    def get_records_between(self, collection, after=None, before=None, limit=200, session_id: str = None):
+        """Реплики сессии с timestamp в интервале (after, before), старое → новое.
+        Идёт по индексу (session_id, timestamp)."""
+        query = self.session_filter(session_id)
+        if after is not None:
+            query.setdefault("timestamp", {})["$gt"] = after
+        if before is not None:
+            query.setdefault("timestamp", {})["$lt"] = before
         try:
-            # Возвращаем в правильном порядке: старое → новое
-            records = list(collection.find().sort("_id", -1).limit(number))
-            return list(reversed(records))
+            return list(collection.find(query).sort("timestamp", ASCENDING).limit(limit))
         except Exception as e:
             print(str(e))
             return []
-    
-    def delete_all_records(self, collection):
+
+    @traced("mongo.read")
+    def get_records_in_range(self, start: datetime, end: datetime, limit=1000, session_id: str = None):
+        """Реплики за период времени: [start, end)."""
+        query = self.session_filter(session_id)
+        query["timestamp"] = {"$gte": start, "$lt": end}
         try:
-            result = collection.delete_many({})
-            print(f"Удалено записей: {result.deleted_count}")
+            return list(self.phrases.find(query).sort("timestamp", ASCENDING).limit(limit))
         except Exception as e:
-            print(str(e))
\ No newline at end of file
+            print(str(e))
+            return []
+
+    @traced("mongo.write")
+    def set_record_tokens(self, collection, record_id, tokens: int):
+        if collection == self.phrases:
+            with self.recent_lock:
+                for record in self.recent_phrases:
+                    if record.get("_id") == record_id:
+                        record["tokens"] = tokens
+                        break
+        try:
+            collection.update_one({"_id": record_id}, {"$set": {"tokens": tokens}})
+        except Exception as e:
+            print(str(e))
+
+    @traced("mongo.read")
+    def get_summary(self, name: str = None):
+        try:
+            return self.summaries.find_one({"_id": name or self.session_id})
+        except Exception as e:
+            print(str(e))
+            return None
+
+    @traced("mongo.write")
+    def save_summary(self, text: str, covered_until, name: str = None):
+        name = name or self.session_id
+        try:
+            self.summaries.replace_one(
+                {"_id": name},
+                {"_id": name, "text": text, "covered_until": covered_until},
+                upsert=True
+            )
+        except Exception as e:
+            print(str(e))
@@ -0,0 +1,120 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from tracing import tracer
+
+EMBEDDING_CACHE_PATH = "embedding_cache.sqlite"
+
+
+class EmbeddingCache():
+    """Двухуровневый кэш эмбеддингов: LRU в памяти + SQLite на диске.
+
+    Ключ — sha256 от имени модели и текста, так что смена модели не
+    подмешивает чужие векторы. На диске векторы лежат в float16, число
+    записей ограничено max_disk_items (выселяются давно не читанные).
+    """
+
+    def __init__(self, model, model_name: str, path: str = EMBEDDING_CACHE_PATH,
+                 max_memory_items: int = 2048, max_disk_items: int = 200_000):
+        self.model = model
+        self.model_name = model_name
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, dim INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self.db.commit()
+        # Число строк на диске считается один раз, дальше ведётся при вставке и выселении
+        self.disk_count = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def encode(self, text: str) -> np.ndarray:
+        return self.encode_many([text])[0]
+
+    def encode_many(self, texts: list) -> np.ndarray:
+        """Векторы для списка текстов; недостающие считаются одним батчем."""
+        with tracer.span("embed.encode", texts=len(texts)) as span:
+            vectors, encoded = self._encode_many(texts)
+            span.update(cache_hit=not encoded, encoded=encoded)
+            return vectors
+
+    def _encode_many(self, texts):
+        keys = [self.key(t) for t in texts]
+        found = {}
+
+        with self.lock:
+            for k in keys:
+                if k in self.memory:
+                    self.memory.move_to_end(k)
+                    found[k] = self.memory[k]
+                    self.stats["memory_hits"] += 1
+
+            missing_keys = list(dict.fromkeys(k for k in keys if k not in found))
+            if missing_keys:
+                now = time.time()
+                for k in missing_keys:
+                    row = self.db.execute("SELECT vector, dim FROM embeddings WHERE key = ?", (k,)).fetchone()
+                    if row:
+                        vec = np.frombuffer(row[0], dtype=np.float16, count=row[1]).astype(np.float32)
+                        found[k] = vec
+                        self._remember(k, vec)
+                        self.db.execute("UPDATE embeddings SET last_access = ? WHERE key = ?", (now, k))
+                        self.stats["disk_hits"] += 1
+                self.db.commit()
+
+        to_encode = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in found))
+        if to_encode:
+            vectors = self.model.encode(to_encode, convert_to_numpy=True)
+            with self.lock:
+                now = time.time()
+                for t, vec in zip(to_encode, vectors):
+                    k = self.key(t)
+                    vec = np.asarray(vec, dtype=np.float32)
+                    found[k] = vec
+                    self._remember(k, vec)
+                    # Ключа на диске не было; если его успел записать параллельный поток — вектор тот же
+                    cursor = self.db.execute(
+                        "INSERT OR IGNORE INTO embeddings (key, vector, dim, last_access) VALUES (?, ?, ?, ?)",
+                        (k, vec.astype(np.float16).tobytes(), vec.shape[0], now)
+                    )
+                    self.disk_count += cursor.rowcount
+                    self.stats["misses"] += 1
+                self._evict_disk()
+                self.db.commit()
+
+        return np.stack([found[k] for k in keys]), len(to_encode)
+
+    def hit_rate(self) -> float:
+        total = sum(self.stats.values())
+        return (self.stats["memory_hits"] + self.stats["disk_hits"]) / total if total else 0.0
+
+    def _remember(self, key, vec):
+        self.memory[key] = vec
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
+
+    def _evict_disk(self):
+        excess = self.disk_count - self.max_disk_items
+        if excess > 0:
+            cursor = self.db.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_access LIMIT ?)",
+                (excess,)
+            )
+            self.disk_count -= cursor.rowcount
@@ -0,0 +1,266 @@
+"""Локальный OpenAI-совместимый сервер для офлайн-бенчмарков и проверок.
+
+Отвечает на POST /v1/chat/completions заготовленными JSON, валидными по
+схемам из openrouter_schemas (схема узнаётся по response_format.json_schema.name),
+с настраиваемой задержкой на каждую схему. Поддерживает stream=True (SSE
+с usage в последнем чанке), так что OpenRouterClient работает без изменений.
+
+Сбои задаются по схеме и номеру попытки: faults[схема][i] — что сделать с
+i-м запросом этой схемы (дальше — обычный ответ). {"status": 503} — ошибка
+с этим кодом (и заголовком Retry-After, если есть "retry_after"),
+{"reset": True} — разрыв соединения без ответа, {"delay": 2.0} — медленная
+попытка. Так проверяются ретраи, бэкофф и хеджирование клиента.
+
+    server = FakeOpenAIServer(latency={"memory_agent_planning": 0.3}).start()
+    server = FakeOpenAIServer(faults={"memory_agent_planning": [{"status": 503}, {"delay": 2.0}]}).start()
+    client = OpenRouterClient("fake-key", base_url=server.base_url)
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from tokens import estimate_tokens
+
+# Задержки по умолчанию, в секундах, — порядок величин бесплатных моделей OpenRouter
+DEFAULT_LATENCY = {
+    "memory_agent_planning": 0.6,
+    "memory_manager_response": 0.8,
+    "memory_agent_combined": 0.9,
+    "aurora_final_answer": 1.5,
+    "dialogue_summary": 1.0,
+}
+
+# Короткие имена для CLI: planning=0.3 вместо memory_agent_planning=0.3
+LATENCY_ALIASES = {
+    "planning": "memory_agent_planning",
+    "memory": "memory_manager_response",
+    "combined": "memory_agent_combined",
+    "final": "aurora_final_answer",
+    "summary": "dialogue_summary",
+}
+
+USER_REQUEST_RE = re.compile(r"Сейчас пользователь написал: '(.*?)'\.(?=\n|$)", re.S)
+PROPOSED_RE = re.compile(r"new_memory_record: (.*?), category: (\w+), importance: (\w+)\.")
+MEMORY_RE = re.compile(r"'id': '([^']+)', 'text': '([^']*)', 'category': '([^']*)', 'importance': '(\w+)'")
+
+
+def parse_latency(spec: str) -> dict:
+    """"planning=0.3,final=1.2" → {схема: секунды}."""
+    latency = {}
+    for part in filter(None, (p.strip() for p in (spec or "").split(","))):
+        name, _, value = part.partition("=")
+        latency[LATENCY_ALIASES.get(name, name)] = float(value)
+    return latency
+
+
+def _last_content(messages):
+    return messages[-1].get("content", "") if messages else ""
+
+
+def canned_planning(messages):
+    """Решение фазы 1 детерминировано по тексту реплики: ~60% нужна память,
+    ~20% новая информация, остальное — ни то ни другое."""
+    match = USER_REQUEST_RE.search(_last_content(messages))
+    user_request = match.group(1) if match else ""
+    bucket = zlib.crc32(user_request.encode("utf-8")) % 10
+    is_new_info = bucket < 2
+    return {
+        "thoughts": "Заготовленное решение бенчмарка.",
+        "is_new_info": is_new_info,
+        "new_memory_record": user_request if is_new_info else None,
+        "category": "preferences" if is_new_info else None,
+        "importance": "medium" if is_new_info else None,
+        "requires_memory": bucket < 8,
+        "memory_query": user_request if bucket < 8 else "",
+    }
+
+
+def canned_memory(messages):
+    content = _last_content(messages)
+    relevant = [
+        {"id": m[0], "text": m[1], "category": m[2], "importance": m[3]}
+        for m in MEMORY_RE.findall(content)[:3]
+    ]
+    proposed = PROPOSED_RE.search(content)
+    if proposed and proposed.group(1) != "None":
+        action = {"action": "create", "old_memory_id": None, "new_memory": {
+            "text": proposed.group(1), "category": proposed.group(2), "importance": proposed.group(3)
+        }}
+    else:
+        action = {"action": "skip", "old_memory_id": None, "new_memory": None}
+    return {"relevant_memories": relevant, "new_memory_action": action}
+
+
+def canned_combined(messages):
+    """Однопроходный режим: те же флаги, что у canned_planning, отбор и действие — как у canned_memory."""
+    content = _last_content(messages)
+    planning = canned_planning(messages)
+    relevant = [
+        {"id": m[0], "text": m[1], "category": m[2], "importance": m[3]}
+        for m in MEMORY_RE.findall(content)[:3]
+    ] if planning["requires_memory"] else []
+    if planning["is_new_info"]:
+        action = {"action": "create", "old_memory_id": None, "new_memory": {
+            "text": planning["new_memory_record"], "category": planning["category"],
+            "importance": planning["importance"]
+        }}
+    else:
+        action = {"action": "skip", "old_memory_id": None, "new_memory": None}
+    return {
+        "thoughts": planning["thoughts"],
+        "is_new_info": planning["is_new_info"],
+        "requires_memory": planning["requires_memory"],
+        "relevant_memories": relevant,
+        "new_memory_action": action,
+    }
+
+
+def canned_final(messages):
+    return {
+        "thoughts": "Пользователь продолжает разговор, отвечаю тепло и по делу.",
+        "final_answer": "Слушай, это правда интересно. Расскажи подробнее, как это было? "
+                        "Мне важно понять, что ты сам об этом думаешь.",
+        "mood": "curious",
+    }
+
+
+def canned_summary(messages):
+    return {"summary": "Андрей и Аврора обсуждали планы, привычки и увлечения Андрея."}
+
+
+CANNED = {
+    "memory_agent_planning": canned_planning,
+    "memory_manager_response": canned_memory,
+    "memory_agent_combined": canned_combined,
+    "aurora_final_answer": canned_final,
+    "dialogue_summary": canned_summary,
+}
+
+
+class FakeOpenAIServer():
+    def __init__(self, latency: dict = None, jitter: float = 0.1, stream_chunk: int = 16,
+                 canned: dict = None, host: str = "127.0.0.1", port: int = 0, seed: int = 0,
+                 faults: dict = None):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        self.jitter = jitter
+        self.stream_chunk = stream_chunk
+        self.canned = dict(CANNED, **(canned or {}))
+        self.faults = {name: list(plan) for name, plan in (faults or {}).items()}
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        # Запросы приходят параллельно (хедж клиента) — счётчик попыток под замком
+        self.requests_lock = threading.Lock()
+        self.requests = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def delay(self, schema_name):
+        base = self.latency.get(schema_name, 0.0)
+        with self.random_lock:
+            factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+        return max(0.0, base * factor)
+
+    def respond(self, body):
+        """(имя схемы, JSON-строка ответа, usage, сбой этой попытки или None)."""
+        schema_name = ((body.get("response_format") or {}).get("json_schema") or {}).get("name", "")
+        with self.requests_lock:
+            attempt = self.requests.get(schema_name, 0)
+            self.requests[schema_name] = attempt + 1
+        plan = self.faults.get(schema_name, [])
+        fault = plan[attempt] if attempt < len(plan) else None
+        build = self.canned.get(schema_name, canned_final)
+        content = json.dumps(build(body.get("messages", [])), ensure_ascii=False)
+        prompt_tokens = sum(estimate_tokens(m.get("content", "")) for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": estimate_tokens(content),
+            "total_tokens": prompt_tokens + estimate_tokens(content),
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+        return schema_name, content, usage, fault
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                schema_name, content, usage, fault = server.respond(body)
+                fault = fault or {}
+                delay = fault.get("delay", server.delay(schema_name))
+                if fault.get("reset"):
+                    time.sleep(delay)
+                    self.close_connection = True
+                elif fault.get("status"):
+                    time.sleep(delay)
+                    self.send_json({"error": {"message": "fake fault", "code": fault["status"]}},
+                                   status=fault["status"], retry_after=fault.get("retry_after"))
+                elif body.get("stream"):
+                    self.stream(content, usage, delay)
+                else:
+                    time.sleep(delay)
+                    self.send_json({
+                        "id": "fake", "object": "chat.completion", "created": int(time.time()),
+                        "model": body.get("model", "fake"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                        "usage": usage,
+                    })
+
+            def send_json(self, payload, status=200, retry_after=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                if retry_after is not None:
+                    self.send_header("Retry-After", str(retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def stream(self, content, usage, delay):
+                # Треть задержки — до первого токена, остальное размазано по чанкам
+                chunks = [content[i:i + server.stream_chunk] for i in range(0, len(content), server.stream_chunk)]
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                time.sleep(delay / 3)
+                per_chunk = (delay * 2 / 3) / max(1, len(chunks))
+                for piece in chunks:
+                    self.event({"choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+                    time.sleep(per_chunk)
+                self.event({"choices": [], "usage": usage})
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def event(self, payload):
+                payload = dict({"id": "fake", "object": "chat.completion.chunk", "created": 0, "model": "fake"}, **payload)
+                self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
@@ -0,0 +1,95 @@
+import threading
+
+from openrouter_schemas import DIALOGUE_SUMMARY_SCHEMA
+from main_prompts import DIALOGUE_SUMMARY_PROMPT
+from tokens import estimate_tokens
+from tracing import traced
+
+# Бюджеты истории по фазам, в токенах
+HISTORY_BUDGETS = {
+    "final": 3000,
+    "planning": 800,
+}
+
+
+class HistoryManager():
+    """Окно диалога по токенам, а не по числу сообщений.
+
+    Окно заполняется от новых реплик к старым, пока влезает в бюджет фазы.
+    Всё, что выпало из окна финальной фазы, сворачивается в краткое
+    содержание (коллекция summaries рядом с phrases), которое дополняется
+    инкрементально. Число токенов кэшируется прямо в записи phrases.
+    """
+
+    def __init__(self, mongodb, client=None, budgets: dict = None, fetch_depth: int = 200,
+                 summary_max_words: int = 250, model_name: str = "openai/gpt-oss-20b:free"):
+        self.mongodb = mongodb
+        self.client = client
+        self.budgets = dict(HISTORY_BUDGETS, **(budgets or {}))
+        self.fetch_depth = fetch_depth
+        self.summary_max_words = summary_max_words
+        self.model_name = model_name
+        self.fold_lock = threading.Lock()
+
+    def record_tokens(self, record: dict) -> int:
+        tokens = record.get("tokens")
+        if tokens is None:
+            tokens = estimate_tokens(record.get("content", ""))
+            record["tokens"] = tokens
+            if "_id" in record:
+                self.mongodb.set_record_tokens(self.mongodb.phrases, record["_id"], tokens)
+        return tokens
+
+    def load_recent(self):
+        return self.mongodb.get_n_records(self.mongodb.phrases, self.fetch_depth)
+
+    def window(self, phase: str, records: list) -> list:
+        """Самые свежие записи, влезающие в бюджет фазы, старое → новое.
+        Последняя реплика (текущий запрос) попадает в окно всегда."""
+        budget = self.budgets.get(phase, self.budgets["final"])
+        kept = []
+        for record in reversed(records):
+            cost = self.record_tokens(record)
+            if kept and cost > budget:
+                break
+            kept.append(record)
+            budget -= cost
+        return list(reversed(kept))
+
+    def get_summary_text(self):
+        summary = self.mongodb.get_summary()
+        return summary.get("text") if summary else None
+
+    @traced("history.fold")
+    def fold(self, window: list):
+        """Сворачивает в краткое содержание всё между прошлой свёрткой и началом окна."""
+        if not self.client or not window or "timestamp" not in window[0]:
+            return
+        with self.fold_lock:
+            summary = self.mongodb.get_summary() or {}
+            pending = self.mongodb.get_records_between(
+                self.mongodb.phrases,
+                after=summary.get("covered_until"),
+                before=window[0]["timestamp"],
+                limit=self.fetch_depth
+            )
+            if not pending:
+                return
+
+            lines = [f"{r['role']}: {r['content']}" for r in pending]
+            messages = [
+                {"role": "system", "content": DIALOGUE_SUMMARY_PROMPT.replace("{max_words}", str(self.summary_max_words))},
+                {"role": "user", "content": (
+                    f"Текущее краткое содержание: {summary.get('text') or 'пусто.'}\n\n"
+                    "Новые старые реплики:\n" + "\n".join(lines)
+                )},
+            ]
+            response = self.client.chat_completion(
+                self.model_name, messages, schema=DIALOGUE_SUMMARY_SCHEMA, phase="summary"
+            )
+            if not isinstance(response, dict) or not response.get("summary"):
+                print(f"[History] Не удалось обновить краткое содержание: {response}")
+                return
+
+            self.mongodb.save_summary(response["summary"], pending[-1]["timestamp"])
+            print(f"[History] В краткое содержание свёрнуто реплик: {len(pending)}")
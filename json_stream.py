@@ -0,0 +1,98 @@
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class JsonFieldStreamer():
+    """Инкрементальный разбор JSON-объекта, приходящего кусками из стрима.
+
+    Следит только за строковым полем верхнего уровня `field` и отдаёт
+    декодированный текст по мере прихода, не дожидаясь конца объекта.
+    Остальные поля пропускаются — целиком объект всё равно разбирается
+    через json.loads, когда стрим закончился.
+    """
+
+    def __init__(self, field: str):
+        self.field = field
+        self.value = ""          # уже декодированная часть поля
+        self.done = False        # строка поля закрылась
+
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._unicode = None     # накопитель для \uXXXX
+        self._pending_high = None
+        self._is_key = False
+        self._capture = False
+        self._key_buf = []
+        self._last_key = None
+        self._expect_key = False
+
+    def feed(self, chunk: str) -> str:
+        """Принимает очередной кусок, возвращает новый текст поля (может быть пустым)."""
+        out = []
+        for ch in chunk:
+            if self._in_string:
+                self._string_char(ch, out)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._is_key = self._depth == 1 and self._expect_key
+                self._capture = (
+                    self._depth == 1 and not self._is_key
+                    and self._last_key == self.field and not self.done
+                )
+                self._key_buf = []
+            elif ch in '{[':
+                self._depth += 1
+                self._expect_key = ch == '{'
+            elif ch in '}]':
+                self._depth -= 1
+            elif ch == ',' and self._depth == 1:
+                self._expect_key = True
+            elif ch == ':':
+                self._expect_key = False
+
+        text = "".join(out)
+        self.value += text
+        return text
+
+    def _string_char(self, ch, out):
+        if self._unicode is not None:
+            self._unicode += ch
+            if len(self._unicode) == 4:
+                code = int(self._unicode, 16)
+                self._unicode = None
+                if 0xD800 <= code < 0xDC00:
+                    self._pending_high = code
+                    return
+                if self._pending_high is not None and 0xDC00 <= code < 0xE000:
+                    code = 0x10000 + ((self._pending_high - 0xD800) << 10) + (code - 0xDC00)
+                self._pending_high = None
+                self._emit(chr(code), out)
+            return
+
+        if self._escape:
+            self._escape = False
+            if ch == 'u':
+                self._unicode = ""
+            else:
+                self._emit(_ESCAPES.get(ch, ch), out)
+            return
+
+        if ch == '\\':
+            self._escape = True
+        elif ch == '"':
+            self._in_string = False
+            if self._is_key:
+                self._last_key = "".join(self._key_buf)
+            elif self._capture:
+                self._capture = False
+                self.done = True
+        else:
+            self._emit(ch, out)
+
+    def _emit(self, text, out):
+        if self._is_key:
+            self._key_buf.append(text)
+        elif self._capture:
+            out.append(text)
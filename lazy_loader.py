@@ -0,0 +1,97 @@
+import threading
+import time
+
+
+class LazyComponent():
+    """Прокси компонента, который собирается в фоновом потоке.
+
+    Первое обращение к любому атрибуту ждёт окончания загрузки, поэтому
+    код, которому компонент ещё не нужен, не блокируется вовсе.
+    """
+
+    def __init__(self, name: str, factory, on_ready=None):
+        self._name = name
+        self._factory = factory
+        self._on_ready = on_ready
+        self._instance = None
+        self._error = None
+        self._seconds = None
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self._load, name=f"load-{name}", daemon=True)
+        self._thread.start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            self._instance = self._factory()
+        except Exception as e:
+            self._error = e
+            print(f"[Startup] ❌ {self._name}: {e}")
+        self._seconds = time.perf_counter() - start
+        self._event.set()
+        if self._error is None:
+            print(f"[Startup] {self._name} готов за {self._seconds:.2f} с")
+        if self._on_ready:
+            self._on_ready(self._name, self._seconds, self._error is None)
+
+    def wait(self, timeout: float = None):
+        if not self._event.wait(timeout):
+            raise TimeoutError(f"{self._name} не загрузился за {timeout} с")
+        if self._error is not None:
+            raise RuntimeError(f"Компонент {self._name} не загрузился: {self._error}") from self._error
+        return self._instance
+
+    def is_ready(self) -> bool:
+        return self._event.is_set()
+
+    def load_seconds(self):
+        return self._seconds
+
+    def __getattr__(self, attr):
+        # Сюда попадают только атрибуты, которых нет у самого прокси
+        return getattr(self.wait(), attr)
+
+
+class StartupLoader():
+    """Параллельная загрузка тяжёлых компонентов с отчётом о фазах старта."""
+
+    def __init__(self, on_ready=None):
+        self.started = time.perf_counter()
+        self.on_ready = on_ready
+        self.components = {}
+        self.lock = threading.Lock()
+        self.sealed = False
+        self.reported = False
+
+    def add(self, name: str, factory) -> LazyComponent:
+        component = LazyComponent(name, factory, on_ready=self._component_ready)
+        with self.lock:
+            self.components[name] = component
+        return component
+
+    def seal(self):
+        """Больше компонентов не будет — можно печатать отчёт, когда все загрузятся."""
+        with self.lock:
+            self.sealed = True
+        self._maybe_report()
+
+    def _component_ready(self, name, seconds, ok):
+        if self.on_ready:
+            self.on_ready(name, seconds, ok)
+        self._maybe_report()
+
+    def _maybe_report(self):
+        with self.lock:
+            if self.reported or not self.sealed:
+                return
+            if not all(c.is_ready() for c in self.components.values()):
+                return
+            self.reported = True
+        self.report()
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        print("[Startup] Фазы запуска:")
+        for name, component in self.components.items():
+            print(f"  {name:<14} {component.load_seconds():6.2f} с")
+        print(f"  {'всего':<14} {total:6.2f} с (параллельно)")
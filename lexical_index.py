@@ -0,0 +1,144 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+
+TOKEN_RE = re.compile(r"[a-zа-я0-9]+(?:[-.][a-zа-я0-9]+)*")
+
+STOPWORDS = {
+    "и", "в", "во", "не", "что", "он", "на", "я", "с", "со", "как", "а", "то", "все", "она", "так",
+    "его", "но", "да", "ты", "к", "у", "же", "вы", "за", "бы", "по", "только", "ее", "мне", "было",
+    "вот", "от", "меня", "еще", "нет", "о", "из", "ему", "теперь", "когда", "даже", "ну", "ли", "если",
+    "уже", "или", "ни", "быть", "был", "него", "до", "вас", "нибудь", "опять", "уж", "вам", "ведь",
+    "там", "потом", "себя", "ничего", "ей", "может", "они", "тут", "где", "есть", "надо", "ней", "для",
+    "мы", "тебя", "их", "чем", "была", "сам", "чтоб", "без", "будто", "чего", "раз", "тоже", "себе",
+    "под", "будет", "ж", "тогда", "кто", "этот", "того", "потому", "этого", "какой", "совсем", "ним",
+    "здесь", "этом", "один", "почти", "мой", "тем", "чтобы", "нее", "были", "куда", "зачем", "всех",
+    "можно", "при", "об", "другой", "хоть", "после", "над", "больше", "тот", "через", "эти", "нас",
+    "про", "всего", "них", "какая", "много", "разве", "эту", "моя", "свою", "этой", "перед", "иногда",
+    "лучше", "чуть", "том", "такой", "им", "более", "всегда", "конечно", "всю", "между",
+    "пользователь", "андрей",
+}
+
+# Окончания для грубого стемминга, если нет snowballstemmer (длинные — первыми)
+_SUFFIXES = sorted([
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "ых", "их", "ым", "им", "ий", "ый", "ой", "ая", "яя", "ое",
+    "ее", "ые", "ие", "ую", "юю", "ов", "ев", "ей", "ам", "ям", "ах", "ях", "ом", "ем", "ть", "ет",
+    "ит", "ут", "ют", "ат", "ят", "ешь", "ишь", "ла", "ли", "ло", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь",
+], key=len, reverse=True)
+
+try:
+    import snowballstemmer
+    _stemmer = snowballstemmer.stemmer("russian")
+except ImportError:
+    _stemmer = None
+
+
+def stem(token: str) -> str:
+    if not re.search("[а-я]", token):
+        return token  # латиница и числа ("rtx", "3060") — как есть
+    if _stemmer:
+        return _stemmer.stemWord(token)
+    for suffix in _SUFFIXES:
+        if len(token) - len(suffix) >= 3 and token.endswith(suffix):
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> list:
+    text = text.lower().replace("ё", "е")
+    return [stem(t) for t in TOKEN_RE.findall(text) if t not in STOPWORDS]
+
+
+class BM25Index():
+    """Инвертированный индекс BM25 по текстам памяти с инкрементальным
+    добавлением и удалением — дополняет векторный поиск точными словами
+    (названия, модели железа, игры)."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)   # термин → {id: tf}
+        self.doc_terms = {}                 # id → Counter терминов
+        self.doc_len = {}                   # id → длина в терминах
+        self.docs = {}                      # id → (текст, метаданные)
+        self.total_len = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, record_id: str, text: str, metadata: dict = None):
+        terms = Counter(tokenize(text))
+        with self.lock:
+            if record_id in self.docs:
+                self._remove(record_id)
+            self.docs[record_id] = (text, metadata or {})
+            self.doc_terms[record_id] = terms
+            self.doc_len[record_id] = sum(terms.values())
+            self.total_len += self.doc_len[record_id]
+            for term, tf in terms.items():
+                self.postings[term][record_id] = tf
+
+    def remove(self, record_id: str):
+        with self.lock:
+            self._remove(record_id)
+
+    def _remove(self, record_id):
+        terms = self.doc_terms.pop(record_id, None)
+        if terms is None:
+            return
+        self.docs.pop(record_id, None)
+        self.total_len -= self.doc_len.pop(record_id)
+        for term in terms:
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(record_id, None)
+                if not docs:
+                    del self.postings[term]
+
+    def search(self, query: str, k: int = 10, where=None, normalize: bool = False):
+        """[(id, score)] по убыванию; where(metadata) -> bool фильтрует записи.
+
+        normalize — счёт делится на idf термина, который есть ровно в одной
+        записи: 1.0 — как одно совпадение уникального слова в записи средней
+        длины. Сырой BM25 растёт с размером корпуса (вместе с idf), а эта
+        шкала — нет, поэтому на неё можно ставить постоянный порог."""
+        terms = set(tokenize(query))
+        with self.lock:
+            n = len(self.docs)
+            if not n or not terms:
+                return []
+            avg_len = self.total_len / n
+            scores = defaultdict(float)
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = self._idf(n, len(docs))
+                for record_id, tf in docs.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[record_id] / avg_len)
+                    scores[record_id] += idf * tf * (self.k1 + 1) / norm
+            if normalize:
+                unique_idf = self._idf(n, 1)
+                scores = {rid: s / unique_idf for rid, s in scores.items()}
+            if where:
+                scores = {rid: s for rid, s in scores.items() if where(self.docs[rid][1])}
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    @staticmethod
+    def _idf(n, df):
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def get(self, record_id: str):
+        with self.lock:
+            return self.docs.get(record_id)
+
+
+def reciprocal_rank_fusion(rankings: list, k: int = 60) -> list:
+    """RRF: score(d) = Σ 1 / (k + rank). rankings — списки id по убыванию релевантности."""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, record_id in enumerate(ranking, start=1):
+            scores[record_id] += 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -7,34 +7,72 @@ from PySide6.QtCore import Qt
 from dotenv import load_dotenv
 import os
 import sys
+import time
 
 from openrouter_client import OpenRouterClient
 from database_handler import DatabaseHandler
 from chroma_mem import ChromaHandler
 from aurora_window import MainWindow
 from memory_agent import MemoryAgent
+from memory_gate import MemoryGate
+from planning_cache import PlanningCache
+from history_manager import HistoryManager
+from memory_tiering import MemoryTiering
+from memory_write_queue import MemoryWriteQueue
 from chat_tts.chatts import AudioManager
+from lazy_loader import StartupLoader
+from tracing import configure_tracing
+from turn_recorder import configure_recording, RecordingClient, RecordingChroma
 
 
 def main():
+    started = time.perf_counter()
     load_dotenv("keys.env")
     
     app = QApplication([])
+    configure_tracing()
 
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
     if not OPENROUTER_API_KEY:
         raise ValueError("OPENROUTER_API_KEY не найден в keys.env")
-    
-    client = OpenRouterClient(OPENROUTER_API_KEY)
-    mongodb = DatabaseHandler()
-    chroma_memory = ChromaHandler()
-    memory_agent = MemoryAgent(client, chroma_memory)
-    audio_manager = AudioManager()
 
-    window = MainWindow(client, mongodb, chroma_memory, memory_agent, audio_manager)
+    # Тяжёлые компоненты грузятся параллельно в фоне, окно получает прокси
+    loader = StartupLoader()
+
+    client = loader.add("OpenRouter", lambda: OpenRouterClient(
+        OPENROUTER_API_KEY,
+        hedge=os.getenv("OPENROUTER_HEDGE") == "1"
+    ))
+    mongodb = loader.add("MongoDB", lambda: DatabaseHandler(
+        user_id=os.getenv("AURORA_USER_ID", "andrey"),
+        persona=os.getenv("AURORA_PERSONA", "aurora")
+    ))
+    chroma_memory = loader.add("Chroma", ChromaHandler)
+    write_queue = None
+    if os.getenv("AURORA_WRITE_BEHIND", "1") != "0":
+        # Записи агента в память уходят в журнал и пишутся в Chroma фоновым потоком
+        write_queue = chroma_memory = MemoryWriteQueue(chroma_memory).start()
+    if configure_recording():
+        # Запись ходов для turn_replay.py: вызовы LLM и поиск идут через записывающие прокси
+        client = RecordingClient(client)
+        chroma_memory = RecordingChroma(chroma_memory)
+    memory_gate = loader.add("MemoryGate", lambda: MemoryGate(chroma_memory.embeddings))
+    planning_cache = loader.add("PlanningCache", lambda: PlanningCache(chroma_memory))
+    loader.add("Tiering", lambda: MemoryTiering(chroma_memory).start())
+    audio_manager = loader.add("TTS", AudioManager)
+    history = HistoryManager(mongodb, client)
+    memory_agent = MemoryAgent(client, chroma_memory, gate=memory_gate, planning_cache=planning_cache, history=history)
+
+    window = MainWindow(client, mongodb, chroma_memory, memory_agent, audio_manager, history)
+    window.watch_startup(loader)
     window.show()
+    loader.seal()
+    print(f"[Startup] Окно показано через {time.perf_counter() - started:.2f} с")
 
-    sys.exit(app.exec())
+    code = app.exec()
+    if write_queue:
+        write_queue.stop()
+    sys.exit(code)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -139,4 +139,23 @@ FINAL_EXAMPLES_PROMPT = '''
   "final_answer": "Вау! Ты же давно мечтал про фантастику — это же круто! Давай, я буду первой читательницей? Могу даже ругать за персонажей, если что...",
   "mood": "excited"
 }
-'''
\ No newline at end of file
+'''
+
+
+DIALOGUE_SUMMARY_PROMPT = '''
+# ТЫ — ЛЕТОПИСЕЦ ДИАЛОГА АВРОРЫ И АНДРЕЯ
+Твоя задача — поддерживать **краткое содержание старой части разговора**, которая уже не помещается в контекст.
+
+## ВХОДНЫЕ ДАННЫЕ
+- Текущее краткое содержание (может быть пустым).
+- Новые старые реплики, которые нужно в него добавить.
+
+## ПРАВИЛА
+- Пиши по-русски, от третьего лица, в прошедшем времени: "Андрей рассказал...", "Аврора предложила...".
+- Сохраняй темы, договорённости, вопросы без ответа и эмоциональный тон разговора.
+- Не повторяй то, что уже есть в кратком содержании, — дополняй и сжимай.
+- Не больше {max_words} слов. Если не помещается — выкидывай самое старое и малозначимое.
+
+## ФОРМАТ ОТВЕТА
+JSON с единственным полем `summary`.
+'''
@@ -1,36 +1,61 @@
+import os
+
 from openrouter_client import OpenRouterClient
 from chroma_mem import ChromaHandler
-from openrouter_schemas import MEMORY_AGENT_FINAL_SCHEMA, MEMORY_AGENT_PLANNING_SCHEMA
-from memory_agent_prompts import MEMORY_AGENT_PLANNING_PROMPT, MEMORY_AGENT_FINAL_PROMPT
+from openrouter_schemas import MEMORY_AGENT_FINAL_SCHEMA, MEMORY_AGENT_PLANNING_SCHEMA, MEMORY_AGENT_COMBINED_SCHEMA
+from memory_agent_prompts import MEMORY_AGENT_PLANNING_PROMPT, MEMORY_AGENT_FINAL_PROMPT, MEMORY_AGENT_COMBINED_PROMPT
+from memory_gate import MemoryGate, log_phase1_decision
+from planning_cache import PlanningCache
+from memory_tiering import is_explicit_recall
+from tracing import tracer, traced, current_span
+from prompt_builder import build_phase_messages
+
+# two_phase — планирование и менеджер памяти отдельными вызовами;
+# single_call — поиск по реплике заранее и одно решение на всё (см. activate_memory_agent_combined)
+AGENT_MODES = ("two_phase", "single_call")
 
 class MemoryAgent():
-    def __init__(self, client: OpenRouterClient, chroma: ChromaHandler, model_name: str = "openai/gpt-oss-20b:free"):
+    def __init__(self, client: OpenRouterClient, chroma: ChromaHandler, model_name: str = "openai/gpt-oss-20b:free", gate: MemoryGate = None, planning_cache: PlanningCache = None, history=None, log_decisions: bool = True, mode: str = None):
         self.client = client
         self.chroma = chroma
         self.model_name = model_name
+        self.gate = gate
+        self.planning_cache = planning_cache
+        self.history = history
+        # Лог решений фазы 1 — обучающие данные гейта; при воспроизведении ходов отключается
+        self.log_decisions = log_decisions
+        self.mode = mode or os.getenv("AURORA_AGENT_MODE", "two_phase")
+        if self.mode not in AGENT_MODES:
+            print(f"[MemoryAgent] Неизвестный режим {self.mode!r}, используется two_phase")
+            self.mode = "two_phase"
 
-    def build_system_prompt(self, memory_step, user_request: str, dialogue_context: list = None, first_step_response: dict = None):
+    def build_messages(self, memory_step, user_request: str, dialogue_context: list = None, first_step_response: dict = None, prefetched_search: tuple = None):
+        # Промпт фазы неизменен и идёт первым (кэшируется провайдером), данные хода — после
+        dynamic_prompt = self.build_system_prompt(memory_step, user_request, dialogue_context, first_step_response, prefetched_search)
+        return build_phase_messages(memory_step, dynamic_prompt)
+
+    def build_system_prompt(self, memory_step, user_request: str, dialogue_context: list = None, first_step_response: dict = None, prefetched_search: tuple = None):
+        """Динамическая часть промпта фазы: история, реплика, найденные записи."""
         prompt_parts = []
         
         if memory_step == MEMORY_AGENT_PLANNING_PROMPT:
-            history_parts = []
-            start_idx = max(0, len(dialogue_context) - 11)
-            for msg in dialogue_context[start_idx:-1]:  # все кроме последнего (это user_request)
-                history_parts.append(f"{msg['role']}: {msg['content']}")
-            history = "Последние сообщения в диалоге: " + ". ".join(history_parts) + "."
-            history += f" Сейчас пользователь написал: '{user_request}'."
-
-            prompt_parts.append(MEMORY_AGENT_PLANNING_PROMPT)
-            prompt_parts.append(history)
+            prompt_parts.append(self.format_planning_history(user_request, dialogue_context))
             return "\n\n".join(prompt_parts)
 
         elif memory_step == MEMORY_AGENT_FINAL_PROMPT:
             query = first_step_response.get("memory_query", "").strip()
             if not query:
                 relevant_memories = []
+            elif is_explicit_recall(user_request):
+                # Явное "помнишь..." — ищем и в холодном архиве
+                relevant_memories = self.chroma.search_memory(query, include_archive=True)
+            elif prefetched_search and prefetched_search[0].strip() == query:
+                # Поиск по этому же тексту уже запущен заранее — просто ждём его
+                relevant_memories = prefetched_search[1].result()
+                self.chroma.accept_search_results(relevant_memories)
+                print("[MemoryAgent] Используется предзагруженный поиск")
             else:
                 relevant_memories = self.chroma.search_memory(query)
-            prompt_parts.append(MEMORY_AGENT_FINAL_PROMPT)
             prompt_parts.append(f"Сейчас пользователь написал: '{user_request}'.")
 
             if first_step_response.get("is_new_info"):
@@ -51,10 +76,45 @@ class MemoryAgent():
                 )
 
             return "\n\n".join(prompt_parts)
+
+    def format_planning_history(self, user_request: str, dialogue_context: list) -> str:
+        history_parts = []
+        if self.history:
+            recent = self.history.window("planning", dialogue_context)
+        else:
+            recent = dialogue_context[max(0, len(dialogue_context) - 11):]
+        for msg in recent[:-1]:  # все кроме последнего (это user_request)
+            history_parts.append(f"{msg['role']}: {msg['content']}")
+        history = "Последние сообщения в диалоге: " + ". ".join(history_parts) + "."
+        history += f" Сейчас пользователь написал: '{user_request}'."
+        return history
     
     def activate_memory_agent_phase1(self, user_request, dialogue_context):
-        system_prompt = self.build_system_prompt(MEMORY_AGENT_PLANNING_PROMPT, user_request, dialogue_context)
-        messages = [{"role": "system", "content": system_prompt}]
+        with tracer.span("phase1", context_messages=len(dialogue_context or [])) as span:
+            response, source = self._plan(user_request, dialogue_context)
+            span.set("source", source)
+            if isinstance(response, dict):
+                span.update(requires_memory=bool(response.get("requires_memory")),
+                            is_new_info=bool(response.get("is_new_info")))
+            return response
+
+    def _plan(self, user_request, dialogue_context):
+        """Решение фазы 1 и его источник: gate, cache или llm."""
+        if self.gate:
+            try:
+                gated = self.gate.try_skip(user_request)
+            except Exception as e:
+                print(f"[MemoryGate] Гейт недоступен: {e}")
+                gated = None
+            if gated:
+                return gated, "gate"
+
+        if self.planning_cache:
+            cached = self.planning_cache.lookup(user_request, dialogue_context)
+            if cached:
+                return cached, "cache"
+
+        messages = self.build_messages(MEMORY_AGENT_PLANNING_PROMPT, user_request, dialogue_context)
         
         print("\n[MemoryAgent:Phase1] Отправляем промпт:")
         print(dialogue_context)
@@ -62,21 +122,29 @@ class MemoryAgent():
         response = self.client.chat_completion(
             self.model_name,
             messages,
-            schema=MEMORY_AGENT_PLANNING_SCHEMA
+            schema=MEMORY_AGENT_PLANNING_SCHEMA,
+            phase="planning"
         )
         
         print("\n[MemoryAgent:Phase1] Полный ответ API:")
         print(response)
-        return response
+        if self.log_decisions:
+            log_phase1_decision(user_request, response)
+        if self.planning_cache:
+            self.planning_cache.store(user_request, dialogue_context, response)
+        return response, "llm"
 
-    def activate_memory_agent_phase2(self, user_request, dialogue_context, first_step_response):
-        system_prompt = self.build_system_prompt(
+    @traced("phase2")
+    def activate_memory_agent_phase2(self, user_request, dialogue_context, first_step_response, prefetched_search=None):
+        """prefetched_search — (запрос, Future) спекулятивного поиска, запущенного
+        параллельно с фазой 1; используется, если memory_query с ним совпал."""
+        messages = self.build_messages(
             MEMORY_AGENT_FINAL_PROMPT,
             user_request,
             dialogue_context,
-            first_step_response
+            first_step_response,
+            prefetched_search
         )
-        messages = [{"role": "system", "content": system_prompt}]
         
         print("\n[MemoryAgent:Phase2] Отправляем промпт:")
         print(dialogue_context)
@@ -84,7 +152,8 @@ class MemoryAgent():
         second_response = self.client.chat_completion(
             self.model_name,
             messages,
-            schema=MEMORY_AGENT_FINAL_SCHEMA
+            schema=MEMORY_AGENT_FINAL_SCHEMA,
+            phase="memory"
         )
         
         print("\n[MemoryAgent:Phase2] Полный ответ API:")
@@ -101,8 +170,90 @@ class MemoryAgent():
             relevant_memories = second_response.get("relevant_memories", [])
             print(f"[MemoryAgent] Передаем Авроре релевантные старые записи: {relevant_memories}")
 
+        span = current_span()
+        span.set("relevant", len(relevant_memories))
+        if isinstance(second_response, dict):
+            span.set("action", (second_response.get("new_memory_action") or {}).get("action"))
+
         return relevant_memories
             
+    def activate_memory_agent_combined(self, user_request, dialogue_context, prefetched_search=None):
+        """Однопроходный режим: поиск по самой реплике и один вызов, который
+        возвращает и флаги фазы 1, и отбор записей, и действие с памятью.
+
+        Возвращает (decision, relevant_memories); decision — в формате ответа
+        фазы 1, чтобы лог гейта и запись ходов не отличали режимы.
+        """
+        with tracer.span("agent.combined", context_messages=len(dialogue_context or [])) as span:
+            if self.gate:
+                try:
+                    gated = self.gate.try_skip(user_request)
+                except Exception as e:
+                    print(f"[MemoryGate] Гейт недоступен: {e}")
+                    gated = None
+                if gated:
+                    span.update(source="gate", requires_memory=False, is_new_info=False)
+                    return gated, []
+
+            if is_explicit_recall(user_request):
+                candidates = self.chroma.search_memory(user_request, include_archive=True)
+            elif prefetched_search and prefetched_search[0].strip() == user_request.strip():
+                candidates = prefetched_search[1].result()
+                self.chroma.accept_search_results(candidates)
+            else:
+                candidates = self.chroma.search_memory(user_request)
+
+            dynamic_prompt = self.format_planning_history(user_request, dialogue_context)
+            dynamic_prompt += f"\n\nВ памяти найдены следующие записи, похожие на реплику: {candidates}"
+            messages = build_phase_messages(MEMORY_AGENT_COMBINED_PROMPT, dynamic_prompt)
+
+            print("\n[MemoryAgent:Combined] Отправляем промпт:")
+            print(dialogue_context)
+
+            response = self.client.chat_completion(
+                self.model_name,
+                messages,
+                schema=MEMORY_AGENT_COMBINED_SCHEMA,
+                phase="combined"
+            )
+
+            print("\n[MemoryAgent:Combined] Полный ответ API:")
+            print(response)
+            if not isinstance(response, dict):
+                span.set("source", "error")
+                return {}, []
+
+            new_action = response.get("new_memory_action") or {}
+            new_memory = new_action.get("new_memory") or {}
+            decision = {
+                "thoughts": response.get("thoughts", ""),
+                "is_new_info": bool(response.get("is_new_info")),
+                "new_memory_record": new_memory.get("text"),
+                "category": new_memory.get("category"),
+                "importance": new_memory.get("importance"),
+                "requires_memory": bool(response.get("requires_memory")),
+                "memory_query": user_request if response.get("requires_memory") else "",
+            }
+            if self.log_decisions:
+                log_phase1_decision(user_request, decision)
+
+            if decision["is_new_info"]:
+                self.apply_memory_action(response)
+                print("[MemoryAgent] Новая информация сохранена в память.")
+
+            relevant_memories = []
+            if decision["requires_memory"]:
+                # Модель может вернуть только то, что ей показали, — чужие id отбрасываем
+                known = {m.get("id") for m in candidates}
+                relevant_memories = [m for m in response.get("relevant_memories", []) if m.get("id") in known]
+                print(f"[MemoryAgent] Передаем Авроре релевантные старые записи: {relevant_memories}")
+
+            span.update(source="llm", candidates=len(candidates), relevant=len(relevant_memories),
+                        requires_memory=decision["requires_memory"], is_new_info=decision["is_new_info"],
+                        action=new_action.get("action"))
+            return decision, relevant_memories
+
+    @traced("memory.apply")
     def apply_memory_action(self, action_response: dict):
         print("\n[MemoryAgent] Разбираем действие с памятью...")
         new_action = action_response.get("new_memory_action", {})
@@ -118,24 +269,22 @@ class MemoryAgent():
 
         print(f"[MemoryAgent] Действие: {action}, old_id={old_id}, new_memory={new_memory}")
 
-        if action == "update" and new_memory:
-            if old_id:
-                self.chroma.delete_record(old_id)
-                print(f"[MemoryAgent] Удалена старая запись: {old_id}")
-            self.chroma.add_record(
-                text=new_memory["text"],
-                category=new_memory["category"],
-                importance=new_memory["importance"]
-            )
-            print(f"[MemoryAgent] Добавлена новая запись: {new_memory['text']}")
-
-        elif action == "create" and new_memory:
-            self.chroma.add_record(
-                text=new_memory["text"],
-                category=new_memory["category"],
-                importance=new_memory["importance"]
-            )
-            print(f"[MemoryAgent] Добавлена новая запись: {new_memory['text']}")
+        if action in ("update", "create") and new_memory:
+            record = {
+                "text": new_memory["text"],
+                "category": new_memory["category"],
+                "importance": new_memory["importance"]
+            }
+            if action == "update":
+                # Удаление старой записи и запись новой — одним пакетным вызовом
+                report = self.chroma.upsert_records([dict(record, replaces=old_id)])
+            else:
+                report = self.chroma.add_records([record])
+            if report.get("queued"):
+                print(f"[MemoryAgent] {action}: в очереди на запись {len(report['queued'])}")
+            else:
+                print(f"[MemoryAgent] {action}: добавлено {len(report['added'])}, "
+                      f"обновлено {len(report['merged'])}, пропущено {len(report['skipped'])}")
 
         elif action == "skip":
             print("[MemoryAgent] Новая запись пропущена (дубль или неактуальна)")
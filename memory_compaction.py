@@ -0,0 +1,164 @@
+"""Офлайн-компактизация памяти: склейка почти одинаковых записей в preferences.
+
+Все эмбеддинги грузятся постранично в одну float16-матрицу (100k × 1024 ≈ 200 МБ),
+косинусная близость считается блоками block × block, так что пиковая память
+не зависит от числа записей квадратично. Пары выше порога собираются в
+кластеры (union-find), в каждом остаётся одна запись, остальные удаляются.
+
+    python memory_compaction.py                      # dry-run, только отчёт
+    python memory_compaction.py --apply --threshold 0.9
+
+Запускать при закрытом приложении: ChromaHandler пересобирает критические
+границы и BM25-индекс при старте.
+"""
+import argparse
+import json
+from datetime import datetime
+
+import numpy as np
+
+IMPORTANCE_RANK = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+
+
+def load_memories(collection, page: int = 5000):
+    ids, documents, metadatas, blocks = [], [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(limit=page, offset=offset, include=["documents", "metadatas", "embeddings"])
+        if not batch["ids"]:
+            break
+        vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+        vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        blocks.append(vectors.astype(np.float16))
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(batch["metadatas"])
+        offset += len(batch["ids"])
+    matrix = np.concatenate(blocks) if blocks else np.zeros((0, 0), dtype=np.float16)
+    return ids, documents, metadatas, matrix
+
+
+class UnionFind():
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def find_clusters(matrix, threshold: float, block: int = 2048, categories: list = None):
+    """Кластеры индексов с попарной близостью ≥ threshold (через транзитивность)."""
+    n = len(matrix)
+    uf = UnionFind(n)
+    categories = np.asarray(categories) if categories is not None else None
+
+    for i0 in range(0, n, block):
+        rows = matrix[i0:i0 + block].astype(np.float32)
+        for j0 in range(i0, n, block):
+            cols = matrix[j0:j0 + block].astype(np.float32)
+            sims = rows @ cols.T
+            if i0 == j0:
+                sims = np.triu(sims, k=1)  # только пары i < j, без диагонали
+            for a, b in zip(*np.nonzero(sims >= threshold)):
+                i, j = i0 + a, j0 + b
+                if categories is None or categories[i] == categories[j]:
+                    uf.union(i, j)
+
+    clusters = {}
+    for i in range(n):
+        clusters.setdefault(uf.find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, "%d.%m.%y")
+    except (TypeError, ValueError):
+        return datetime.min
+
+
+def plan_cluster(members, documents, metadatas):
+    """Кто остаётся: важнейшая, потом самая свежая, потом самая подробная запись.
+    Важность выжившей поднимается до максимальной в кластере."""
+    survivor = max(members, key=lambda i: (
+        IMPORTANCE_RANK.get(metadatas[i].get("importance"), 0),
+        _parse_date(metadatas[i].get("creation_date")),
+        len(documents[i])
+    ))
+    top_importance = max((metadatas[i].get("importance") for i in members),
+                         key=lambda imp: IMPORTANCE_RANK.get(imp, 0))
+    return survivor, [i for i in members if i != survivor], top_importance
+
+
+def compact(collection, threshold: float = 0.9, block: int = 2048, same_category: bool = True, apply: bool = False):
+    ids, documents, metadatas, matrix = load_memories(collection)
+    print(f"[Compaction] Записей: {len(ids)}, матрица {matrix.shape} float16 ({matrix.nbytes / 2**20:.0f} МБ)")
+    if not ids:
+        return {"clusters": [], "retired": 0}
+
+    categories = [m.get("category") for m in metadatas] if same_category else None
+    clusters = find_clusters(matrix, threshold, block, categories)
+
+    report = {"threshold": threshold, "records": len(ids), "clusters": [], "retired": 0}
+    retire_ids, updates = [], []
+    for members in clusters:
+        survivor, retired, top_importance = plan_cluster(members, documents, metadatas)
+        report["clusters"].append({
+            "keep": {"id": ids[survivor], "text": documents[survivor]},
+            "retire": [{"id": ids[i], "text": documents[i]} for i in retired],
+            "importance": top_importance
+        })
+        retire_ids.extend(ids[i] for i in retired)
+        if top_importance != metadatas[survivor].get("importance"):
+            updates.append((ids[survivor], dict(metadatas[survivor], importance=top_importance)))
+    report["retired"] = len(retire_ids)
+
+    print(f"[Compaction] Кластеров: {len(clusters)}, к удалению: {len(retire_ids)}, "
+          f"повышение важности: {len(updates)}")
+    for cluster in report["clusters"][:20]:
+        print(f"  ✔ {cluster['keep']['text']}")
+        for retired in cluster["retire"]:
+            print(f"    ✘ {retired['text']}")
+
+    if apply:
+        if updates:
+            collection.update(ids=[i for i, _ in updates], metadatas=[m for _, m in updates])
+        for start in range(0, len(retire_ids), 5000):
+            collection.delete(ids=retire_ids[start:start + 5000])
+        print(f"[Compaction] Применено: удалено {len(retire_ids)}")
+    else:
+        print("[Compaction] Dry-run: ничего не изменено (--apply для применения)")
+    return report
+
+
+def main():
+    import chromadb
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threshold", type=float, default=0.9, help="косинусная близость для склейки")
+    parser.add_argument("--block", type=int, default=2048, help="размер блока матрицы близости")
+    parser.add_argument("--any-category", action="store_true", help="склеивать записи разных категорий")
+    parser.add_argument("--apply", action="store_true")
+    parser.add_argument("--report", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    collection = chromadb.PersistentClient(path="./chroma_db").get_or_create_collection(
+        name="preferences",
+        metadata={"hnsw:space": "cosine"}
+    )
+    report = compact(collection, args.threshold, args.block, not args.any_category, args.apply)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import json
+import os
+from datetime import datetime
+
+import numpy as np
+
+PHASE1_LOG_PATH = "phase1_log.jsonl"
+GATE_PATH = "memory_gate.npz"
+FLAGS = ("requires_memory", "is_new_info")
+
+# Стартовые примеры, пока не накопился лог решений фазы 1: (текст, requires_memory, is_new_info)
+SEED_EXAMPLES = [
+    ("привет", False, False),
+    ("приветик", False, False),
+    ("доброе утро", False, False),
+    ("спокойной ночи", False, False),
+    ("ок", False, False),
+    ("ага", False, False),
+    ("понятно", False, False),
+    ("спасибо", False, False),
+    ("как дела?", False, False),
+    ("хаха", False, False),
+    ("пока", False, False),
+    ("ну ладно", False, False),
+    ("помнишь, что я тебе рассказывал про работу?", True, False),
+    ("какую игру я сейчас прохожу?", True, False),
+    ("что ты знаешь о моих планах?", True, False),
+    ("напомни, что я обещал другу", True, False),
+    ("я бросил кофе", False, True),
+    ("я начал учить японский", True, True),
+    ("не говори со мной про мою семью", False, True),
+    ("в субботу еду к родителям", True, True),
+]
+
+
+def log_phase1_decision(user_request: str, response: dict, path: str = PHASE1_LOG_PATH):
+    """Дописывает решение фазы 1 в JSONL — из этого лога потом учится гейт."""
+    if not isinstance(response, dict):
+        return
+    record = {
+        "user_request": user_request,
+        "requires_memory": bool(response.get("requires_memory", False)),
+        "is_new_info": bool(response.get("is_new_info", False)),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+    }
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"[MemoryGate] Не удалось записать лог фазы 1: {e}")
+
+
+def load_phase1_log(path: str = PHASE1_LOG_PATH):
+    examples = []
+    if not os.path.exists(path):
+        return examples
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            examples.append((rec["user_request"], rec["requires_memory"], rec["is_new_info"]))
+    return examples
+
+
+class MemoryGate():
+    """Локальный классификатор флагов фазы 1 поверх эмбеддингов ChromaHandler.
+
+    Nearest-centroid: для каждого флага хранится центроид примеров "да" и "нет",
+    уверенность — сигмоида разницы косинусных близостей. Фазу 1 гейт пропускает
+    только для уверенно "пустых" реплик (оба флага False) — остальным нужен
+    memory_query / new_memory_record, которые умеет только LLM.
+
+    embeddings — EmbeddingCache того же движка, что у поиска (torch или onnx):
+    центроиды имеют смысл только в том пространстве, где их обучили, поэтому
+    в файле гейта хранится ключ модели, и чужой файл не загружается.
+    """
+
+    def __init__(self, embeddings, path: str = GATE_PATH, threshold: float = 0.9, temperature: float = 0.05):
+        self.embeddings = embeddings
+        self.path = path
+        self.threshold = threshold
+        self.temperature = temperature
+        self.centroids = {}
+
+        if os.path.exists(path) and self.load(path):
+            return
+        self.fit(SEED_EXAMPLES)
+
+    def encode(self, texts):
+        vectors = self.embeddings.encode_many(list(texts))
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def fit(self, examples, embeddings=None):
+        if embeddings is None:
+            embeddings = self.encode([text for text, _, _ in examples])
+        labels = np.array([[req, new] for _, req, new in examples], dtype=bool)
+
+        self.centroids = {}
+        for i, flag in enumerate(FLAGS):
+            pos, neg = embeddings[labels[:, i]], embeddings[~labels[:, i]]
+            if len(pos) == 0 or len(neg) == 0:
+                print(f"[MemoryGate] Нет примеров обоих классов для {flag}, гейт выключен")
+                self.centroids = {}
+                return
+            self.centroids[flag] = np.stack([self._unit(neg.mean(axis=0)), self._unit(pos.mean(axis=0))])
+
+    def save(self, path: str = None):
+        np.savez(path or self.path, model_key=np.array(self.embeddings.model_name), **self.centroids)
+
+    def load(self, path: str) -> bool:
+        data = np.load(path)
+        model_key = str(data["model_key"]) if "model_key" in data else None
+        if model_key != self.embeddings.model_name:
+            print(f"[MemoryGate] {path} обучен на других эмбеддингах ({model_key}), "
+                  f"сейчас {self.embeddings.model_name} — берутся стартовые примеры")
+            return False
+        self.centroids = {flag: data[flag] for flag in FLAGS if flag in data}
+        return True
+
+    def predict_embedding(self, embedding):
+        """Возвращает {flag: (значение, уверенность)}."""
+        prediction = {}
+        for flag, centroids in self.centroids.items():
+            sim_neg, sim_pos = centroids @ embedding
+            p_true = 1.0 / (1.0 + np.exp(-(sim_pos - sim_neg) / self.temperature))
+            prediction[flag] = (bool(p_true >= 0.5), float(max(p_true, 1.0 - p_true)))
+        return prediction
+
+    def predict(self, text: str):
+        return self.predict_embedding(self.encode([text])[0])
+
+    def try_skip(self, user_request: str):
+        """Готовый ответ фазы 1 для уверенно простых реплик, иначе None."""
+        if not self.centroids:
+            return None
+        prediction = self.predict(user_request)
+        confident_empty = all(
+            not value and confidence >= self.threshold
+            for value, confidence in prediction.values()
+        )
+        if not confident_empty:
+            return None
+
+        print(f"[MemoryGate] Фаза 1 пропущена локально: {prediction}")
+        return {
+            "thoughts": "Локальный гейт: реплика не требует работы с памятью.",
+            "is_new_info": False,
+            "new_memory_record": None,
+            "category": None,
+            "importance": None,
+            "requires_memory": False,
+            "memory_query": "",
+        }
+
+    @staticmethod
+    def _unit(vec):
+        return vec / (np.linalg.norm(vec) or 1.0)
@@ -0,0 +1,283 @@
+"""Офлайн-импорт долговременной памяти из старой переписки.
+
+Читает лог потоком (сессии пользователя из коллекции phrases в Mongo или
+JSONL-экспорт с полями role / content / timestamp), режет каждый диалог на
+окна, извлекает из окон записи памяти параллельно и пишет их в коллекцию
+preferences пачками через ChromaHandler.add_records (батч-эмбеддинги +
+дедупликация). В чекпойнт по каждому диалогу пишется позиция последнего
+полного окна, повторный запуск продолжает с неё и подхватывает дописанное.
+
+    python memory_import.py --source mongo --extractor heuristic --workers 8
+    python memory_import.py --source export.jsonl --extractor llm --executor thread
+"""
+import abc
+import argparse
+import importlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from memory_agent_prompts import MEMORY_IMPORT_PROMPT
+from openrouter_schemas import MEMORY_IMPORT_SCHEMA
+
+CHECKPOINT_PATH = "memory_import.checkpoint.json"
+
+
+class MemoryExtractor(abc.ABC):
+    """Интерфейс извлечения: окно реплик → [{"text", "category", "importance"}]."""
+
+    @abc.abstractmethod
+    def extract(self, window: list) -> list:
+        """Записи памяти, найденные в окне."""
+
+
+class LLMExtractor(MemoryExtractor):
+    def __init__(self, model_name: str = "openai/gpt-oss-20b:free"):
+        from dotenv import load_dotenv
+        from openrouter_client import OpenRouterClient
+
+        load_dotenv("keys.env")
+        self.client = OpenRouterClient(os.getenv("OPENROUTER_API_KEY"))
+        self.model_name = model_name
+
+    def extract(self, window):
+        dialogue = "\n".join(f"{msg['role']}: {msg['content']}" for msg in window)
+        messages = [
+            {"role": "system", "content": MEMORY_IMPORT_PROMPT},
+            {"role": "user", "content": dialogue},
+        ]
+        response = self.client.chat_completion(self.model_name, messages, schema=MEMORY_IMPORT_SCHEMA, phase="import")
+        if not isinstance(response, dict):
+            print(f"[Import] Ошибка извлечения: {response}")
+            return []
+        return response.get("memories", [])
+
+
+class HeuristicExtractor(MemoryExtractor):
+    """Локальная замена LLM: реплики Андрея от первого лица с явными маркерами."""
+
+    RULES = [
+        (re.compile(r"\bне (говори|напоминай|шути)\b", re.I), "boundaries", "critical"),
+        (re.compile(r"\b(обещал|обещаю)\b", re.I), "promises", "medium"),
+        (re.compile(r"\b(хочу|планирую|собираюсь|мечтаю)\b", re.I), "goals", "medium"),
+        (re.compile(r"\b(учу|изучаю|учусь)\b", re.I), "skills", "medium"),
+        (re.compile(r"\b(каждый день|по утрам|по вечерам|обычно|встаю|бросил)\b", re.I), "habits", "high"),
+        (re.compile(r"\b(люблю|обожаю|нравится|не люблю|ненавижу)\b", re.I), "preferences", "medium"),
+        (re.compile(r"\b(меня зовут|мне \d+|я работаю|я живу)\b", re.I), "identity", "high"),
+    ]
+    FIRST_PERSON = re.compile(r"\b(я|мне|меня|мой|моя|моё|мои|у меня)\b", re.I)
+
+    def extract(self, window):
+        memories = []
+        for msg in window:
+            if msg.get("role") != "user":
+                continue
+            for sentence in re.split(r"(?<=[.!?…])\s+", msg.get("content", "")):
+                sentence = sentence.strip()
+                if len(sentence) < 8 or sentence.endswith("?") or not self.FIRST_PERSON.search(sentence):
+                    continue
+                for pattern, category, importance in self.RULES:
+                    if pattern.search(sentence):
+                        memories.append({"text": sentence, "category": category, "importance": importance})
+                        break
+        return memories
+
+
+EXTRACTORS = {
+    "llm": LLMExtractor,
+    "heuristic": HeuristicExtractor,
+}
+
+
+def make_extractor(name: str) -> MemoryExtractor:
+    """Имя из EXTRACTORS или "модуль:Класс" для своей реализации."""
+    if name in EXTRACTORS:
+        return EXTRACTORS[name]()
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+# Экстрактор живёт в каждом процессе-воркере отдельно
+_worker_extractor = None
+
+
+def _init_worker(extractor_name):
+    global _worker_extractor
+    _worker_extractor = make_extractor(extractor_name)
+
+
+def _extract_window(window):
+    try:
+        return _worker_extractor.extract(window)
+    except Exception as e:
+        print(f"[Import] Ошибка в окне: {e}")
+        return []
+
+
+def iter_messages(source: str, done: dict = None, user_id: str = "andrey", persona: str = "aurora",
+                  batch_size: int = 1000):
+    """Поток (диалог, позиция, реплика) старое → новое, без загрузки лога целиком в память.
+
+    Mongo читается по сессиям пользователя, каждая — по индексу (session_id,
+    timestamp); позиция — timestamp реплики. В JSONL диалог — поле session_id
+    (если есть), позиция — номер строки. done — {диалог: позиция} уже
+    импортированного: реплики до неё включительно пропускаются."""
+    done = done or {}
+    if source == "mongo":
+        from pymongo import MongoClient
+
+        db = MongoClient("mongodb://localhost:27017/")["aurora_db"]
+        sessions = db["sessions"].find({"user_id": user_id, "persona": persona}, {"started_at": 1})
+        for session in sorted(sessions, key=lambda session: session.get("started_at") or datetime.min):
+            query = {"session_id": session["_id"]}
+            if session["_id"] in done:
+                query["timestamp"] = {"$gt": datetime.fromisoformat(done[session["_id"]])}
+            cursor = db["phrases"].find(query, {"role": 1, "content": 1, "timestamp": 1}).sort("timestamp", 1).batch_size(batch_size)
+            for record in cursor:
+                yield session["_id"], record["timestamp"].isoformat(), \
+                    {"role": record.get("role"), "content": record.get("content", "")}
+        return
+
+    with open(source, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            stream = record.get("session_id") or ""
+            if line_number <= done.get(stream, 0):
+                continue
+            yield stream, line_number, {"role": record.get("role"), "content": record.get("content", "")}
+
+
+def iter_windows(messages, size: int):
+    """(диалог, позиция, окно) по size реплик; окно не переходит из диалога в диалог.
+
+    Позиция — последней реплики окна, у неполного хвоста диалога — None: в него
+    ещё могут дописать реплики, поэтому он извлекается, но в чекпойнт не идёт."""
+    window, stream = [], None
+    for message_stream, position, msg in messages:
+        if window and message_stream != stream:
+            yield stream, None, window
+            window = []
+        stream = message_stream
+        window.append(msg)
+        if len(window) == size:
+            yield stream, position, window
+            window = []
+    if window:
+        yield stream, None, window
+
+
+def load_checkpoint(path, source):
+    if not os.path.exists(path):
+        return {"source": source, "done": {}, "messages": 0, "candidates": 0, "added": 0, "skipped": 0}
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("source") != source:
+        raise ValueError(f"Чекпойнт {path} относится к другому источнику: {checkpoint.get('source')}")
+    checkpoint.setdefault("done", {})
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def run_import(source, extractor_name, chroma, workers, executor_kind, window_size, write_batch, checkpoint_path,
+               user_id: str = "andrey", persona: str = "aurora"):
+    checkpoint = load_checkpoint(checkpoint_path, source)
+    if checkpoint["done"]:
+        print(f"[Import] Продолжаем: диалогов с импортированными окнами {len(checkpoint['done'])}")
+
+    pool_class = ProcessPoolExecutor if executor_kind == "process" else ThreadPoolExecutor
+    messages = iter_messages(source, checkpoint["done"], user_id=user_id, persona=persona)
+    windows = iter_windows(messages, window_size)
+    started = time.perf_counter()
+    session = {"windows": 0, "messages": 0, "added": 0}
+    pending, pending_done, pending_messages = [], {}, 0
+
+    def flush():
+        nonlocal pending, pending_done, pending_messages
+        if pending:
+            report = chroma.add_records(pending)
+            checkpoint["added"] += len(report["added"])
+            checkpoint["skipped"] += len(report["skipped"])
+            session["added"] += len(report["added"])
+        checkpoint["done"].update(pending_done)
+        checkpoint["messages"] += pending_messages
+        save_checkpoint(checkpoint_path, checkpoint)
+        pending, pending_done, pending_messages = [], {}, 0
+
+        elapsed = time.perf_counter() - started
+        print(f"[Import] окон {session['windows']}, реплик {checkpoint['messages']}, "
+              f"добавлено {checkpoint['added']}, дублей {checkpoint['skipped']} | "
+              f"{session['messages'] / elapsed:.1f} реплик/с, {session['added'] / elapsed:.2f} записей/с")
+
+    with pool_class(max_workers=workers, initializer=_init_worker, initargs=(extractor_name,)) as pool:
+        # map сохраняет порядок окон — это нужно, чтобы чекпойнт был точным
+        for (stream, position, window), memories in zip_windows(windows, pool, workers):
+            pending.extend(memories)
+            if position is not None:
+                # Неполный хвост при следующем запуске читается заново (дубли отсеет add_records)
+                pending_done[stream] = position
+                pending_messages += len(window)
+            checkpoint["candidates"] += len(memories)
+            session["windows"] += 1
+            session["messages"] += len(window)
+            if len(pending) >= write_batch:
+                flush()
+        flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"[Import] Готово за {elapsed:.1f} с: окон {session['windows']}, реплик {session['messages']}, "
+          f"новых записей {session['added']}")
+    return checkpoint
+
+
+def zip_windows(windows, pool, workers, chunk: int = 64):
+    """Отдаёт ((диалог, позиция, окно), извлечённое) по порядку, держа в работе
+    не больше chunk окон на воркера."""
+    while True:
+        batch = []
+        for item in windows:
+            batch.append(item)
+            if len(batch) >= chunk * workers:
+                break
+        if not batch:
+            return
+        yield from zip(batch, pool.map(_extract_window, [window for _, _, window in batch]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default="mongo", help="mongo или путь к JSONL-экспорту")
+    parser.add_argument("--extractor", default="heuristic", help="llm, heuristic или модуль:Класс")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process",
+                        help="process — для CPU-экстракторов, thread — для сетевых (llm)")
+    parser.add_argument("--window", type=int, default=12, help="реплик в одном окне")
+    parser.add_argument("--write-batch", type=int, default=64, help="записей в одной пачке в Chroma")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--user", default=os.getenv("AURORA_USER_ID", "andrey"), help="чьи сессии импортировать из Mongo")
+    parser.add_argument("--persona", default=os.getenv("AURORA_PERSONA", "aurora"))
+    args = parser.parse_args()
+
+    from chroma_mem import ChromaHandler
+
+    chroma = ChromaHandler()
+    run_import(args.source, args.extractor, chroma, args.workers, args.executor,
+               args.window, args.write_batch, args.checkpoint, user_id=args.user, persona=args.persona)
+
+
+if __name__ == "__main__":
+    main()
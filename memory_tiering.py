@@ -0,0 +1,131 @@
+import re
+import threading
+import time
+from datetime import datetime
+
+# Вес важности: насколько долго запись держится в горячей коллекции.
+# critical не вытесняется никогда — границы всегда идут в промпт.
+IMPORTANCE_WEIGHT = {"high": 1.0, "medium": 0.6, "low": 0.3}
+
+# Период полураспада по категориям, в днях: планы и обещания устаревают быстро,
+# личность и границы — почти никогда
+HALF_LIFE_DAYS = {
+    "planned_events": 14,
+    "promises": 30,
+    "goals": 90,
+    "habits": 180,
+    "interests": 180,
+    "preferences": 180,
+    "skills": 365,
+    "relationships": 720,
+    "identity": 720,
+    "boundaries": 720,
+}
+DEFAULT_HALF_LIFE_DAYS = 180
+
+# Явная просьба вспомнить — только тогда поиск заглядывает в холодный архив
+RECALL_RE = re.compile(
+    r"\b(помнишь|вспомни\w*|припомни\w*|напомни\w*|я (тебе )?(говорил|рассказывал)|когда-то)\b",
+    re.I
+)
+
+
+def is_explicit_recall(text: str) -> bool:
+    return bool(RECALL_RE.search(text or ""))
+
+
+def memory_score(meta: dict, now: float = None, last_retrieved: float = None) -> float:
+    """Важность × экспоненциальный спад от последнего касания записи
+    (создание или попадание в выдачу). Для critical — бесконечность."""
+    importance = meta.get("importance")
+    if importance == "critical":
+        return float("inf")
+    now = now or time.time()
+    try:
+        touched = datetime.strptime(meta.get("creation_date"), "%d.%m.%y").timestamp()
+    except (TypeError, ValueError):
+        touched = now
+    touched = max(touched, meta.get("last_retrieved") or 0, last_retrieved or 0)
+    age_days = max(0.0, now - touched) / 86400
+    half_life = HALF_LIFE_DAYS.get(meta.get("category"), DEFAULT_HALF_LIFE_DAYS)
+    return IMPORTANCE_WEIGHT.get(importance, 0.3) * 0.5 ** (age_days / half_life)
+
+
+class MemoryTiering():
+    """Фоновое вытеснение остывших записей в архив.
+
+    Каждые interval секунд просматривается одна страница горячей коллекции
+    (batch записей, курсор по кругу): отметки последних попаданий в выдачу
+    сбрасываются в метаданные, записи со счётом ниже threshold уходят в архив.
+    Если горячих записей больше max_hot, из страницы дополнительно вытесняются
+    самые слабые. Так стоимость поиска на ходу не растёт вместе с памятью.
+    """
+
+    def __init__(self, chroma, threshold: float = 0.1, max_hot: int = 5000,
+                 batch: int = 200, interval: float = 60.0):
+        self.chroma = chroma
+        self.threshold = threshold
+        self.max_hot = max_hot
+        self.batch = batch
+        self.interval = interval
+
+        self.cursor = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {"scanned": 0, "demoted": 0, "touched": 0}
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="memory-tiering", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                print(f"[Tiering] Ошибка шага: {e}")
+
+    def step(self, now: float = None):
+        """Один инкрементальный шаг; возвращает id вытесненных записей."""
+        now = now or time.time()
+        collection = self.chroma.collection
+        total = collection.count()
+        if self.cursor >= total:
+            self.cursor = 0
+        page = collection.get(limit=self.batch, offset=self.cursor, include=["metadatas"])
+        ids, metadatas = page["ids"], page["metadatas"]
+        if not ids:
+            self.cursor = 0
+            return []
+
+        touched = self.chroma.take_retrieved(ids)
+        if touched:
+            collection.update(
+                ids=list(touched),
+                metadatas=[dict(metadatas[ids.index(rid)], last_retrieved=ts) for rid, ts in touched.items()]
+            )
+            self.stats["touched"] += len(touched)
+
+        scored = sorted(
+            ((memory_score(meta, now, touched.get(rid)), rid) for rid, meta in zip(ids, metadatas)),
+            key=lambda item: item[0]
+        )
+        demote = [rid for score, rid in scored if score < self.threshold]
+        overflow = total - len(demote) - self.max_hot
+        if overflow > 0:
+            extra = [rid for score, rid in scored if score >= self.threshold and score != float("inf")]
+            demote += extra[:overflow]
+
+        moved = self.chroma.demote_records(demote) if demote else []
+        # Вытесненные записи сдвигают страницы — курсор идёт только на оставшиеся
+        self.cursor += len(ids) - len(moved)
+        self.stats["scanned"] += len(ids)
+        self.stats["demoted"] += len(moved)
+        if moved:
+            print(f"[Tiering] В архив: {len(moved)}, горячих осталось {total - len(moved)}, всего {self.stats}")
+        return moved
@@ -0,0 +1,332 @@
+"""Отложенная запись в память: create / update агента не ждут Chroma.
+
+MemoryWriteQueue оборачивает ChromaHandler так же, как RecordingChroma:
+add_records / upsert_records только дописывают мутацию в журнал (JSONL с
+fsync) и сразу возвращаются, а фоновый поток пачками отдаёт их настоящему
+ChromaHandler. Остальные методы уходят в обёрнутый объект как есть.
+
+Чтение видит свои записи: search_memory подмешивает ещё не записанные
+записи, близкие к запросу, и прячет те, что ими заменяются;
+get_critical_memories добавляет ожидающие критические границы.
+
+Журнал переживает падение: при старте незавершённые мутации снова ставятся
+в очередь. Повтор безопасен — add_records отсекает дубль уже записанного,
+upsert_records сливается с ним же. Мутация, которая не записалась
+max_attempts раз подряд, уходит в журнал строкой "dead" и больше не
+повторяется, чтобы не держать очередь за собой.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+
+from tracing import tracer, traced
+
+WRITE_QUEUE_PATH = "memory_queue.jsonl"
+# Префикс id ещё не записанных записей — так их видит агент в выдаче поиска
+PENDING_PREFIX = "pending-"
+
+
+class MemoryWriteQueue():
+    def __init__(self, chroma, path: str = WRITE_QUEUE_PATH, retry_delay: float = 5.0, max_retry_delay: float = 300.0,
+                 max_attempts: int = 8, compact_after: int = 500):
+        self._chroma = chroma
+        self.path = path
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max_attempts
+        self.compact_after = compact_after
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = {}       # pending id → {"kind", "record", "replaces", "ts"}, в порядке постановки
+        self.resolved = {}      # pending id → id в Chroma после записи
+        self.inflight = set()   # pending id, которые сейчас пишутся в Chroma
+        self.attempts = {}      # pending id → неудачных попыток записи
+        self.dead = {}          # pending id → мутация, снятая после max_attempts неудач
+        self.journal_lines = 0
+        self.stopped = False
+        self.thread = None
+        self._load()
+
+    def _load(self):
+        """Незавершённые мутации из журнала; журнал переписывается только с ними."""
+        if not os.path.exists(self.path):
+            return
+        entries, done, attempts, dead = {}, {}, {}, {}
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # оборванная при падении последняя строка
+                if entry.get("op") == "put":
+                    entries[entry["id"]] = entry
+                elif entry.get("op") == "done":
+                    done[entry["id"]] = entry.get("chroma_id")
+                elif entry.get("op") == "fail":
+                    attempts[entry["id"]] = entry.get("attempts", 1)
+                elif entry.get("op") == "dead":
+                    dead[entry["id"]] = entry
+        self.resolved = {entry_id: chroma_id for entry_id, chroma_id in done.items() if chroma_id}
+        self.pending = {
+            entry_id: {k: entry.get(k) for k in ("kind", "record", "replaces", "ts")}
+            for entry_id, entry in entries.items() if entry_id not in done and entry_id not in dead
+        }
+        self.attempts = {entry_id: n for entry_id, n in attempts.items() if entry_id in self.pending}
+        self.dead = {entry_id: {k: v for k, v in entry.items() if k not in ("op", "id")}
+                     for entry_id, entry in dead.items()}
+        for entry in self.pending.values():
+            entry["replaces"] = self.resolved.get(entry["replaces"], entry["replaces"])
+        self._rewrite()
+        if self.pending:
+            print(f"[WriteQueue] Из журнала восстановлено мутаций: {len(self.pending)}")
+        if self.dead:
+            print(f"[WriteQueue] Мутаций, снятых после ошибок записи: {len(self.dead)} (op=dead в {self.path})")
+
+    def _rewrite(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # Снятые мутации переживают сжатие журнала — их можно разобрать и вернуть руками
+            for entry_id, entry in self.dead.items():
+                f.write(json.dumps(dict(entry, op="dead", id=entry_id), ensure_ascii=False) + "\n")
+            for entry_id, entry in self.pending.items():
+                f.write(json.dumps(dict(entry, op="put", id=entry_id), ensure_ascii=False) + "\n")
+            for entry_id, n in self.attempts.items():
+                f.write(json.dumps({"op": "fail", "id": entry_id, "attempts": n}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.journal_lines = len(self.dead) + len(self.pending) + len(self.attempts)
+
+    def _append(self, entries: list):
+        """Дописывает строки в журнал; после fsync мутация считается принятой."""
+        with open(self.path, "a", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal_lines += len(entries)
+
+    def start(self):
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="memory-write-queue", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        """Дописать очередь (не дольше timeout) и остановить поток."""
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while self.pending and self.thread and self.thread.is_alive():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"[WriteQueue] Не дописано при выходе: {len(self.pending)}, останется в журнале")
+                    break
+                self.wakeup.wait(remaining)
+            self.stopped = True
+            self.wakeup.notify_all()
+
+    # --- запись: вместо ChromaHandler ---
+
+    def add_records(self, records: list, *args, **kwargs):
+        return self._enqueue("create", records)
+
+    def upsert_records(self, records: list, *args, **kwargs):
+        return self._enqueue("update", records)
+
+    @traced("memory.enqueue")
+    def _enqueue(self, kind, records):
+        report = {"added": [], "merged": [], "skipped": [], "queued": []}
+        entries = []
+        with self.lock:
+            for record in records:
+                if not record.get("text", "").strip():
+                    continue
+                replaces = record.get("replaces")
+                if replaces in self.pending and replaces not in self.inflight:
+                    # Заменяется запись, которая ещё не дошла до Chroma: её просто не пишем
+                    self.attempts.pop(replaces, None)
+                    replaces = self.pending.pop(replaces)["replaces"]
+                    entries.append({"op": "done", "id": record["replaces"], "chroma_id": None})
+                # Уже записанная — по её id в Chroma; пишущаяся сейчас — разрешится в _drain
+                if replaces not in self.pending:
+                    replaces = self._chroma_id(replaces)
+                entry_id = PENDING_PREFIX + uuid.uuid4().hex[:12]
+                entry = {
+                    "kind": kind,
+                    "record": {k: record[k] for k in ("text", "category", "importance")},
+                    "replaces": replaces,
+                    "ts": datetime.now().isoformat(timespec="seconds"),
+                }
+                self.pending[entry_id] = entry
+                entries.append(dict(entry, op="put", id=entry_id))
+                report["queued"].append({"id": entry_id, "text": entry["record"]["text"]})
+            if entries:
+                self._append(entries)
+                self.wakeup.notify_all()
+        return report
+
+    # --- фоновая запись ---
+
+    def _run(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopped:
+                    self.wakeup.wait()
+                if self.stopped:
+                    return
+                batch = list(self.pending.items())
+                self.inflight = {entry_id for entry_id, _ in batch}
+            try:
+                delay = self._drain(batch)
+            finally:
+                with self.lock:
+                    self.inflight = set()
+            if delay:
+                # Новые мутации паузу не прерывают, только остановка
+                deadline = time.monotonic() + delay
+                with self.lock:
+                    while not self.stopped and time.monotonic() < deadline:
+                        self.wakeup.wait(deadline - time.monotonic())
+
+    def _chroma_id(self, record_id):
+        """id записи в Chroma для id из выдачи; ожидающий id, который так и не
+        записался (заменён, снят или оказался дублем без id), — None."""
+        record_id = self.resolved.get(record_id, record_id)
+        if record_id and record_id.startswith(PENDING_PREFIX):
+            return None
+        return record_id
+
+    def _groups(self, batch):
+        """Подряд идущие create — одна пачка add_records, подряд идущие update —
+        одна пачка upsert_records; уже падавшие мутации пишутся поодиночке,
+        чтобы одна битая запись не роняла соседей."""
+        groups = []
+        for entry_id, entry in batch:
+            alone = entry_id in self.attempts
+            if groups and not alone and not groups[-1][1] and groups[-1][0][0][1]["kind"] == entry["kind"]:
+                groups[-1][0].append((entry_id, entry))
+            else:
+                groups.append(([(entry_id, entry)], alone))
+        return [group for group, _ in groups]
+
+    def _drain(self, batch):
+        """Пишет пачку по порядку. При ошибке останавливается (порядок мутаций
+        важен) и возвращает паузу перед повтором, иначе None."""
+        with tracer.span("memory.drain", records=len(batch)) as span:
+            with self.lock:
+                groups = self._groups(batch)
+            for group in groups:
+                kind = group[0][1]["kind"]
+                with self.lock:
+                    records = [dict(entry["record"], replaces=self._chroma_id(entry["replaces"])) for _, entry in group]
+                try:
+                    if kind == "update":
+                        report = self._chroma.upsert_records(records)
+                    else:
+                        report = self._chroma.add_records(records)
+                except Exception as e:
+                    span.set("failed", len(group))
+                    return self._fail(group, e)
+                self._complete(group, report)
+        return None
+
+    def _fail(self, group, error):
+        with self.lock:
+            lines, attempts = [], 0
+            for entry_id, entry in group:
+                if entry_id not in self.pending:
+                    continue
+                self.attempts[entry_id] = self.attempts.get(entry_id, 0) + 1
+                attempts = max(attempts, self.attempts[entry_id])
+                if self.attempts[entry_id] >= self.max_attempts:
+                    del self.pending[entry_id]
+                    del self.attempts[entry_id]
+                    self.dead[entry_id] = dict(entry, error=str(error))
+                    lines.append(dict(entry, op="dead", id=entry_id, error=str(error)))
+                    print(f"[WriteQueue] Мутация снята после {self.max_attempts} ошибок: {entry['record']['text']!r}")
+                else:
+                    lines.append({"op": "fail", "id": entry_id, "attempts": self.attempts[entry_id], "error": str(error)})
+            if lines:
+                self._append(lines)
+            self.wakeup.notify_all()
+        delay = min(self.retry_delay * 2 ** max(attempts - 1, 0), self.max_retry_delay)
+        print(f"[WriteQueue] Ошибка записи в Chroma, повтор через {delay:.0f} с: {error}")
+        return delay
+
+    def _complete(self, group, report):
+        # Дубль уже записанного не получает своего id — за него отвечает запись, с которой он совпал
+        written = {r["text"]: r.get("duplicate_id") for r in report.get("skipped", [])}
+        written.update({r["text"]: r["id"] for r in report.get("added", []) + report.get("merged", [])})
+        with self.lock:
+            done = []
+            for entry_id, entry in group:
+                # Запись могла быть заменена, пока шла запись в Chroma, — тогда она уже снята
+                if self.pending.pop(entry_id, None) is None:
+                    continue
+                self.attempts.pop(entry_id, None)
+                chroma_id = written.get(entry["record"]["text"])
+                if chroma_id:
+                    self.resolved[entry_id] = chroma_id
+                done.append({"op": "done", "id": entry_id, "chroma_id": chroma_id})
+            if done:
+                self._append(done)
+            if not self.pending and self.journal_lines >= self.compact_after:
+                self._rewrite()
+            self.wakeup.notify_all()
+        print(f"[WriteQueue] Записано в Chroma: {len(group)}, в очереди: {len(self.pending)}")
+
+    # --- чтение своих записей ---
+
+    def pending_records(self):
+        with self.lock:
+            return [(entry_id, dict(entry)) for entry_id, entry in self.pending.items()]
+
+    def search_memory(self, query, *args, **kwargs):
+        results = self._chroma.search_memory(query, *args, **kwargs)
+        pending = self.pending_records()
+        if not pending:
+            return results
+
+        threshold = kwargs.get("threshold", 0.7)
+        top_n = kwargs.get("top_n", 5)
+        hidden = {entry["replaces"] for _, entry in pending if entry["replaces"]}
+        candidates = [(entry_id, entry["record"]) for entry_id, entry in pending
+                      if entry["record"]["importance"] != "critical"]
+        matched = []
+        if candidates:
+            # Тексты ожидающих записей уже в кэше эмбеддингов — при записи они посчитаются из него же
+            vectors = self._chroma.embeddings.encode_many([query] + [r["text"] for _, r in candidates])
+            unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            distances = 1.0 - unit[1:] @ unit[0]
+            order = np.argsort(distances)
+            matched = [dict(id=candidates[i][0], **candidates[i][1]) for i in order if distances[i] < threshold]
+
+        texts = {r["text"] for r in matched}
+        merged = matched + [r for r in results if r["id"] not in hidden and r["text"] not in texts]
+        if matched:
+            print(f"[WriteQueue] В выдачу добавлено ожидающих записей: {len(matched)}")
+        return merged[:top_n]
+
+    def accept_search_results(self, results):
+        # Ожидающие записи в Chroma ещё нет — отмечать для тиринга нечего
+        self._chroma.accept_search_results([r for r in results if not r["id"].startswith(PENDING_PREFIX)])
+
+    def get_critical_memories(self, *args, **kwargs):
+        critical = self._chroma.get_critical_memories(*args, **kwargs)
+        for _, entry in self.pending_records():
+            text = entry["record"]["text"]
+            if entry["record"]["importance"] == "critical" and text not in critical:
+                critical.append(text)
+        return critical
+
+    def __getattr__(self, attr):
+        return getattr(self._chroma, attr)
@@ -0,0 +1,174 @@
+"""Эмбеддер sbert_large на ONNX Runtime с динамической int8-квантизацией для CPU.
+
+    python onnx_embedder.py export            # экспорт в ONNX + квантизация
+    python onnx_embedder.py check [--texts N] # сверка с fp32 и замер скорости/памяти
+
+Движок выбирается в ChromaHandler через AURORA_EMBEDDING_ENGINE=onnx,
+число потоков — AURORA_ONNX_THREADS.
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+ONNX_DIR = "onnx_models/sbert_large_mt_nlu_ru"
+FP32_FILE = "model.onnx"
+INT8_FILE = "model.int8.onnx"
+
+
+class OnnxEmbedder():
+    """Повторяет нужную часть SentenceTransformer.encode: токенизация,
+    прогон через ONNX Runtime, mean pooling по attention mask."""
+
+    def __init__(self, model_dir: str = ONNX_DIR, quantized: bool = True, threads: int = None, max_length: int = 512):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_length = max_length
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        path = os.path.join(model_dir, INT8_FILE if quantized else FP32_FILE)
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True, normalize_embeddings: bool = False, **_):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        # Сортировка по длине — меньше паддинга в батчах
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            idx = order[start:start + batch_size]
+            for i, vec in zip(idx, self._encode_batch([texts[i] for i in idx])):
+                result[i] = vec
+
+        vectors = np.stack(result) if result else np.zeros((0, 0), dtype=np.float32)
+        if normalize_embeddings and len(vectors):
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors[0] if single else vectors
+
+    def _encode_batch(self, texts):
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feeds = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+        hidden = self.session.run(None, feeds)[0]
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+def export(model_name: str, out_dir: str = ONNX_DIR):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer(["пример текста"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = os.path.join(out_dir, FP32_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    print(f"[ONNX] fp32: {fp32_path} ({os.path.getsize(fp32_path) / 2**20:.0f} МБ)")
+
+    int8_path = os.path.join(out_dir, INT8_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"[ONNX] int8: {int8_path} ({os.path.getsize(int8_path) / 2**20:.0f} МБ)")
+
+
+def rss_mb():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        return float("nan")
+
+
+def check(model_name: str, texts: list, threads: int = None, batch_size: int = 32):
+    """Косинусное согласие int8 с fp32 и сравнение латентности и памяти."""
+    from sentence_transformers import SentenceTransformer
+
+    def measure(load, label):
+        before = rss_mb()
+        started = time.perf_counter()
+        model = load()
+        load_time = time.perf_counter() - started
+        after_load = rss_mb()
+
+        model.encode(texts[:batch_size], batch_size=batch_size)  # прогрев
+        started = time.perf_counter()
+        vectors = model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+        encode_time = time.perf_counter() - started
+        print(f"  {label:<10} загрузка {load_time:5.1f} с, +{after_load - before:6.0f} МБ RSS, "
+              f"{encode_time / len(texts) * 1000:6.1f} мс/текст")
+        return np.asarray(vectors, dtype=np.float32)
+
+    print(f"[ONNX] Сверка на {len(texts)} текстах, потоков: {threads or 'по умолчанию'}")
+    reference = measure(lambda: SentenceTransformer(model_name, device="cpu"), "torch fp32")
+    quantized = measure(lambda: OnnxEmbedder(threads=threads), "onnx int8")
+
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    quant = quantized / np.linalg.norm(quantized, axis=1, keepdims=True)
+    cosine = (ref * quant).sum(axis=1)
+    print(f"  косинус int8↔fp32: среднее {cosine.mean():.4f}, минимум {cosine.min():.4f}, "
+          f"p1 {np.percentile(cosine, 1):.4f}")
+
+    # Важнее абсолютного косинуса — совпадают ли соседи при поиске
+    ref_top = np.argsort(-(ref @ ref.T), axis=1)[:, 1:6]
+    quant_top = np.argsort(-(quant @ quant.T), axis=1)[:, 1:6]
+    overlap = np.mean([len(set(a) & set(b)) / 5 for a, b in zip(ref_top, quant_top)])
+    print(f"  совпадение top-5 соседей: {overlap:.3f}")
+    return cosine
+
+
+def sample_texts(limit: int):
+    """Тексты для сверки: записи памяти из Chroma, а если их мало — синтетика."""
+    texts = []
+    try:
+        import chromadb
+        collection = chromadb.PersistentClient(path="./chroma_db").get_or_create_collection("preferences")
+        texts = collection.get(limit=limit, include=["documents"])["documents"]
+    except Exception as e:
+        print(f"[ONNX] Chroma недоступна: {e}")
+    base = ["Любит научную фантастику", "Бросил пить кофе", "Учит японский по 10 минут в день",
+            "Не говори про семью", "Использует RTX 3060", "Встаёт в 6 утра и делает зарядку"]
+    while len(texts) < limit:
+        texts.append(f"{base[len(texts) % len(base)]} ({len(texts)})")
+    return texts[:limit]
+
+
+def main():
+    from chroma_mem import EMBEDDING_MODEL_NAME
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export", "check"])
+    parser.add_argument("--texts", type=int, default=256)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export(EMBEDDING_MODEL_NAME)
+    else:
+        check(EMBEDDING_MODEL_NAME, sample_texts(args.texts), threads=args.threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,216 @@
-from openai import OpenAI
+from openai import OpenAI, NOT_GIVEN
+import contextvars
 import json
+import os
+import time
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor, wait, FIRST_COMPLETED
 from openrouter_schemas import AURORA_SCHEMA, MEMORY_AGENT_FINAL_SCHEMA, MEMORY_AGENT_PLANNING_SCHEMA
+from openrouter_transport import LatencyTracker, build_http_client, phase_timeout, is_retryable, backoff_delay
+from json_stream import JsonFieldStreamer
+from tracing import tracer
+
+# Статистика последнего вызова в текущем контексте: у каждого потока (ход, предзагрузка,
+# свёртка истории) своя, параллельные вызовы не затирают чужую
+_last_call_stats = contextvars.ContextVar("openrouter_last_call_stats", default=None)
+
+def usage_dict(usage):
+    """usage ответа → плоский dict; cached_tokens — сколько промпта пришло из кэша провайдера."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details else None
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": cached or 0,
+    }
+
 
 class OpenRouterClient():
-    def __init__(self, openrouter_key):
+    def __init__(self, openrouter_key, base_url: str = None, max_retries: int = 3,
+                 hedge: bool = False, hedge_default_delay: float = None):
+        """base_url можно переопределить (или OPENROUTER_BASE_URL) — например,
+        на локальный мок-сервер. hedge включает дублирующий запрос, если
+        первый не ответил за p95 латентности этой фазы."""
+        self.http_client = build_http_client()
         self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
+            base_url=base_url or os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
             api_key=openrouter_key,
+            http_client=self.http_client,
+            max_retries=0,  # ретраи делаем сами, с джиттером и учётом фазы
         )
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="openrouter-hedge")
+        self.latency = LatencyTracker()
+        # Накопленный учёт кэша промптов провайдера по фазам
+        self.prompt_cache_stats = {}
+        self.stats_lock = threading.Lock()
     
-    def chat_completion(self, model: str, messages: list, schema: dict = None):
-        try:
-            completion = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    temperature=0.8,
-                    top_p=0.9,
-                    frequency_penalty=0.4,
-                    presence_penalty=0.6,
-                    # extra_body={
-                    #     "provider": {
-                    #         "order": ["Chutes", "atlas-cloud/fp8", "venice/fp16", "venice/fp8"],
-                    #         "allow_fallbacks": False
-                    #     }
-                    # },
-                    response_format = schema
-            )
-            result = json.loads(completion.choices[0].message.content)
+    def chat_completion(self, model: str, messages: list, schema: dict = None,
+                        stream: bool = False, on_delta=None, stream_field: str = "final_answer",
+                        phase: str = "default"):
+        """При stream=True ответ читается по токенам, а новые куски поля
+        `stream_field` сразу отдаются в on_delta(text). Результат тот же dict.
+        Статистика вызова (попытки, ретраи, хедж, латентность, токены) — в атрибутах
+        спана llm.{phase} и в last_call_stats текущего потока."""
+        stats = {"phase": phase, "model": model, "attempts": 0, "retries": 0,
+                 "hedged": False, "latency": None, "error": None, "usage": None}
+        with tracer.span(f"llm.{phase}", model=model, stream=stream) as span:
+            started = time.perf_counter()
+            try:
+                result, usage = self._with_retries(model, messages, schema, stream, on_delta, stream_field, phase, stats)
+                stats["usage"] = usage
+                return result
+            except Exception as e:
+                stats["error"] = str(e)
+                return f"Ошибка API: {str(e)}"
+            finally:
+                stats["latency"] = time.perf_counter() - started
+                _last_call_stats.set(stats)
+                self._account_usage(phase, stats)
+                usage = stats["usage"] or {}
+                print(f"[OpenRouter] {phase}: {stats['latency']:.2f} с, попыток {stats['attempts']}, "
+                      f"ретраев {stats['retries']}, хедж {stats['hedged']}, "
+                      f"промпт {usage.get('prompt_tokens', '?')} ток. (из кэша {usage.get('cached_tokens', '?')})")
+                span.update(attempts=stats["attempts"], retries=stats["retries"], hedged=stats["hedged"], **usage)
+                if stats["error"]:
+                    span.set("api_error", stats["error"])
+
+    @property
+    def last_call_stats(self) -> dict:
+        """Статистика последнего вызова, сделанного в этом потоке / контексте."""
+        return _last_call_stats.get() or {}
+
+    def _account_usage(self, phase, stats):
+        usage = stats["usage"]
+        if not usage:
+            return
+        with self.stats_lock:
+            acc = self.prompt_cache_stats.setdefault(phase, {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0,
+                "completion_tokens": 0, "latency_total": 0.0
+            })
+            acc["calls"] += 1
+            acc["prompt_tokens"] += usage["prompt_tokens"]
+            acc["cached_tokens"] += usage["cached_tokens"]
+            acc["completion_tokens"] += usage["completion_tokens"]
+            acc["latency_total"] += stats["latency"]
+
+    def prompt_cache_report(self):
+        """По фазам: доля промпт-токенов, пришедших из кэша провайдера, и средняя латентность."""
+        with self.stats_lock:
+            return {
+                phase: {
+                    "calls": acc["calls"],
+                    "prompt_tokens": acc["prompt_tokens"],
+                    "cached_tokens": acc["cached_tokens"],
+                    "cached_ratio": acc["cached_tokens"] / acc["prompt_tokens"] if acc["prompt_tokens"] else 0.0,
+                    "avg_latency": acc["latency_total"] / acc["calls"],
+                }
+                for phase, acc in self.prompt_cache_stats.items()
+            }
+
+    def _with_retries(self, model, messages, schema, stream, on_delta, stream_field, phase, stats):
+        # Стрим, уже отдавший текст в окно, повторять нельзя — иначе текст задвоится
+        emitted = {"any": False}
+        # Попытки хеджа идут в потоках пула одновременно — общий stats правят под замком
+        stats_lock = threading.Lock()
+        # Ответ уже получен: попытка хеджа, дождавшаяся потока пула позже, запрос не шлёт
+        settled = threading.Event()
+
+        def forward(text):
+            emitted["any"] = True
+            on_delta(text)
+
+        def attempt():
+            if settled.is_set():
+                raise CancelledError()
+            with stats_lock:
+                stats["attempts"] += 1
+            attempt_started = time.perf_counter()
+            result = self._request(model, messages, schema, stream, forward if on_delta else None, stream_field, phase)
+            self.latency.add(phase, time.perf_counter() - attempt_started)
+            settled.set()
             return result
-        except Exception as e:
-            return f"Ошибка API: {str(e)}"
\ No newline at end of file
+
+        for retry in range(self.max_retries + 1):
+            try:
+                if stream:
+                    return attempt()
+                return self._hedged(attempt, phase, stats, stats_lock)
+            except Exception as e:
+                if retry == self.max_retries or not is_retryable(e) or emitted["any"]:
+                    raise
+                delay = backoff_delay(retry, e)
+                with stats_lock:
+                    stats["retries"] += 1
+                print(f"[OpenRouter] {phase}: {type(e).__name__}, повтор через {delay:.2f} с")
+                time.sleep(delay)
+
+    def _hedged(self, attempt, phase, stats, stats_lock):
+        delay = self.latency.percentile(phase, 0.95) or self.hedge_default_delay
+        if not self.hedge or delay is None:
+            return attempt()
+
+        first = self.hedge_pool.submit(attempt)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        with stats_lock:
+            stats["hedged"] = True
+        pending = {first, self.hedge_pool.submit(attempt)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # Проигравшая попытка, ещё стоящая в очереди пула, уже не нужна
+                    for loser in pending:
+                        loser.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def _request(self, model, messages, schema, stream, on_delta, stream_field, phase):
+        completion = self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.8,
+                top_p=0.9,
+                frequency_penalty=0.4,
+                presence_penalty=0.6,
+                # extra_body={
+                #     "provider": {
+                #         "order": ["Chutes", "atlas-cloud/fp8", "venice/fp16", "venice/fp8"],
+                #         "allow_fallbacks": False
+                #     }
+                # },
+                response_format = schema,
+                stream=stream,
+                stream_options={"include_usage": True} if stream else NOT_GIVEN,
+                extra_body={"usage": {"include": True}},
+                timeout=phase_timeout(phase)
+        )
+        if not stream:
+            return json.loads(completion.choices[0].message.content), usage_dict(completion.usage)
+
+        streamer = JsonFieldStreamer(stream_field)
+        content = []
+        usage = None
+        for chunk in completion:
+            if getattr(chunk, "usage", None):
+                usage = usage_dict(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            content.append(delta)
+            text = streamer.feed(delta)
+            if text and on_delta:
+                on_delta(text)
+        return json.loads("".join(content)), usage
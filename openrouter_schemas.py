@@ -159,3 +159,85 @@ MEMORY_AGENT_FINAL_SCHEMA = {
         }
     }
 }
+
+
+DIALOGUE_SUMMARY_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "dialogue_summary",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "summary": {
+                    "type": "string",
+                    "description": "Обновлённое краткое содержание старой части диалога."
+                }
+            },
+            "required": ["summary"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+MEMORY_IMPORT_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "memory_import",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "memories": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "text": {"type": "string"},
+                            "category": {
+                                "type": "string",
+                                "enum": [
+                                    "identity", "habits", "interests", "skills", "goals",
+                                    "relationships", "boundaries", "preferences",
+                                    "promises", "planned_events"
+                                ]
+                            },
+                            "importance": {
+                                "type": "string",
+                                "enum": ["critical", "high", "medium", "low"]
+                            }
+                        },
+                        "required": ["text", "category", "importance"],
+                        "additionalProperties": False
+                    },
+                    "description": "Долговременные факты об Андрее из фрагмента переписки."
+                }
+            },
+            "required": ["memories"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+# Однопроходный режим агента памяти: флаги фазы 1 и решение фазы 2 одним ответом
+MEMORY_AGENT_COMBINED_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "memory_agent_combined",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "thoughts": {"type": "string"},
+                "is_new_info": {"type": "boolean"},
+                "requires_memory": {"type": "boolean"},
+                "relevant_memories": MEMORY_AGENT_FINAL_SCHEMA["json_schema"]["schema"]["properties"]["relevant_memories"],
+                "new_memory_action": MEMORY_AGENT_FINAL_SCHEMA["json_schema"]["schema"]["properties"]["new_memory_action"]
+            },
+            "required": ["thoughts", "is_new_info", "requires_memory", "relevant_memories", "new_memory_action"],
+            "additionalProperties": False
+        }
+    }
+}
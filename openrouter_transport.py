@@ -0,0 +1,86 @@
+import random
+import threading
+from collections import deque
+
+import httpx
+import openai
+
+# Таймауты по фазам хода: (connect, read). Финальный ответ стримится,
+# поэтому read — это пауза между токенами, а не вся генерация.
+PHASE_TIMEOUTS = {
+    "planning": (5.0, 30.0),
+    "memory": (5.0, 30.0),
+    "combined": (5.0, 40.0),
+    "final": (5.0, 60.0),
+    "default": (5.0, 60.0),
+}
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def build_http_client(max_connections: int = 20, max_keepalive: int = 10, keepalive_expiry: float = 120.0):
+    """Общий httpx-клиент с пулом keep-alive соединений: TLS-рукопожатие
+    к OpenRouter делается один раз, а не на каждый вызов модели."""
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+
+def phase_timeout(phase: str) -> httpx.Timeout:
+    connect, read = PHASE_TIMEOUTS.get(phase, PHASE_TIMEOUTS["default"])
+    return httpx.Timeout(read, connect=connect)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def backoff_delay(attempt: int, error: Exception = None, base: float = 0.5, cap: float = 8.0) -> float:
+    """Экспоненциальная задержка с full jitter; Retry-After сервера важнее."""
+    if isinstance(error, openai.APIStatusError):
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            if retry_after is not None:
+                return min(float(retry_after), cap)
+        except ValueError:
+            pass
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class LatencyTracker():
+    """Скользящее окно латентностей по фазам — из него берётся p95 для хеджирования."""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, phase: str, seconds: float):
+        with self.lock:
+            self.samples.setdefault(phase, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, phase: str, q: float, min_samples: int = 20):
+        with self.lock:
+            samples = sorted(self.samples.get(phase, ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def summary(self):
+        return {
+            phase: {
+                "count": len(self.samples.get(phase, ())),
+                "p50": self.percentile(phase, 0.5, min_samples=1),
+                "p95": self.percentile(phase, 0.95, min_samples=1),
+            }
+            for phase in list(self.samples)
+        }
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def context_fingerprint(dialogue_context: list) -> str:
+    """Короткий отпечаток контекста: чем закончилась последняя реплика Авроры.
+
+    Ответ на её вопрос ("Что ел?" → "пиццу") — это новая информация, а та же
+    реплика без вопроса — нет, поэтому такие решения не должны смешиваться.
+    """
+    for msg in reversed(dialogue_context or []):
+        if msg.get("role") == "assistant":
+            return "question" if msg.get("content", "").rstrip().endswith("?") else "statement"
+    return "start"
+
+
+class PlanningCache():
+    """Семантический кэш решений фазы 1 для почти повторяющихся реплик.
+
+    Ключ — эмбеддинг запроса плюс отпечаток контекста; попадание — косинусная
+    близость выше threshold. Кэшируются только решения без новой информации:
+    их повтор безопасен. Записи живут ttl секунд, лишние выселяются по LRU.
+    """
+
+    def __init__(self, chroma, threshold: float = 0.93, ttl: float = 6 * 3600,
+                 max_items: int = 512, invalidate_threshold: float = 0.78):
+        self.chroma = chroma
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_items = max_items
+        # У sbert_large косинус 0.5 дают почти любые две русские фразы — при таком пороге
+        # каждая новая запись сбрасывала бы большую часть кэша
+        self.invalidate_threshold = invalidate_threshold
+
+        self.entries = OrderedDict()  # key → (вектор, отпечаток, решение, время)
+        self.next_key = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+        chroma.add_change_listener(self.on_memory_change)
+
+    def embed(self, text: str):
+        vec = self.chroma.embeddings.encode(text)
+        return vec / (np.linalg.norm(vec) or 1.0)
+
+    def lookup(self, user_request: str, dialogue_context: list):
+        vec = self.embed(user_request)
+        fingerprint = context_fingerprint(dialogue_context)
+        now = time.time()
+
+        with self.lock:
+            self._expire(now)
+            best_key, best_sim = None, self.threshold
+            for key, (entry_vec, entry_fp, _, _) in self.entries.items():
+                if entry_fp != fingerprint:
+                    continue
+                sim = float(entry_vec @ vec)
+                if sim >= best_sim:
+                    best_key, best_sim = key, sim
+
+            if best_key is None:
+                self.stats["misses"] += 1
+                return None
+
+            self.entries.move_to_end(best_key)
+            self.stats["hits"] += 1
+            decision = dict(self.entries[best_key][2])
+
+        print(f"[PlanningCache] Попадание (сходство {best_sim:.3f}), hit rate {self.hit_rate():.0%}")
+        return decision
+
+    def store(self, user_request: str, dialogue_context: list, decision: dict):
+        if not isinstance(decision, dict) or decision.get("is_new_info"):
+            return
+        vec = self.embed(user_request)
+        fingerprint = context_fingerprint(dialogue_context)
+        with self.lock:
+            self.entries[self.next_key] = (vec, fingerprint, dict(decision), time.time())
+            self.next_key += 1
+            while len(self.entries) > self.max_items:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def on_memory_change(self, kind: str, embeddings=None):
+        """Новая запись может сделать requires_memory=True для похожих реплик,
+        удаление — обнулить найденное для тех, где память была нужна.
+        Перенос между горячей коллекцией и архивом ("tier") решений не меняет:
+        записи на месте, меняется только то, где их искать."""
+        if kind == "tier":
+            return
+        with self.lock:
+            stale = []
+            for key, (entry_vec, _, decision, _) in self.entries.items():
+                if kind == "delete" and decision.get("requires_memory"):
+                    stale.append(key)
+                elif kind == "add" and embeddings is not None:
+                    for emb in embeddings:
+                        emb = np.asarray(emb, dtype=np.float32)
+                        if float(entry_vec @ emb) / (np.linalg.norm(emb) or 1.0) >= self.invalidate_threshold:
+                            stale.append(key)
+                            break
+            for key in stale:
+                del self.entries[key]
+            self.stats["invalidations"] += len(stale)
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _expire(self, now):
+        expired = [key for key, (_, _, _, created) in self.entries.items() if now - created > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        self.stats["evictions"] += len(expired)
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+from main_prompts import (
+    PERSONALITY_PROMPT,
+    FINAL_RESPONSE_PHASE_PROMPT,
+    FINAL_EXAMPLES_PROMPT
+)
+
+# Статический префикс финальной фазы: побайтно одинаковый на каждом ходу,
+# поэтому провайдер может закэшировать его целиком. Всё, что меняется от хода
+# к ходу, идёт после истории диалога отдельным сообщением.
+FINAL_STATIC_PROMPT = "\n\n".join([
+    PERSONALITY_PROMPT,
+    FINAL_RESPONSE_PHASE_PROMPT,
+    FINAL_EXAMPLES_PROMPT
+])
+
+
+def describe_elapsed(last_msg_time, now: datetime = None) -> str:
+    now = now or datetime.now()
+    time_info = "Ты не помнишь, сколько времени прошло с последнего сообщения."
+    if last_msg_time:
+        elapsed = now - last_msg_time
+        hours, rem = divmod(int(elapsed.total_seconds()), 3600)
+        minutes = rem // 60
+        days = elapsed.days
+
+        if elapsed.total_seconds() < 120:
+            time_info = "Андрей только что писал тебе."
+        elif hours == 0:
+            time_info = f"С последнего сообщения Андрея прошло {minutes} минут."
+        elif hours < 24:
+            time_info = f"С последнего сообщения Андрея прошло {hours} ч {minutes} мин."
+        else:
+            time_info = f"С последнего разговора прошло {days} дн."
+
+    return time_info + f" Время сейчас: {now.strftime('%d.%m.%y %H:%M')}."
+
+
+def build_final_context(user_request, relevant_memories, critical_prefs=None, last_msg_time=None, now=None) -> str:
+    """Динамическая часть финального промпта — всё, что зависит от хода."""
+    critical_text = "\n".join([p for p in critical_prefs]) if critical_prefs else "ничего."
+    memory_text = "\n".join([m["text"] for m in relevant_memories]) if relevant_memories else "ничего."
+
+    prompt_parts = [
+        "Критические границы: " + critical_text,
+        describe_elapsed(last_msg_time, now),
+        f"Андрей сказал: {user_request}",
+        "Релевантные воспоминания из памяти:",
+        memory_text,
+    ]
+    return "\n\n".join(prompt_parts)
+
+
+def build_final_messages(user_request, relevant_memories, dialogue_history,
+                         critical_prefs=None, last_msg_time=None, now=None, summary=None) -> list:
+    """[статический system] + [краткое содержание] + история + [контекст хода].
+
+    Краткое содержание меняется только при свёртке, поэтому стоит до истории.
+    """
+    messages = [{"role": "system", "content": FINAL_STATIC_PROMPT}]
+    if summary:
+        messages.append({"role": "system", "content": f"Краткое содержание более раннего разговора: {summary}"})
+    for msg in dialogue_history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+    messages.append({
+        "role": "system",
+        "content": build_final_context(user_request, relevant_memories, critical_prefs, last_msg_time, now)
+    })
+    return messages
+
+
+def build_phase_messages(static_prompt: str, dynamic_prompt: str) -> list:
+    """Сообщения фазы агента памяти: неизменный промпт фазы и отдельно данные хода."""
+    return [
+        {"role": "system", "content": static_prompt},
+        {"role": "user", "content": dynamic_prompt},
+    ]
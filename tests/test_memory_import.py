@@ -0,0 +1,56 @@
+import json
+from datetime import datetime, timedelta
+
+import mongomock
+import pymongo
+
+from memory_import import run_import
+
+
+class StubChroma():
+    def __init__(self):
+        self.texts = []
+
+    def add_records(self, records):
+        self.texts.extend(r["text"] for r in records)
+        return {"added": records, "merged": [], "skipped": []}
+
+
+def import_once(source, path, **kwargs):
+    chroma = StubChroma()
+    run_import(source, "heuristic", chroma, 1, "thread", 2, 64, path, **kwargs)
+    return chroma.texts
+
+
+def test_trailing_window_is_reread_after_append(tmp_path):
+    source, checkpoint = tmp_path / "export.jsonl", str(tmp_path / "checkpoint.json")
+    lines = [{"role": "user", "content": f"Я люблю вещь номер {i}."} for i in range(3)]
+    source.write_text("\n".join(json.dumps(line, ensure_ascii=False) for line in lines) + "\n", encoding="utf-8")
+
+    assert len(import_once(str(source), checkpoint)) == 3
+    # Хвост из одной реплики не зачтён — дописанная к нему реплика не теряется
+    with open(source, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"role": "user", "content": "Я люблю вещь номер 3."}, ensure_ascii=False) + "\n")
+    assert import_once(str(source), checkpoint) == ["Я люблю вещь номер 2.", "Я люблю вещь номер 3."]
+    assert import_once(str(source), checkpoint) == []
+
+
+def test_mongo_reads_only_sessions_of_user(tmp_path, monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(pymongo, "MongoClient", lambda *args, **kwargs: client)
+    db, start = client["aurora_db"], datetime(2026, 1, 1)
+    for i, (session_id, user_id) in enumerate([("s1", "andrey"), ("s2", "guest"), ("s3", "andrey")]):
+        db["sessions"].insert_one({"_id": session_id, "user_id": user_id, "persona": "aurora",
+                                   "started_at": start + timedelta(days=i)})
+        for j in range(2):
+            db["phrases"].insert_one({"session_id": session_id, "user_id": user_id, "role": "user",
+                                      "content": f"Я люблю {session_id} {j}.",
+                                      "timestamp": start + timedelta(days=i, minutes=j)})
+
+    checkpoint = str(tmp_path / "checkpoint.json")
+    assert import_once("mongo", checkpoint, user_id="andrey") == [
+        "Я люблю s1 0.", "Я люблю s1 1.", "Я люблю s3 0.", "Я люблю s3 1."
+    ]
+    db["phrases"].insert_one({"session_id": "s3", "user_id": "andrey", "role": "user",
+                              "content": "Я люблю s3 2.", "timestamp": start + timedelta(days=3)})
+    assert import_once("mongo", checkpoint, user_id="andrey") == ["Я люблю s3 2."]
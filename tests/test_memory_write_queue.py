@@ -0,0 +1,108 @@
+import json
+
+from memory_write_queue import MemoryWriteQueue, PENDING_PREFIX
+
+
+class StubChroma():
+    """Запись в словарь; дубль — совпадение текста, как у add_records с порогом."""
+
+    def __init__(self, records=None, failing=()):
+        self.records = dict(records or {})
+        self.failing = set(failing)
+        self.calls = []
+        self.next_id = 0
+
+    def _write(self, kind, records):
+        self.calls.append((kind, [dict(r) for r in records]))
+        if any(r["text"] in self.failing for r in records):
+            raise RuntimeError("stub write failed")
+        report = {"added": [], "merged": [], "skipped": []}
+        for r in records:
+            if kind == "update" and r.get("replaces"):
+                self.records.pop(r["replaces"], None)
+            existing = next((i for i, text in self.records.items() if text == r["text"]), None)
+            if existing:
+                report["skipped"].append({"text": r["text"], "duplicate_of": r["text"], "duplicate_id": existing})
+                continue
+            self.next_id += 1
+            record_id = f"c{self.next_id}"
+            self.records[record_id] = r["text"]
+            report["added"].append({"id": record_id, "text": r["text"]})
+        return report
+
+    def add_records(self, records):
+        return self._write("create", records)
+
+    def upsert_records(self, records):
+        return self._write("update", records)
+
+
+def record(text, **extra):
+    return dict({"text": text, "category": "habits", "importance": "high"}, **extra)
+
+
+def sent_replaces(chroma):
+    return [r.get("replaces") for _, records in chroma.calls for r in records]
+
+
+def test_journal_survives_restart(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    chroma = StubChroma({"c0": "Пьёт кофе"})
+    # Поток не запущен — как если бы процесс упал до записи
+    queue = MemoryWriteQueue(chroma, path=path)
+    queue.add_records([record("Бегает по утрам")])
+    queue.upsert_records([record("Бросил пить кофе", replaces="c0")])
+    assert chroma.calls == []
+
+    restored = MemoryWriteQueue(chroma, path=path)
+    assert [e["record"]["text"] for _, e in restored.pending_records()] == ["Бегает по утрам", "Бросил пить кофе"]
+    restored.start().stop(timeout=5)
+
+    assert sorted(chroma.records.values()) == ["Бегает по утрам", "Бросил пить кофе"]
+    assert restored.pending_records() == []
+    # После дозаписи при следующем старте повторять нечего
+    assert MemoryWriteQueue(chroma, path=path).pending_records() == []
+
+
+def test_update_of_queued_record_collapses(tmp_path):
+    chroma = StubChroma()
+    queue = MemoryWriteQueue(chroma, path=str(tmp_path / "queue.jsonl"))
+    pending_id = queue.add_records([record("Любит кофе")])["queued"][0]["id"]
+    queue.upsert_records([record("Бросил пить кофе", replaces=pending_id)])
+    assert len(queue.pending_records()) == 1
+
+    queue.start().stop(timeout=5)
+    assert list(chroma.records.values()) == ["Бросил пить кофе"]
+    assert not any(r and r.startswith(PENDING_PREFIX) for r in sent_replaces(chroma))
+
+
+def test_update_of_deduplicated_create_replaces_existing(tmp_path):
+    chroma = StubChroma({"c0": "Пьёт кофе"})
+    queue = MemoryWriteQueue(chroma, path=str(tmp_path / "queue.jsonl")).start()
+    pending_id = queue.add_records([record("Пьёт кофе")])["queued"][0]["id"]
+    queue.stop(timeout=5)
+
+    queue.start()
+    queue.upsert_records([record("Бросил пить кофе", replaces=pending_id)])
+    queue.stop(timeout=5)
+    assert list(chroma.records.values()) == ["Бросил пить кофе"]
+    assert sent_replaces(chroma)[-1] == "c0"
+
+
+def test_failing_record_is_dead_lettered(tmp_path):
+    path = str(tmp_path / "queue.jsonl")
+    chroma = StubChroma(failing={"Битая запись"})
+    queue = MemoryWriteQueue(chroma, path=path, retry_delay=0.01, max_attempts=3)
+    queue.add_records([record("Битая запись"), record("Любит чай")])
+    queue.add_records([record("Учит японский")])
+    queue.start().stop(timeout=5)
+
+    assert sorted(chroma.records.values()) == ["Любит чай", "Учит японский"]
+    assert queue.pending_records() == []
+    with open(path, encoding="utf-8") as f:
+        ops = [json.loads(line)["op"] for line in f]
+    assert "dead" in ops
+
+    restored = MemoryWriteQueue(chroma, path=path)
+    assert restored.pending_records() == []
+    assert [e["record"]["text"] for e in restored.dead.values()] == ["Битая запись"]
@@ -0,0 +1,119 @@
+import time
+
+import pytest
+
+import openrouter_client
+from fake_openai_server import DEFAULT_LATENCY, FakeOpenAIServer
+from openrouter_client import OpenRouterClient
+from openrouter_schemas import MEMORY_AGENT_PLANNING_SCHEMA
+from openrouter_transport import backoff_delay
+
+PLANNING = MEMORY_AGENT_PLANNING_SCHEMA["json_schema"]["name"]
+MESSAGES = [{"role": "user", "content": "Сейчас пользователь написал: 'люблю кофе'."}]
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def start(**faults):
+        server = FakeOpenAIServer(latency={name: 0.0 for name in DEFAULT_LATENCY}, jitter=0.0, faults=faults).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def backoffs(monkeypatch):
+    """Записывает выбранные задержки бэкоффа и укорачивает их, чтобы тест шёл быстро."""
+    delays = []
+
+    def recording_backoff(attempt, error=None):
+        delay = backoff_delay(attempt, error)
+        delays.append((attempt, delay))
+        return min(delay, 0.01)
+
+    monkeypatch.setattr(openrouter_client, "backoff_delay", recording_backoff)
+    return delays
+
+
+def plan(client):
+    return client.chat_completion("fake", MESSAGES, schema=MEMORY_AGENT_PLANNING_SCHEMA, phase="planning")
+
+
+def test_retries_until_success(serve, backoffs):
+    server = serve(**{PLANNING: [{"status": 503}, {"reset": True}]})
+    client = OpenRouterClient("fake-key", base_url=server.base_url, max_retries=3)
+
+    assert isinstance(plan(client), dict)
+    stats = client.last_call_stats
+    assert (stats["attempts"], stats["retries"], stats["error"]) == (3, 2, None)
+    assert server.requests[PLANNING] == 3
+    # Экспоненциальный бэкофф с full jitter: потолок растёт с номером повтора
+    assert [attempt for attempt, _ in backoffs] == [0, 1]
+    assert all(0 <= delay <= 0.5 * 2 ** attempt for attempt, delay in backoffs)
+
+
+def test_retry_after_overrides_backoff(serve, backoffs):
+    server = serve(**{PLANNING: [{"status": 429, "retry_after": "3"}]})
+    client = OpenRouterClient("fake-key", base_url=server.base_url)
+
+    assert isinstance(plan(client), dict)
+    assert backoffs == [(0, 3.0)]
+
+
+def test_gives_up_after_max_retries(serve, backoffs):
+    server = serve(**{PLANNING: [{"status": 503}] * 5})
+    client = OpenRouterClient("fake-key", base_url=server.base_url, max_retries=2)
+
+    assert plan(client).startswith("Ошибка API")
+    assert (client.last_call_stats["attempts"], client.last_call_stats["retries"]) == (3, 2)
+    assert server.requests[PLANNING] == 3
+
+
+def test_client_error_is_not_retried(serve, backoffs):
+    server = serve(**{PLANNING: [{"status": 400}]})
+    client = OpenRouterClient("fake-key", base_url=server.base_url)
+
+    assert plan(client).startswith("Ошибка API")
+    assert client.last_call_stats["attempts"] == 1
+    assert backoffs == []
+
+
+def test_hedge_wins_over_slow_attempt(serve):
+    server = serve(**{PLANNING: [{"delay": 2.0}]})
+    client = OpenRouterClient("fake-key", base_url=server.base_url, hedge=True, hedge_default_delay=0.1)
+
+    started = time.perf_counter()
+    assert isinstance(plan(client), dict)
+    assert time.perf_counter() - started < 1.0
+    stats = client.last_call_stats
+    assert stats["hedged"] and stats["attempts"] == 2
+    assert server.requests[PLANNING] == 2
+
+
+def test_hedge_not_sent_when_first_attempt_is_fast(serve):
+    server = serve()
+    client = OpenRouterClient("fake-key", base_url=server.base_url, hedge=True, hedge_default_delay=0.5)
+
+    assert isinstance(plan(client), dict)
+    time.sleep(0.6)
+    assert not client.last_call_stats["hedged"]
+    assert server.requests[PLANNING] == 1
+
+
+def test_queued_hedge_is_cancelled_when_first_attempt_wins(serve):
+    server = serve(**{PLANNING: [{"delay": 0.3}]})
+    client = OpenRouterClient("fake-key", base_url=server.base_url, hedge=True, hedge_default_delay=0.1)
+    # Один поток в пуле: дублирующая попытка ждёт, пока первая не ответит, и запрос уже не шлёт
+    client.hedge_pool.shutdown()
+    client.hedge_pool = openrouter_client.ThreadPoolExecutor(max_workers=1)
+
+    assert isinstance(plan(client), dict)
+    client.hedge_pool.shutdown(wait=True)
+    assert client.last_call_stats["hedged"]
+    assert client.last_call_stats["attempts"] == 1
+    assert server.requests[PLANNING] == 1
@@ -0,0 +1,6 @@
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов без токенизатора: для русского текста
+    у BPE-моделей выходит примерно 3 символа на токен."""
+    if not text:
+        return 0
+    return len(text) // 3 + 1
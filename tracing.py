@@ -0,0 +1,320 @@
+"""Трассировка хода: спаны по этапам с атрибутами, экспорт в JSONL и Prometheus.
+
+    with tracer.span("chroma.search", k=10) as span:
+        ...
+        span.set("results", len(filtered))
+
+Текущий спан хранится в contextvars, поэтому вложенность собирается сама.
+В пулы и потоки контекст не переходит — функцию для них оборачивает
+tracer.bind(fn). Когда закрывается корневой спан, весь трейс отдаётся
+подписчикам (панель таймингов в окне).
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACE_PATH = "traces.jsonl"
+METRICS_PORT = 9464
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span():
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "started", "duration", "attrs", "error", "thread")
+
+    def __init__(self, name, parent=None, attrs=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:8]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.attrs = dict(attrs or {})
+        self.error = None
+        self.thread = threading.current_thread().name
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def update(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round((self.duration or 0.0) * 1000, 3),
+            "thread": self.thread,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+class _NullSpan():
+    """Заглушка для кода вне трейса, чтобы span.set() не требовал проверок."""
+
+    def set(self, key, value):
+        pass
+
+    def update(self, **attrs):
+        pass
+
+
+class Tracer():
+    def __init__(self):
+        self.exporters = []
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.open_traces = defaultdict(list)  # trace_id → закрытые спаны, пока жив корень
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def add_listener(self, listener):
+        """listener(spans) — список dict всех спанов трейса после закрытия корня."""
+        self.listeners.append(listener)
+
+    def current(self):
+        return _current_span.get()
+
+    def span(self, name, **attrs):
+        return _SpanScope(self, name, attrs)
+
+    def bind(self, fn):
+        """Обёртка для запуска fn в другом потоке внутри текущего спана."""
+        context = contextvars.copy_context()
+
+        @functools.wraps(fn)
+        def bound(*args, **kwargs):
+            return context.copy().run(fn, *args, **kwargs)
+        return bound
+
+    def _finish(self, span):
+        record = span.to_dict()
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception as e:
+                print(f"[Tracing] Ошибка экспорта: {e}")
+
+        if span.parent_id is not None:
+            with self.lock:
+                if span.trace_id in self.open_traces:
+                    self.open_traces[span.trace_id].append(record)
+            return
+
+        with self.lock:
+            spans = self.open_traces.pop(span.trace_id, [])
+        spans.append(record)
+        spans.sort(key=lambda s: s["start"])
+        for listener in self.listeners:
+            try:
+                listener(spans)
+            except Exception as e:
+                print(f"[Tracing] Ошибка подписчика: {e}")
+
+
+class _SpanScope():
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span = None
+        self.token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span = Span(self.name, parent, self.attrs)
+        if parent is None:
+            with self.tracer.lock:
+                self.tracer.open_traces[self.span.trace_id] = []
+        self.token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.duration = time.perf_counter() - self.span.started
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.tracer._finish(self.span)
+        return False
+
+
+def traced(name, **attrs):
+    """Декоратор: весь вызов функции — один спан."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with tracer.span(name, **attrs):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def current_span():
+    return _current_span.get() or _NullSpan()
+
+
+class JsonlExporter():
+    """Спаны построчно в JSONL; при превышении max_bytes файл ротируется
+    (traces.jsonl → traces.jsonl.1 → ... → .backups)."""
+
+    def __init__(self, path: str = TRACE_PATH, max_bytes: int = 5 * 2**20, backups: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+
+    def export(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            if os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class PrometheusExporter():
+    """Агрегаты спанов в текстовом формате Prometheus на http://host:port/metrics:
+    гистограмма длительностей, ошибки, токены (атрибуты *_tokens) и попадания
+    в кэш (атрибут cache_hit)."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}                 # span → [счётчики по бакетам, count, sum]
+        self.errors = defaultdict(int)
+        self.tokens = defaultdict(int)      # (span, kind) → сумма
+        self.cache = defaultdict(int)       # (span, hit) → число
+        self.server = None
+
+    def export(self, record):
+        name = record["name"]
+        seconds = record["duration_ms"] / 1000
+        with self.lock:
+            buckets, count, total = self.durations.get(name, ([0] * len(self.BUCKETS), 0, 0.0))
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+            self.durations[name] = (buckets, count + 1, total + seconds)
+            if record["error"]:
+                self.errors[name] += 1
+            for key, value in record["attrs"].items():
+                if key.endswith("_tokens") and isinstance(value, (int, float)):
+                    self.tokens[(name, key[:-len("_tokens")])] += value
+                elif key == "cache_hit" and isinstance(value, bool):
+                    self.cache[(name, "true" if value else "false")] += 1
+
+    def render(self) -> str:
+        lines = [
+            "# HELP aurora_span_duration_seconds Длительность этапов хода.",
+            "# TYPE aurora_span_duration_seconds histogram",
+        ]
+        with self.lock:
+            for name, (buckets, count, total) in sorted(self.durations.items()):
+                for bound, value in zip(self.BUCKETS, buckets):
+                    lines.append(f'aurora_span_duration_seconds_bucket{{span="{name}",le="{bound}"}} {value}')
+                lines.append(f'aurora_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+                lines.append(f'aurora_span_duration_seconds_count{{span="{name}"}} {count}')
+                lines.append(f'aurora_span_duration_seconds_sum{{span="{name}"}} {total:.6f}')
+            lines += ["# HELP aurora_span_errors_total Спаны, завершившиеся исключением.",
+                      "# TYPE aurora_span_errors_total counter"]
+            lines += [f'aurora_span_errors_total{{span="{name}"}} {n}' for name, n in sorted(self.errors.items())]
+            lines += ["# HELP aurora_tokens_total Токены LLM по этапам.",
+                      "# TYPE aurora_tokens_total counter"]
+            lines += [f'aurora_tokens_total{{span="{name}",kind="{kind}"}} {n}'
+                      for (name, kind), n in sorted(self.tokens.items())]
+            lines += ["# HELP aurora_cache_lookups_total Обращения к кэшам по исходу.",
+                      "# TYPE aurora_cache_lookups_total counter"]
+            lines += [f'aurora_cache_lookups_total{{span="{name}",hit="{hit}"}} {n}'
+                      for (name, hit), n in sorted(self.cache.items())]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = METRICS_PORT, host: str = "127.0.0.1"):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                data = exporter.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        print(f"[Tracing] Метрики: http://{host}:{port}/metrics")
+        return self
+
+
+def configure_tracing(path: str = None, metrics_port: int = None):
+    """Подключает экспортёры глобального tracer: AURORA_TRACE_PATH (пусто — без файла),
+    AURORA_METRICS_PORT (0 — без эндпоинта)."""
+    path = os.getenv("AURORA_TRACE_PATH", TRACE_PATH) if path is None else path
+    if metrics_port is None:
+        metrics_port = int(os.getenv("AURORA_METRICS_PORT", str(METRICS_PORT)))
+    if path:
+        tracer.add_exporter(JsonlExporter(path))
+    if metrics_port:
+        prometheus = PrometheusExporter()
+        try:
+            prometheus.serve(metrics_port)
+            tracer.add_exporter(prometheus)
+        except OSError as e:
+            print(f"[Tracing] Эндпоинт метрик не поднят: {e}")
+    return tracer
+
+
+def format_waterfall(spans: list, width: int = 40) -> str:
+    """Текстовый водопад трейса: отступ по вложенности, полоса по времени."""
+    if not spans:
+        return ""
+    root = next((s for s in spans if s["parent_id"] is None), spans[0])
+    total = max(root["duration_ms"], 1e-3)
+    depth = {root["span_id"]: 0}
+    by_id = {s["span_id"]: s for s in spans}
+
+    def level(span):
+        if span["span_id"] not in depth:
+            parent = by_id.get(span["parent_id"])
+            depth[span["span_id"]] = level(parent) + 1 if parent else 1
+        return depth[span["span_id"]]
+
+    lines = [f"{time.strftime('%H:%M:%S', time.localtime(root['start']))}  {root['name']}  {total / 1000:.2f} с"]
+    for span in sorted(spans, key=lambda s: s["start"]):
+        offset = int((span["start"] - root["start"]) * 1000 / total * width)
+        length = max(1, int(span["duration_ms"] / total * width))
+        offset = min(max(offset, 0), width - 1)
+        bar = (" " * offset + "█" * length)[:width]
+        label = ("  " * level(span) + span["name"])[:26]
+        mark = " ✗" if span["error"] else ""
+        lines.append(f"{label:<26} │{bar:<{width}}│ {span['duration_ms']:8.1f} мс{mark}")
+    return "\n".join(lines)
+
+
+tracer = Tracer()
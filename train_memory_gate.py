@@ -0,0 +1,72 @@
+"""Обучение и оценка MemoryGate по логу решений фазы 1 (phase1_log.jsonl).
+
+Эмбеддинги — той же модели и того же движка, что у поиска в рантайме
+(AURORA_EMBEDDING_ENGINE или --engine), через общий EmbeddingCache.
+
+    python train_memory_gate.py [--log phase1_log.jsonl] [--out memory_gate.npz] [--engine onnx]
+"""
+import argparse
+import random
+
+import numpy as np
+
+from chroma_mem import EMBEDDING_ENGINE, load_embedding_model
+from embedding_cache import EmbeddingCache
+from memory_gate import MemoryGate, SEED_EXAMPLES, FLAGS, GATE_PATH, PHASE1_LOG_PATH, load_phase1_log
+
+
+def evaluate(gate, embeddings, examples, thresholds):
+    labels = np.array([[req, new] for _, req, new in examples], dtype=bool)
+    predictions = [gate.predict_embedding(e) for e in embeddings]
+
+    for i, flag in enumerate(FLAGS):
+        correct = sum(p[flag][0] == labels[j, i] for j, p in enumerate(predictions))
+        print(f"  {flag}: точность {correct / len(examples):.3f}")
+
+    # Пропуск фазы 1 безопасен, только если LLM тоже сказала бы (False, False)
+    truly_empty = ~labels.any(axis=1)
+    for threshold in thresholds:
+        skipped = np.array([
+            all(not v and c >= threshold for v, c in p.values()) for p in predictions
+        ])
+        n_skipped = int(skipped.sum())
+        precision = float(truly_empty[skipped].mean()) if n_skipped else float("nan")
+        print(f"  порог {threshold:.2f}: пропущено {n_skipped}/{len(examples)} "
+              f"({n_skipped / len(examples):.1%}), точность пропуска {precision:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log", default=PHASE1_LOG_PATH)
+    parser.add_argument("--out", default=GATE_PATH)
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--engine", choices=["torch", "onnx"], default=EMBEDDING_ENGINE)
+    args = parser.parse_args()
+
+    logged = load_phase1_log(args.log)
+    print(f"Решений фазы 1 в логе: {len(logged)}")
+    examples = SEED_EXAMPLES + logged
+
+    model, model_key = load_embedding_model(args.engine)
+    gate = MemoryGate(EmbeddingCache(model, model_key), path=args.out)
+    embeddings = gate.encode([text for text, _, _ in examples])
+
+    order = list(range(len(examples)))
+    random.Random(args.seed).shuffle(order)
+    n_eval = int(len(order) * args.holdout)
+    eval_idx, train_idx = order[:n_eval], order[n_eval:]
+
+    if eval_idx:
+        gate.fit([examples[i] for i in train_idx], embeddings[train_idx])
+        print(f"Оценка на {len(eval_idx)} отложенных примерах:")
+        evaluate(gate, embeddings[eval_idx], [examples[i] for i in eval_idx], (0.7, 0.8, 0.9, 0.95))
+
+    gate.fit(examples, embeddings)
+    if gate.centroids:
+        gate.save(args.out)
+        print(f"Гейт сохранён: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
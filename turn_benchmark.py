@@ -0,0 +1,254 @@
+"""Офлайн-бенчмарк хода: без ключей API, Mongo, GPU и окна.
+
+Настоящие MemoryAgent, ChromaHandler, HistoryManager, prompt_builder и
+OpenRouterClient работают против FakeOpenAIServer (задержки по схемам),
+mongomock вместо Mongo и временного каталога под Chroma и кэш эмбеддингов.
+По каждой фазе (phase1, search, phase2, final, prompt_build и ход целиком)
+считаются p50/p95/p99; базовая линия сохраняется в JSON и сравнивается.
+
+    python turn_benchmark.py --turns 200 --save benchmarks/baseline.json
+    python turn_benchmark.py --turns 200 --compare benchmarks/baseline.json --latency planning=0.3,final=1.0
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import numpy as np
+
+from fake_openai_server import FakeOpenAIServer, parse_latency
+from openrouter_schemas import AURORA_SCHEMA
+from prompt_builder import build_final_messages
+from tokens import estimate_tokens
+
+PHASES = ["phase1", "search", "phase2", "prompt_build", "final", "turn"]
+QUANTILES = {"p50": 50, "p95": 95, "p99": 99}
+
+SEED_SUBJECTS = ["кофе", "бег по утрам", "японский язык", "научную фантастику", "RTX 3060", "Python",
+                 "поездку в Казань", "гитару", "шахматы", "сериалы про космос", "кошку Мусю", "работу в студии"]
+SEED_TEMPLATES = [
+    ("Любит {}", "preferences", "medium"),
+    ("Хочет освоить {}", "goals", "medium"),
+    ("Каждый день думает про {}", "habits", "high"),
+    ("Планирует на выходных {}", "planned_events", "low"),
+    ("Обещал рассказать про {}", "promises", "low"),
+]
+REQUESTS = [
+    "Привет! Как дела?", "Что ты помнишь про мои привычки?", "Я сегодня опять пробежал пять километров",
+    "Посоветуй что-нибудь почитать", "Помнишь, я говорил про поездку?", "Я начал учить японский",
+    "Мне грустно сегодня", "Какая у меня видеокарта?", "Расскажи что-нибудь интересное",
+    "Я бросил пить кофе", "Что посмотреть вечером?", "Спасибо, ты лучшая",
+]
+
+
+def seed_records(n: int) -> list:
+    records = []
+    for i in range(n):
+        template, category, importance = SEED_TEMPLATES[i % len(SEED_TEMPLATES)]
+        subject = SEED_SUBJECTS[(i // len(SEED_TEMPLATES)) % len(SEED_SUBJECTS)]
+        records.append({"text": f"{template.format(subject)} (запись {i})", "category": category, "importance": importance})
+    return records
+
+
+class BenchmarkEnvironment():
+    """Временный каталог, mongomock и фейковый сервер; компоненты — настоящие."""
+
+    def __init__(self, latency: dict = None, jitter: float = 0.1, memories: int = 500, engine: str = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.memories = memories
+        self.engine = engine
+        self.workdir = None
+        self.previous_cwd = None
+
+    def __enter__(self):
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("Для бенчмарка нужен mongomock: pip install mongomock")
+        import database_handler
+        from chroma_mem import ChromaHandler, EMBEDDING_ENGINE
+        from database_handler import DatabaseHandler
+        from history_manager import HistoryManager
+        from memory_agent import MemoryAgent
+        from openrouter_client import OpenRouterClient
+
+        # Chroma, кэш эмбеддингов и логи пишут по относительным путям — уводим их во временный каталог
+        self.previous_cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp(prefix="aurora-bench-")
+        os.chdir(self.workdir)
+        database_handler.MongoClient = mongomock.MongoClient
+
+        self.server = FakeOpenAIServer(latency=self.latency, jitter=self.jitter).start()
+        self.client = OpenRouterClient("fake-key", base_url=self.server.base_url)
+        self.mongodb = DatabaseHandler(user_id="bench", persona="aurora")
+        self.chroma = ChromaHandler(self.engine or EMBEDDING_ENGINE)
+        self.history = HistoryManager(self.mongodb, self.client)
+        self.agent = MemoryAgent(self.client, self.chroma, history=self.history)
+
+        records = seed_records(self.memories)
+        for start in range(0, len(records), 256):
+            self.chroma.add_records(records[start:start + 256])
+        return self
+
+    def __exit__(self, *exc):
+        self.server.stop()
+        os.chdir(self.previous_cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def run_turn(env: BenchmarkEnvironment, user_request: str) -> dict:
+    """Ход как в TurnWorker.run_turn, но последовательно и с замером фаз."""
+    timings = {}
+    turn_started = time.perf_counter()
+
+    def timed(stage, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings[stage] = time.perf_counter() - started
+
+    env.mongodb.add_record(env.mongodb.phrases, {
+        "role": "user", "content": user_request, "timestamp": datetime.now(),
+        "tokens": estimate_tokens(user_request)
+    })
+    dialogue_history = env.history.window("final", env.history.load_recent())
+
+    planning = timed("phase1", env.agent.activate_memory_agent_phase1, user_request, dialogue_history)
+    planning = planning if isinstance(planning, dict) else {}
+
+    # Поиск в приложении идёт параллельно с фазой 1; здесь он замеряется отдельно
+    # и отдаётся фазе 2 готовым, как предзагруженный
+    search_future = Future()
+    search_future.set_result(timed("search", env.chroma.search_memory, user_request))
+
+    relevant_memories = []
+    if planning.get("requires_memory") or planning.get("is_new_info"):
+        relevant_memories = timed(
+            "phase2", env.agent.activate_memory_agent_phase2,
+            user_request, dialogue_history, planning, prefetched_search=(user_request, search_future)
+        )
+
+    messages = timed(
+        "prompt_build", build_final_messages,
+        user_request, relevant_memories, dialogue_history,
+        critical_prefs=env.chroma.get_critical_memories(),
+        last_msg_time=None,
+        summary=env.history.get_summary_text()
+    )
+    response = timed(
+        "final", env.client.chat_completion,
+        "openai/gpt-oss-20b:free", messages, schema=AURORA_SCHEMA, stream=True, phase="final"
+    )
+
+    answer = response.get("final_answer", "") if isinstance(response, dict) else str(response)
+    env.mongodb.add_record(env.mongodb.phrases, {
+        "role": "assistant", "content": answer, "timestamp": datetime.now(), "tokens": estimate_tokens(answer)
+    })
+    timings["turn"] = time.perf_counter() - turn_started
+    return timings
+
+
+def summarize(samples: dict) -> dict:
+    """{фаза: [секунды]} → {фаза: {count, mean, p50, p95, p99}} в миллисекундах."""
+    summary = {}
+    for phase in PHASES:
+        values = np.asarray(samples.get(phase, []), dtype=np.float64) * 1000
+        if not len(values):
+            continue
+        summary[phase] = {"count": int(len(values)), "mean": round(float(values.mean()), 2)}
+        for name, q in QUANTILES.items():
+            summary[phase][name] = round(float(np.percentile(values, q)), 2)
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"\n{'фаза':<14}{'n':>6}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}   (мс)")
+    for phase, stats in summary.items():
+        print(f"{phase:<14}{stats['count']:>6}{stats['mean']:>10.1f}{stats['p50']:>10.1f}"
+              f"{stats['p95']:>10.1f}{stats['p99']:>10.1f}")
+
+
+def compare(summary: dict, baseline: dict, tolerance: float = 0.15, min_delta_ms: float = 5.0) -> list:
+    """Регрессии: квантиль вырос больше чем на tolerance и больше чем на min_delta_ms."""
+    regressions = []
+    for phase, stats in summary.items():
+        base = baseline.get("phases", {}).get(phase)
+        if not base:
+            continue
+        for name in QUANTILES:
+            current, previous = stats[name], base.get(name)
+            if previous is None:
+                continue
+            delta = current - previous
+            marker = ""
+            if delta > min_delta_ms and current > previous * (1 + tolerance):
+                regressions.append((phase, name, previous, current))
+                marker = "  ← регрессия"
+            print(f"  {phase:<14}{name:>4}: {previous:9.1f} → {current:9.1f} мс ({delta:+.1f}){marker}")
+    return regressions
+
+
+def run_benchmark(turns: int, warmup: int, latency: dict, jitter: float, memories: int, engine: str = None) -> dict:
+    samples = {phase: [] for phase in PHASES}
+    with BenchmarkEnvironment(latency, jitter, memories, engine) as env:
+        for i in range(warmup + turns):
+            timings = run_turn(env, REQUESTS[i % len(REQUESTS)])
+            if i >= warmup:
+                for phase, seconds in timings.items():
+                    samples[phase].append(seconds)
+        requests = dict(env.server.requests)
+        latency = env.server.latency
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "config": {"turns": turns, "warmup": warmup, "memories": memories, "latency": latency,
+                   "jitter": jitter, "engine": engine, "python": platform.python_version(),
+                   "machine": platform.machine()},
+        "requests": requests,
+        "phases": summarize(samples),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--memories", type=int, default=500, help="записей в Chroma перед прогоном")
+    parser.add_argument("--latency", default="", help="задержки фейкового сервера: planning=0.3,memory=0.5,final=1.2")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--engine", default=None, help="torch или onnx (по умолчанию AURORA_EMBEDDING_ENGINE)")
+    parser.add_argument("--save", help="сохранить результат как базовую линию")
+    parser.add_argument("--compare", help="сравнить с сохранённой базовой линией")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    result = run_benchmark(args.turns, args.warmup, parse_latency(args.latency), args.jitter, args.memories, args.engine)
+    print_summary(result["phases"])
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n[Bench] Базовая линия сохранена: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n[Bench] Сравнение с {args.compare} ({baseline.get('created')}):")
+        regressions = compare(result["phases"], baseline, args.tolerance)
+        if regressions:
+            print(f"[Bench] Регрессий: {len(regressions)}")
+            sys.exit(1)
+        print("[Bench] Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""Запись ходов для воспроизведения: входы и выходы каждого этапа.
+
+Ход пишется одной строкой JSONL: окно истории, краткое содержание, время,
+критические границы, решение фазы 1, результаты поиска, каждый вызов LLM
+(фаза, схема, сообщения, сырой JSON ответа) и итоговый ответ. Длинные
+тексты (статические промпты, повторяющиеся реплики) выносятся в отдельные
+строки-блобы по sha1 и дальше идут ссылками — файл растёт в основном на
+динамическую часть хода. Путь с .gz пишется сжатым.
+
+Запись включается AURORA_RECORD_TURNS=путь; клиент и Chroma оборачиваются
+в RecordingClient / RecordingChroma, TurnWorker открывает recorder.turn().
+Воспроизведение — turn_replay.py.
+"""
+import contextvars
+import gzip
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+RECORD_PATH = "turn_records.jsonl"
+RECORD_VERSION = 1
+# Тексты длиннее этого выносятся в блобы
+BLOB_MIN_CHARS = 200
+
+_current_record = contextvars.ContextVar("current_turn_record", default=None)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return str(value)  # ObjectId и прочее — строкой
+
+
+def _json_hook(obj):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def clean_history(records: list) -> list:
+    """Окно истории без служебных полей Mongo — только то, что влияет на промпты."""
+    keep = ("role", "content", "timestamp", "tokens")
+    return [{k: r[k] for k in keep if k in r} for r in records]
+
+
+def messages_digest(messages: list) -> str:
+    """Отпечаток промпта для сверки при воспроизведении."""
+    data = json.dumps(messages, ensure_ascii=False, sort_keys=True, default=_json_default)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def record(key: str, value):
+    """Записать значение в текущий ход (вне записи — ничего не делает)."""
+    current = _current_record.get()
+    if current is not None:
+        current[key] = value
+
+
+class TurnRecorder():
+    def __init__(self, path: str = RECORD_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.blobs = set()  # уже записанные в файл блобы
+        self.turns = 0
+        self._load_blob_ids()
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load_blob_ids(self):
+        # При дозаписи в существующий файл блобы не дублируются
+        if not os.path.exists(self.path):
+            return
+        with self._open("r") as f:
+            for line in f:
+                if line.startswith('{"blob"'):
+                    self.blobs.add(json.loads(line)["blob"])
+
+    @contextmanager
+    def turn(self, user_request: str):
+        current = {"v": RECORD_VERSION, "ts": datetime.now(), "request": user_request, "llm": [], "search": []}
+        token = _current_record.set(current)
+        try:
+            yield current
+        except Exception as e:
+            current["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_record.reset(token)
+            self.write(current)
+
+    def write(self, turn: dict):
+        lines = []
+        with self.lock:
+            compact = self._compact(turn, lines)
+            lines.append(json.dumps({"turn": compact}, ensure_ascii=False, default=_json_default))
+            with self._open("a") as f:
+                f.write("\n".join(lines) + "\n")
+            self.turns += 1
+
+    def _compact(self, value, lines):
+        """Длинные строки → {"$ref": sha1}, блоб пишется один раз."""
+        if isinstance(value, str) and len(value) >= BLOB_MIN_CHARS:
+            blob_id = hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+            if blob_id not in self.blobs:
+                self.blobs.add(blob_id)
+                lines.append(json.dumps({"blob": blob_id, "text": value}, ensure_ascii=False))
+            return {"$ref": blob_id}
+        if isinstance(value, dict):
+            return {k: self._compact(v, lines) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._compact(v, lines) for v in value]
+        return value
+
+
+def load_turns(path: str):
+    """Ходы из файла записи с развёрнутыми блобами, в порядке записи."""
+    opener = gzip.open if path.endswith(".gz") else open
+    blobs, turns = {}, []
+
+    def expand(value):
+        if isinstance(value, dict):
+            if len(value) == 1 and "$ref" in value:
+                return blobs[value["$ref"]]
+            return {k: expand(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [expand(v) for v in value]
+        return value
+
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line, object_hook=_json_hook)
+            if "blob" in entry:
+                blobs[entry["blob"]] = entry["text"]
+            elif "turn" in entry:
+                turns.append(expand(entry["turn"]))
+    return turns
+
+
+class RecordingClient():
+    """Прокси OpenRouterClient: каждый вызов попадает в текущую запись хода."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def chat_completion(self, model, messages, schema=None, stream=False, on_delta=None,
+                        stream_field="final_answer", phase="default"):
+        response = self._client.chat_completion(model, messages, schema=schema, stream=stream, on_delta=on_delta,
+                                                stream_field=stream_field, phase=phase)
+        current = _current_record.get()
+        if current is not None:
+            current["llm"].append({
+                "phase": phase,
+                "model": model,
+                "schema": (schema or {}).get("json_schema", {}).get("name"),
+                "stream": stream,
+                "digest": messages_digest(messages),
+                "messages": messages,
+                "response": response,
+            })
+        return response
+
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+
+class RecordingChroma():
+    """Прокси ChromaHandler: запоминает результаты поиска и критические границы."""
+
+    def __init__(self, chroma):
+        self._chroma = chroma
+
+    def search_memory(self, query, *args, **kwargs):
+        results = self._chroma.search_memory(query, *args, **kwargs)
+        current = _current_record.get()
+        if current is not None:
+            current["search"].append({
+                "query": query,
+                "include_archive": kwargs.get("include_archive", False),
+                "results": results,
+            })
+        return results
+
+    def get_critical_memories(self, *args, **kwargs):
+        critical = self._chroma.get_critical_memories(*args, **kwargs)
+        record("critical", critical)
+        return critical
+
+    def __getattr__(self, attr):
+        return getattr(self._chroma, attr)
+
+
+class _NullRecorder():
+    @contextmanager
+    def turn(self, user_request):
+        yield None
+
+
+recorder = _NullRecorder()
+
+
+def configure_recording(path: str = None):
+    """Включает запись ходов, если задан путь (или AURORA_RECORD_TURNS)."""
+    global recorder
+    path = path or os.getenv("AURORA_RECORD_TURNS")
+    if path:
+        recorder = TurnRecorder(path)
+        print(f"[Recorder] Ходы записываются в {path}")
+    return bool(path)
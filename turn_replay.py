@@ -0,0 +1,235 @@
+"""Детерминированное воспроизведение записанных ходов без сети.
+
+Записанные ответы LLM и результаты поиска подаются обратно в настоящие
+MemoryAgent, HistoryManager.window и build_final_messages; промпт каждого
+вызова сверяется с записанным по отпечатку. Так ловятся регрессии сборки
+промптов и профилируется локальная часть хода на тысячах ходов подряд.
+
+    python turn_replay.py turn_records.jsonl
+    python turn_replay.py turn_records.jsonl --repeat 20 --profile
+    python turn_replay.py turn_records.jsonl --strict --show-diffs 3
+"""
+import argparse
+import contextlib
+import difflib
+import io
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from openrouter_schemas import AURORA_SCHEMA
+from prompt_builder import build_final_messages
+from turn_recorder import load_turns, messages_digest
+
+EMPTY_WRITE_REPORT = {"added": [], "merged": [], "skipped": []}
+
+
+class ReplayClient():
+    """Вместо OpenRouterClient: отдаёт записанные ответы по фазам по порядку."""
+
+    def __init__(self):
+        self.turn = None
+        self.calls = {}
+        self.mismatches = []
+        self.missing = []
+
+    def load(self, index, turn):
+        self.index = index
+        self.turn = turn
+        self.calls = {}
+        for call in turn.get("llm", []):
+            self.calls.setdefault(call["phase"], deque()).append(call)
+
+    def chat_completion(self, model, messages, schema=None, stream=False, on_delta=None,
+                        stream_field="final_answer", phase="default"):
+        queue = self.calls.get(phase)
+        if not queue:
+            # Фаза 1 (или единый вызов) могла быть решена гейтом или кэшем — тогда вызова нет, есть решение
+            if phase in ("planning", "combined") and self.turn.get("planning") is not None:
+                return self.turn["planning"]
+            self.missing.append((self.index, phase))
+            return f"Ошибка API: нет записанного ответа для фазы {phase}"
+
+        call = queue.popleft()
+        if messages_digest(messages) != call["digest"]:
+            self.mismatches.append((self.index, phase, call["messages"], messages))
+        response = call["response"]
+        if stream and on_delta and isinstance(response, dict):
+            on_delta(response.get(stream_field, ""))
+        return response
+
+    def prompt_cache_report(self):
+        return {}
+
+
+class ReplayChroma():
+    """Вместо ChromaHandler: записанные результаты поиска, записи в память — без эффекта."""
+
+    def __init__(self):
+        self.turn = None
+        self.results = {}
+
+    def load(self, turn):
+        self.turn = turn
+        self.results = {}
+        for search in turn.get("search", []):
+            self.results.setdefault(search["query"], search["results"])
+
+    def search_memory(self, query, *args, **kwargs):
+        return self.results.get(query, [])
+
+    def get_critical_memories(self, *args, **kwargs):
+        return self.turn.get("critical") or []
+
+    def accept_search_results(self, results):
+        pass
+
+    def add_records(self, records, *args, **kwargs):
+        return EMPTY_WRITE_REPORT
+
+    def upsert_records(self, records, *args, **kwargs):
+        return EMPTY_WRITE_REPORT
+
+    def add_change_listener(self, listener):
+        pass
+
+
+def replay_turn(agent, client, chroma, index, turn, timings):
+    """Один ход по шагам TurnWorker.run_turn; возвращает список расхождений."""
+    client.load(index, turn)
+    chroma.load(turn)
+    user_request = turn["request"]
+    history = turn.get("history") or []
+    problems = []
+
+    def timed(stage, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            timings.setdefault(stage, []).append(time.perf_counter() - started)
+
+    search_future = Future()
+    search_future.set_result(chroma.search_memory(user_request))
+    relevant_memories = []
+    if turn.get("agent_mode") == "single_call":
+        _, relevant_memories = timed(
+            "combined", agent.activate_memory_agent_combined,
+            user_request, history, prefetched_search=(user_request, search_future)
+        )
+    else:
+        planning = timed("phase1", agent.activate_memory_agent_phase1, user_request, history)
+        planning = planning if isinstance(planning, dict) else {}
+        if planning.get("requires_memory") or planning.get("is_new_info"):
+            relevant_memories = timed(
+                "phase2", agent.activate_memory_agent_phase2,
+                user_request, history, planning, prefetched_search=(user_request, search_future)
+            )
+    if "relevant_memories" in turn and relevant_memories != turn["relevant_memories"]:
+        problems.append("relevant_memories")
+
+    messages = timed(
+        "prompt_build", build_final_messages,
+        user_request, relevant_memories, history,
+        critical_prefs=turn.get("critical"),
+        last_msg_time=turn.get("last_msg_time"),
+        now=turn.get("now"),
+        summary=turn.get("summary")
+    )
+    response = timed(
+        "final", client.chat_completion,
+        "openai/gpt-oss-20b:free", messages, schema=AURORA_SCHEMA, stream=True, phase="final"
+    )
+    if "final" in turn and response != turn["final"]:
+        problems.append("final")
+    return problems
+
+
+def print_diff(index, phase, recorded, replayed, max_lines=30):
+    print(f"\n--- ход {index}, фаза {phase}: промпт отличается от записанного")
+    for i, (old, new) in enumerate(zip(recorded, replayed)):
+        if old != new:
+            diff = difflib.unified_diff(
+                str(old.get("content", "")).splitlines(), str(new.get("content", "")).splitlines(),
+                f"записано[{i}]", f"сейчас[{i}]", lineterm="", n=1
+            )
+            print("\n".join(list(diff)[:max_lines]))
+            return
+    print(f"  число сообщений: записано {len(recorded)}, сейчас {len(replayed)}")
+
+
+def run_replay(turns, repeat: int = 1, quiet: bool = True):
+    from history_manager import HistoryManager
+    from memory_agent import MemoryAgent
+
+    client, chroma = ReplayClient(), ReplayChroma()
+    # Без Mongo: у записанной истории уже есть tokens, обращаться к базе не нужно
+    agent = MemoryAgent(client, chroma, history=HistoryManager(None), log_decisions=False)
+
+    timings, problems = {}, []
+    sink = open(os.devnull, "w", encoding="utf-8") if quiet else None
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sink) if quiet else contextlib.nullcontext():
+        for _ in range(repeat):
+            for index, turn in enumerate(turns):
+                turn_started = time.perf_counter()
+                for problem in replay_turn(agent, client, chroma, index, turn, timings):
+                    problems.append((index, problem))
+                timings.setdefault("turn", []).append(time.perf_counter() - turn_started)
+    elapsed = time.perf_counter() - started
+    if sink:
+        sink.close()
+    return {"elapsed": elapsed, "timings": timings, "problems": problems,
+            "mismatches": client.mismatches, "missing": client.missing}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="файл записи ходов (AURORA_RECORD_TURNS)")
+    parser.add_argument("--repeat", type=int, default=1, help="прогнать запись несколько раз подряд")
+    parser.add_argument("--limit", type=int, default=None, help="только первые N ходов")
+    parser.add_argument("--profile", action="store_true", help="cProfile, топ функций по суммарному времени")
+    parser.add_argument("--show-diffs", type=int, default=3, help="сколько расхождений промптов показать")
+    parser.add_argument("--strict", action="store_true", help="код выхода 1 при любом расхождении")
+    parser.add_argument("--verbose", action="store_true", help="не глушить вывод компонентов")
+    args = parser.parse_args()
+
+    turns = load_turns(args.path)[:args.limit]
+    print(f"[Replay] Ходов в записи: {len(turns)}, повторов: {args.repeat}")
+
+    if args.profile:
+        import cProfile
+        import pstats
+
+        profiler = cProfile.Profile()
+        result = profiler.runcall(run_replay, turns, args.repeat, not args.verbose)
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+        print(stream.getvalue())
+    else:
+        result = run_replay(turns, args.repeat, not args.verbose)
+
+    total = len(turns) * args.repeat
+    print(f"[Replay] {total} ходов за {result['elapsed']:.2f} с — {total / max(result['elapsed'], 1e-9):.0f} ходов/с")
+    print(f"{'этап':<14}{'n':>8}{'p50':>10}{'p95':>10}{'p99':>10}   (мкс)")
+    for phase in ("phase1", "phase2", "combined", "prompt_build", "final", "turn"):
+        values = np.asarray(result["timings"].get(phase, []), dtype=np.float64) * 1e6
+        if len(values):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            print(f"{phase:<14}{len(values):>8}{p50:>10.0f}{p95:>10.0f}{p99:>10.0f}")
+
+    mismatches, missing, problems = result["mismatches"], result["missing"], result["problems"]
+    print(f"[Replay] Промптов не совпало: {len(mismatches)}, нет записанного ответа: {len(missing)}, "
+          f"расхождений результата: {len(problems)}")
+    for index, phase, recorded, replayed in mismatches[:args.show_diffs]:
+        print_diff(index, phase, recorded, replayed)
+    if args.strict and (mismatches or missing or problems):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
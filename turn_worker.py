@@ -0,0 +1,206 @@
+from PySide6.QtCore import QObject, QRunnable, Signal
+import re
+from datetime import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from openrouter_schemas import AURORA_SCHEMA
+from prompt_builder import build_final_messages
+from tokens import estimate_tokens
+from tracing import tracer
+import turn_recorder
+from turn_recorder import record, clean_history
+
+
+class TurnSignals(QObject):
+    # Сигналы живут в GUI-потоке, воркер только эмитит их
+    stage = Signal(str)           # текущий этап хода
+    answer_delta = Signal(str)    # очередной кусок final_answer из стрима
+    answer = Signal(str, str)     # final_answer, mood
+    error = Signal(str)           # текст ошибки для чата
+    finished = Signal()
+
+
+class TurnWorker(QRunnable):
+    """Один ход диалога целиком: Mongo, MemoryAgent, финальный ответ, озвучка.
+
+    Выполняется в QThreadPool, с окном общается только через TurnSignals.
+    Независимые от фазы 1 чтения (критические границы, время, поиск по сырому
+    запросу) запускаются параллельно с ней в prefetch_pool.
+    """
+
+    prefetch_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix="turn-prefetch")
+
+    def __init__(self, user_request, client, mongodb, chroma_memory, memory_agent, audio_manager, history):
+        super().__init__()
+        self.user_request = user_request
+        self.history = history
+        self.client = client
+        self.mongodb = mongodb
+        self.chroma_memory = chroma_memory
+        self.memory_agent = memory_agent
+        self.audio_manager = audio_manager
+        self.signals = TurnSignals()
+
+    def run(self):
+        try:
+            with tracer.span("turn", request_chars=len(self.user_request)), \
+                    turn_recorder.recorder.turn(self.user_request):
+                self.run_turn()
+        except Exception as e:
+            print(f"❌ Ошибка хода: {e}")
+            self.signals.error.emit("Аврора: У меня техническая ошибка. Повтори позже.")
+        finally:
+            self.signals.stage.emit("")
+            self.signals.finished.emit()
+
+    def run_turn(self):
+        user_request = self.user_request
+
+        self.signals.stage.emit("Сохраняю сообщение...")
+        self.mongodb.add_record(
+            self.mongodb.phrases,
+            {"role": "user", "content": user_request, "timestamp": datetime.now(),
+             "tokens": estimate_tokens(user_request)}
+        )
+
+        # === ЛОГ ===
+        print(f"\n{'='*60}")
+        print(f"📨 НОВЫЙ ЗАПРОС")
+        print(f"{'='*60}")
+        print(f"📝 '{user_request}'")
+
+        # === ИСТОРИЯ: окно по токенам, старое свёрнуто в краткое содержание ===
+        dialogue_history = self.history.window("final", self.history.load_recent())
+        print(f"📌 История загружена: {len(dialogue_history)} сообщений")
+        record("history", clean_history(dialogue_history))
+
+        # === ПРЕДЗАГРУЗКА: всё, что не зависит от фазы 1, идёт параллельно с ней ===
+        critical_future = self.prefetch_pool.submit(tracer.bind(self.chroma_memory.get_critical_memories))
+        time_future = self.prefetch_pool.submit(tracer.bind(self.get_last_user_message_time))
+        search_future = self.prefetch_pool.submit(
+            tracer.bind(self.chroma_memory.search_memory), user_request, speculative=True
+        )
+        summary_future = self.prefetch_pool.submit(tracer.bind(self.history.get_summary_text))
+
+        record("agent_mode", self.memory_agent.mode)
+        if self.memory_agent.mode == "single_call":
+            # === ОДИН ВЫЗОВ: флаги, отбор найденного и действие с памятью сразу ===
+            self.signals.stage.emit("Аврора вспоминает...")
+            try:
+                planning_memory, relevant_memories = self.memory_agent.activate_memory_agent_combined(
+                    user_request, dialogue_history, prefetched_search=(user_request, search_future)
+                )
+                record("planning", planning_memory)
+            except Exception as e:
+                print(f"❌ Ошибка MemoryAgent (один вызов): {e}")
+                relevant_memories = []
+        else:
+            # === ФАЗА 1: Memory Agent — анализирует, нужно ли искать/сохранять ===
+            self.signals.stage.emit("Аврора вспоминает...")
+            try:
+                planning_memory = self.memory_agent.activate_memory_agent_phase1(user_request, dialogue_history)
+                record("planning", planning_memory)
+                requires_memory = planning_memory.get("requires_memory", False)
+                is_new_info = planning_memory.get("is_new_info", False)
+            except Exception as e:
+                print(f"❌ Ошибка MemoryAgent Phase1: {e}")
+                requires_memory = False
+                is_new_info = False
+
+            # === ФАЗА 2: Memory Agent — ищет, обновляет, возвращает контекст ===
+            relevant_memories = []
+            if requires_memory or is_new_info:
+                self.signals.stage.emit("Аврора листает память...")
+                relevant_memories = self.memory_agent.activate_memory_agent_phase2(
+                    user_request=user_request,
+                    dialogue_context=dialogue_history,
+                    first_step_response=planning_memory if isinstance(planning_memory, dict) else {},
+                    prefetched_search=(user_request, search_future)
+                )
+
+        # === ФАЗА ОТВЕТА: Один вызов модели ===
+        self.signals.stage.emit("Аврора думает...")
+        critical_prefs = critical_future.result()
+        last_msg_time = time_future.result()
+        summary = summary_future.result()
+        now = datetime.now()
+        record("relevant_memories", relevant_memories)
+        record("last_msg_time", last_msg_time)
+        record("summary", summary)
+        record("now", now)
+        with tracer.span("prompt.build") as span:
+            messages = build_final_messages(
+                user_request,
+                relevant_memories,
+                dialogue_history,
+                critical_prefs=critical_prefs,
+                last_msg_time=last_msg_time,
+                now=now,
+                summary=summary
+            )
+            span.update(messages=len(messages), prompt_tokens_estimate=sum(estimate_tokens(m["content"]) for m in messages))
+
+        print(messages)
+
+        print(f"\n🧠 → ЗАПРОС К МОДЕЛИ (ФИНАЛЬНЫЙ ОТВЕТ)")
+        try:
+            response = self.client.chat_completion(
+                model="openai/gpt-oss-20b:free",
+                messages=messages,
+                schema=AURORA_SCHEMA,
+                stream=True,
+                on_delta=self.signals.answer_delta.emit,
+                phase="final"
+            )
+        except Exception as e:
+            print(f"❌ ОШИБКА API: {e}")
+            self.signals.error.emit("Аврора: У меня техническая ошибка. Повтори позже.")
+            return
+
+        if isinstance(response, str) or "error" in response:
+            print(f"❌ ОШИБКА: {response}")
+            self.signals.error.emit("Аврора: Не могу ответить — ошибка.")
+            return
+
+        record("final", response)
+        print(f"\n🔍 ← ОТВЕТ МОДЕЛИ — СЫРОЙ JSON")
+        print(json.dumps(response, ensure_ascii=False, indent=2))
+
+        # === ВЫВОД ОТВЕТА ===
+        self.render_and_store(response)
+
+        # Выпавшее из окна сворачивается в фоне, к следующему ходу
+        self.prefetch_pool.submit(self.history.fold, dialogue_history)
+
+    def get_last_user_message_time(self):
+        recent = self.mongodb.get_n_records(self.mongodb.phrases, 5)
+        for msg in recent:
+            if msg.get("role") == "user" and "timestamp" in msg:
+                return msg["timestamp"]
+        return None
+
+    def render_and_store(self, aurora_answer: dict):
+        # Очистка ответа от <think> тегов
+        final_answer = re.sub(
+            r'<think>.*?</think>', '', aurora_answer.get("final_answer", ""), flags=re.DOTALL
+        ).strip() or "…"
+        mood = aurora_answer.get("mood", "neutral")
+
+        # Текст и настроение показываем сразу, озвучка идёт следом в этом же потоке
+        self.signals.answer.emit(final_answer, mood)
+
+        # Сохранение в БД
+        self.mongodb.add_record(
+            self.mongodb.phrases,
+            {
+                "role": "assistant",
+                "content": final_answer,
+                "mood": mood,
+                "timestamp": datetime.now(),
+                "tokens": estimate_tokens(final_answer)
+            }
+        )
+
+        self.signals.stage.emit("Аврора говорит...")
+        self.audio_manager.speak(final_answer)